@@ -1,5 +1,6 @@
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload, selectinload
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
 from flask_migrate import Migrate
@@ -23,7 +24,101 @@ jwt = JWTManager(app)
 CORS(app)
 
 # Import models after db initialization
-from models import User, Case, Judgment, Document, Category, Court
+from models import User, Case, Judgment, Document, Category, Court, NORMALIZED_COLUMNS
+from utils.search_index import InvertedIndex, TrigramIndex, get_search_index, get_trigram_index
+from utils.search_indexer import SearchIndexer
+from utils.search_query import SearchQuery, QueryParseError, filter_ids
+from utils.similarity_index import get_similarity_index
+from utils.spelling import get_spelling_corrector
+from utils.near_duplicates import JudgmentDeduplicator
+from utils.pagination import CursorError, keyset_paginate, ranked_paginate
+from utils.autocomplete import AutocompleteIndex
+from utils.counting import get_row_counter
+from utils.stats_rollup import get_stats_rollup
+from utils.query_profiler import QueryProfiler
+from utils.text_processing import ArabicTextProcessor, SnippetBuilder
+
+# Keep the search tables in sync with every committed write
+search_indexer = SearchIndexer(app.config.get('SEARCH_INDEX_PATH'))
+search_indexer.register()
+
+# Type-ahead over names, adjusted by the same committed writes
+autocomplete_index = AutocompleteIndex(app.config.get('AUTOCOMPLETE_MAX_AGE'))
+autocomplete_index.register()
+row_counter = get_row_counter(app.config.get('COUNT_CACHE_TTL', 30), app.config.get('COUNT_SCAN_BUDGET', 10000))
+stats_rollup = get_stats_rollup()
+
+# Per-request SQL counts and timings, and the slow-query log
+query_profiler = QueryProfiler(
+    slow_threshold=app.config.get('SLOW_QUERY_THRESHOLD', 1.0),
+    log_file=app.config.get('SLOW_QUERY_LOG'),
+    max_bytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+    backup_count=app.config.get('LOG_BACKUP_COUNT', 5),
+    explain=app.config.get('QUERY_PROFILING_EXPLAIN', False)
+)
+if app.config.get('ENABLE_QUERY_PROFILING'):
+    query_profiler.init_app(app)
+
+def search_index():
+    """Get the persistent full-text index configured for this app"""
+    return get_search_index(app.config.get('SEARCH_INDEX_PATH'))
+
+def trigram_index():
+    """Get the trigram index used for partial identifier lookup"""
+    return get_trigram_index(app.config.get('SEARCH_INDEX_PATH'))
+
+def similarity_index():
+    """Get the precomputed judgment vector index"""
+    return get_similarity_index(app.config.get('SIMILARITY_INDEX_PATH'))
+
+def spelling_corrector():
+    """Get the "did you mean" corrector over the search index vocabulary"""
+    return get_spelling_corrector(app.config.get('SEARCH_INDEX_PATH'))
+
+def fragment_condition(model, field, fragment):
+    """SQL substring condition for fragments too short for trigrams"""
+    # Matched anywhere in the normalized column, as the trigram index matches longer fragments
+    shadow = NORMALIZED_COLUMNS.get(model, {}).get(field)
+    if shadow:
+        return getattr(model, shadow).contains(normalize_arabic_text(fragment))
+    return getattr(model, field).contains(fragment)
+
+def ranked_hits(model, resource_type, search, query, limit, visible=None):
+    """Top hits of a parsed search query, ranked by BM25 relevance; visible limits the rows the user may see"""
+    try:
+        plan = search.execute(model, resource_type, search_index(), trigram_index())
+    except QueryParseError:
+        # The query uses a field this resource type does not have
+        return []
+    
+    if search.is_simple:
+        scores = plan.scores or {}
+        if resource_type in TrigramIndex.INDEXED_FIELDS:
+            # Fragments of case numbers, party and judge names count as much as the best text hit
+            TrigramIndex.boost(scores, trigram_index().search(resource_type, query) or ())
+        clause = visible
+    elif plan.ids is None:
+        # Matching is left to SQL (exclusions, OR over field clauses): newest first
+        rows = plan.filter(model.query)
+        if visible is not None:
+            rows = rows.filter(visible)
+        # Documents record their upload time instead of a creation time
+        newest = model.created_at if hasattr(model, 'created_at') else model.uploaded_at
+        return rows.order_by(newest.desc()).limit(limit).all()
+    else:
+        scores = plan.scores
+        clause = plan.clause
+        if visible is not None:
+            clause = visible if clause is None else clause & visible
+    
+    if clause is not None:
+        # Filters are checked on the best hits only, a bounded chunk of ids at a time
+        top_ids, _ = filter_ids(model.query.filter(clause), model.id, InvertedIndex.ranked(scores), limit)
+        top_ids = top_ids[:limit]
+    else:
+        top_ids = InvertedIndex.top_k(scores, limit)
+    rows = {row.id: row for row in model.query.filter(model.id.in_(top_ids)).all()} if top_ids else {}
+    return [rows[resource_id] for resource_id in top_ids if resource_id in rows]
 
 # Arabic text processing helper functions
 def process_arabic_text(text):
@@ -35,21 +130,8 @@ def process_arabic_text(text):
     return bidi_text
 
 def normalize_arabic_text(text):
-    """Normalize Arabic text for search"""
-    if not text:
-        return ""
-    # Remove diacritics and normalize characters
-    normalizations = {
-        'أ': 'ا', 'إ': 'ا', 'آ': 'ا',
-        'ة': 'ه',
-        'ى': 'ي'
-    }
-    
-    normalized = text
-    for old, new in normalizations.items():
-        normalized = normalized.replace(old, new)
-    
-    return normalized.strip()
+    """Normalize Arabic text for search, matching the stored *_norm columns"""
+    return ArabicTextProcessor.normalize_arabic(text)
 
 # Authentication Routes
 @app.route('/api/auth/register', methods=['POST'])
@@ -148,6 +230,7 @@ def get_cases():
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
+        cursor = request.args.get('cursor')  # present (even empty) selects keyset pagination
         search = request.args.get('search', '')
         category_id = request.args.get('category_id', type=int)
         status = request.args.get('status')
@@ -156,14 +239,42 @@ def get_cases():
         # Build query
         query = Case.query
         
-        # Apply filters
+        # What narrowed the query, as the key of its cached total
+        filters = {'search': search, 'category_id': category_id, 'status': status, 'court_id': court_id}
+        
+        # Apply filters; index hits stay ids in Python and are never sent whole to SQL
+        scores = None
         if search:
-            normalized_search = normalize_arabic_text(search)
-            query = query.filter(
-                Case.title.contains(search) |
-                Case.description.contains(search) |
-                Case.case_number.contains(search)
-            )
+            # Words are matched on the inverted index instead of scanning the text columns
+            try:
+                search_query = SearchQuery.parse(search)
+                plan = search_query.execute(Case, 'case', search_index(), trigram_index())
+            except QueryParseError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            query = plan.filter(query)
+            scores = plan.scores
+            
+            if search_query.is_simple:
+                # Partial case numbers are ranked with the text hits, as in the global search
+                case_numbers = trigram_index().search('case', search, fields=['case_number'])
+                if case_numbers is not None:
+                    scores = TrigramIndex.boost(scores or {}, case_numbers)
+                elif scores is None:
+                    query = query.filter(fragment_condition(Case, 'case_number', search))
+        
+        # Partial case numbers and party names
+        for field in TrigramIndex.INDEXED_FIELDS['case']:
+            fragment = request.args.get(field)
+            if fragment:
+                filters[field] = fragment
+                matched_ids = trigram_index().search('case', fragment, fields=[field])
+                if matched_ids is None:
+                    query = query.filter(fragment_condition(Case, field, fragment))
+                elif scores is None:
+                    scores = dict.fromkeys(matched_ids, 0.0)
+                else:
+                    scores = {case_id: score for case_id, score in scores.items() if case_id in matched_ids}
         
         if category_id:
             query = query.filter(Case.category_id == category_id)
@@ -174,15 +285,36 @@ def get_cases():
         if court_id:
             query = query.filter(Case.court_id == court_id)
         
-        # Order by creation date
-        query = query.order_by(Case.created_at.desc())
+        # Category and court come with each row instead of one query apiece
+        query = query.options(joinedload(Case.category), joinedload(Case.court))
+        
+        if scores is not None:
+            # Order by relevance; filters are checked on the best hits a bounded chunk at a time
+            cases = ranked_paginate(Case, query, scores, page, per_page,
+                                    filtered=query.whereclause is not None, cursor=cursor)
+        elif cursor is not None:
+            # Seek past the last (created_at, id) seen: deep pages cost the same as the first
+            cases = keyset_paginate(query, Case.created_at, Case.id, cursor, per_page, 'case.created_at')
+        else:
+            # Order by creation date
+            query = query.order_by(Case.created_at.desc())
+            
+            # Paginate; the total comes from a counter or a cached, capped count
+            cases = row_counter.paginate(Case, query, page, per_page, filters)
         
-        # Paginate
-        cases = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        if cursor is not None:
+            pagination = cases.to_dict()
+        else:
+            pagination = {
+                'page': cases.page,
+                'pages': cases.pages,
+                'per_page': cases.per_page,
+                'total': cases.total,
+                'total_exact': cases.exact,
+                'total_display': cases.total_display,
+                'has_next': cases.has_next,
+                'has_prev': cases.has_prev
+            }
         
         return jsonify({
             'cases': [{
@@ -202,18 +334,13 @@ def get_cases():
                     'id': case.court.id,
                     'name': case.court.name
                 } if case.court else None,
-                'judgment_count': len(case.judgments)
+                'judgment_count': case.judgment_count
             } for case in cases.items],
-            'pagination': {
-                'page': cases.page,
-                'pages': cases.pages,
-                'per_page': cases.per_page,
-                'total': cases.total,
-                'has_next': cases.has_next,
-                'has_prev': cases.has_prev
-            }
+            'pagination': pagination
         }), 200
         
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'حدث خطأ في جلب القضايا'}), 500
 
@@ -273,7 +400,12 @@ def create_case():
 def get_case_details(case_id):
     """Get detailed information about a specific case"""
     try:
-        case = Case.query.get_or_404(case_id)
+        case = Case.query.options(
+            joinedload(Case.category),
+            joinedload(Case.court),
+            selectinload(Case.judgments),
+            selectinload(Case.documents)
+        ).filter(Case.id == case_id).first_or_404()
         
         return jsonify({
             'case': {
@@ -318,6 +450,76 @@ def get_case_details(case_id):
         return jsonify({'error': 'حدث خطأ في جلب تفاصيل القضية'}), 500
 
 # Judgment Routes
+@app.route('/api/judgments', methods=['GET'])
+@jwt_required()
+def get_judgments():
+    """Get list of judgments, newest judgment date first"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+        cursor = request.args.get('cursor')  # present (even empty) selects keyset pagination
+        case_id = request.args.get('case_id', type=int)
+        judgment_type = request.args.get('judgment_type')
+        status = request.args.get('status')
+        court_id = request.args.get('court_id', type=int)
+        
+        query = Judgment.query
+        
+        if case_id:
+            query = query.filter(Judgment.case_id == case_id)
+        
+        if judgment_type:
+            query = query.filter(Judgment.judgment_type == judgment_type)
+        
+        if status:
+            query = query.filter(Judgment.status == status)
+        
+        if court_id:
+            query = query.filter(Judgment.court_id == court_id)
+        
+        if cursor is not None:
+            # Seek past the last (judgment_date, id) seen; undated judgments come last
+            judgments = keyset_paginate(query, Judgment.judgment_date, Judgment.id, cursor, per_page,
+                                        'judgment.judgment_date', nullable=True)
+            pagination = judgments.to_dict()
+        else:
+            judgments = row_counter.paginate(
+                Judgment,
+                query.order_by(Judgment.judgment_date.desc(), Judgment.id.desc()),
+                page,
+                per_page,
+                {'case_id': case_id, 'judgment_type': judgment_type, 'status': status, 'court_id': court_id}
+            )
+            pagination = {
+                'page': judgments.page,
+                'pages': judgments.pages,
+                'per_page': judgments.per_page,
+                'total': judgments.total,
+                'total_exact': judgments.exact,
+                'total_display': judgments.total_display,
+                'has_next': judgments.has_next,
+                'has_prev': judgments.has_prev
+            }
+        
+        return jsonify({
+            'judgments': [{
+                'id': judgment.id,
+                'title': judgment.title,
+                'judgment_type': judgment.judgment_type,
+                'judgment_date': judgment.judgment_date.isoformat() if judgment.judgment_date else None,
+                'judge_name': judgment.judge_name,
+                'status': judgment.status,
+                'case_id': judgment.case_id,
+                'court_id': judgment.court_id
+            } for judgment in judgments.items],
+            'pagination': pagination
+        }), 200
+    
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'حدث خطأ في جلب الأحكام'}), 500
+
 @app.route('/api/judgments', methods=['POST'])
 @jwt_required()
 def create_judgment():
@@ -332,6 +534,27 @@ def create_judgment():
             if not data.get(field):
                 return jsonify({'error': f'حقل {field} مطلوب'}), 400
         
+        # Overlapping uploads resend the same text: merge near-exact copies in the same case, flag the rest
+        signature = JudgmentDeduplicator.signature(data['content'])
+        match = JudgmentDeduplicator.find(db.session, signature)
+        existing = JudgmentDeduplicator.merge_target(db.session, match, data['case_id'])
+        if existing is not None:
+            JudgmentDeduplicator.merge_into(existing, data)
+            db.session.commit()
+            
+            return jsonify({
+                'message': 'الحكم موجود مسبقاً وتم دمجه مع الحكم القائم',
+                'merged': True,
+                'similarity': round(match[1], 3),
+                'judgment': {
+                    'id': existing.id,
+                    'title': existing.title,
+                    'judgment_type': existing.judgment_type,
+                    'judgment_date': existing.judgment_date.isoformat() if existing.judgment_date else None,
+                    'status': existing.status
+                }
+            }), 200
+        
         # Create new judgment
         judgment = Judgment(
             case_id=data['case_id'],
@@ -344,7 +567,9 @@ def create_judgment():
             status=data.get('status', 'نهائي'),
             appeal_status=data.get('appeal_status'),
             notes=data.get('notes'),
-            created_by=current_user_id
+            created_by=current_user_id,
+            minhash=JudgmentDeduplicator.hasher.to_bytes(signature) if signature else None,
+            duplicate_of_id=match[0] if match else None
         )
         
         db.session.add(judgment)
@@ -357,13 +582,44 @@ def create_judgment():
                 'title': judgment.title,
                 'judgment_type': judgment.judgment_type,
                 'judgment_date': judgment.judgment_date.isoformat(),
-                'status': judgment.status
+                'status': judgment.status,
+                'duplicate_of': judgment.duplicate_of_id
             }
         }), 201
         
     except Exception as e:
         return jsonify({'error': 'حدث خطأ في إنشاء الحكم'}), 500
 
+@app.route('/api/judgments/<int:judgment_id>/similar', methods=['GET'])
+@jwt_required()
+def get_similar_judgments(judgment_id):
+    """Get judgments with similar content and cited articles"""
+    try:
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        
+        matches = similarity_index().similar(judgment_id, limit)
+        if matches is None:
+            return jsonify({'error': 'فهرس الأحكام المتشابهة غير متوفر'}), 503
+        
+        # Only the matched rows are loaded, in similarity order
+        scores = dict(matches)
+        rows = {judgment.id: judgment for judgment in Judgment.query.filter(Judgment.id.in_(list(scores))).all()} if scores else {}
+        
+        return jsonify({
+            'judgment_id': judgment_id,
+            'similar': [{
+                'id': judgment.id,
+                'title': judgment.title,
+                'judgment_type': judgment.judgment_type,
+                'judgment_date': judgment.judgment_date.isoformat() if judgment.judgment_date else None,
+                'case_id': judgment.case_id,
+                'score': round(scores[judgment.id], 4)
+            } for judgment in (rows[resource_id] for resource_id, _ in matches if resource_id in rows)]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'حدث خطأ في جلب الأحكام المتشابهة'}), 500
+
 # Category and Court Management
 @app.route('/api/categories', methods=['GET'])
 @jwt_required()
@@ -376,7 +632,7 @@ def get_categories():
                 'id': cat.id,
                 'name': cat.name,
                 'description': cat.description,
-                'case_count': len(cat.cases)
+                'case_count': cat.case_count
             } for cat in categories]
         }), 200
     except Exception as e:
@@ -394,7 +650,8 @@ def get_courts():
                 'name': court.name,
                 'location': court.location,
                 'court_type': court.court_type,
-                'case_count': len(court.cases)
+                'case_count': court.case_count,
+                'judgment_count': court.judgment_count
             } for court in courts]
         }), 200
     except Exception as e:
@@ -407,54 +664,108 @@ def search_system():
     """Advanced search across cases and judgments"""
     try:
         query = request.args.get('q', '')
-        search_type = request.args.get('type', 'all')  # all, cases, judgments
+        search_type = request.args.get('type', 'all')  # all, cases, judgments, documents
         
         if not query:
             return jsonify({'error': 'استعلام البحث مطلوب'}), 400
         
-        normalized_query = normalize_arabic_text(query)
-        results = {'cases': [], 'judgments': []}
+        try:
+            search = SearchQuery.parse(query)
+        except QueryParseError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        results = {'cases': [], 'judgments': [], 'documents': []}
+        limit = 10
+        
+        # Previews are the best-matching window of each text, not its opening
+        snippets = SnippetBuilder.for_texts(search.ranking_texts(), length=200)
         
         if search_type in ['all', 'cases']:
-            # Search cases
-            cases = Case.query.filter(
-                Case.title.contains(query) |
-                Case.description.contains(query) |
-                Case.case_number.contains(query) |
-                Case.plaintiff.contains(query) |
-                Case.defendant.contains(query)
-            ).limit(10).all()
+            # Search cases, ranked by BM25 relevance; only the top hits are loaded
+            cases = ranked_hits(Case, 'case', search, query, limit)
             
             results['cases'] = [{
                 'id': case.id,
                 'case_number': case.case_number,
                 'title': case.title,
-                'description': case.description[:200] + '...' if len(case.description) > 200 else case.description,
+                'snippet': snippets.snippet(case.description),
                 'type': 'case'
             } for case in cases]
         
         if search_type in ['all', 'judgments']:
-            # Search judgments
-            judgments = Judgment.query.filter(
-                Judgment.title.contains(query) |
-                Judgment.content.contains(query) |
-                Judgment.judge_name.contains(query)
-            ).limit(10).all()
+            # Search judgments, ranked by BM25 relevance
+            judgments = ranked_hits(Judgment, 'judgment', search, query, limit)
             
             results['judgments'] = [{
                 'id': judgment.id,
                 'title': judgment.title,
-                'content': judgment.content[:200] + '...' if len(judgment.content) > 200 else judgment.content,
+                'snippet': snippets.snippet(judgment.content),
                 'judgment_type': judgment.judgment_type,
                 'case_id': judgment.case_id,
                 'type': 'judgment'
             } for judgment in judgments]
         
+        if search_type in ['all', 'documents']:
+            # Confidential documents are only found by their uploader and by administrators
+            current_user_id = get_jwt_identity()
+            user = User.query.get(current_user_id)
+            visible = None
+            if not user or user.role != 'admin':
+                visible = Document.is_confidential.isnot(True) | (Document.uploaded_by == current_user_id)
+            
+            # Search documents, ranked by BM25 relevance
+            documents = ranked_hits(Document, 'document', search, query, limit, visible=visible)
+            
+            results['documents'] = [{
+                'id': document.id,
+                'original_filename': document.original_filename,
+                'document_type': document.document_type,
+                'case_id': document.case_id,
+                'type': 'document'
+            } for document in documents]
+        
+        # A query that found nothing gets a spelling suggestion instead of a blind retry
+        results['did_you_mean'] = None
+        if not any(results[key] for key in ('cases', 'judgments', 'documents')):
+            resource_types = [resource_type for resource_type, searched in (
+                ('case', search_type in ['all', 'cases']),
+                ('judgment', search_type in ['all', 'judgments']),
+                ('document', search_type in ['all', 'documents'])
+            ) if searched]
+            if resource_types:
+                results['did_you_mean'] = spelling_corrector().suggest(query, resource_types)
+        
         return jsonify(results), 200
         
     except Exception as e:
         return jsonify({'error': 'حدث خطأ في البحث'}), 500
 
+@app.route('/api/autocomplete', methods=['GET'])
+@jwt_required()
+def autocomplete():
+    """Suggest party, judge, lawyer, court and law names for a typed prefix"""
+    try:
+        field = request.args.get('field', '')
+        prefix = request.args.get('prefix', '')
+        limit = request.args.get('limit', 10, type=int)
+        
+        if field not in AutocompleteIndex.FIELDS:
+            return jsonify({
+                'error': 'حقل الإكمال التلقائي غير صالح',
+                'fields': list(AutocompleteIndex.FIELDS)
+            }), 400
+        
+        suggestions = autocomplete_index.complete(db.session, field, prefix, limit)
+        
+        return jsonify({
+            'field': field,
+            'prefix': prefix,
+            'suggestions': [{'value': value, 'count': count} for value, count in suggestions]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'حدث خطأ في الإكمال التلقائي'}), 500
+
 # Statistics and Analytics
 @app.route('/api/stats', methods=['GET'])
 @jwt_required()
@@ -462,25 +773,17 @@ def get_statistics():
     """Get system statistics"""
     try:
         stats = {
-            'total_cases': Case.query.count(),
-            'total_judgments': Judgment.query.count(),
-            'total_documents': Document.query.count(),
+            'total_cases': row_counter.counters.count(db.session, Case),
+            'total_judgments': row_counter.counters.count(db.session, Judgment),
+            'total_documents': row_counter.counters.count(db.session, Document),
             'cases_by_status': {},
             'judgments_by_type': {},
             'recent_cases': []
         }
         
-        # Cases by status
-        status_counts = db.session.query(
-            Case.status, db.func.count(Case.id)
-        ).group_by(Case.status).all()
-        stats['cases_by_status'] = {status: count for status, count in status_counts}
-        
-        # Judgments by type
-        type_counts = db.session.query(
-            Judgment.judgment_type, db.func.count(Judgment.id)
-        ).group_by(Judgment.judgment_type).all()
-        stats['judgments_by_type'] = {j_type: count for j_type, count in type_counts}
+        # Breakdowns come from the pre-aggregated daily rollup, not the tables
+        stats['cases_by_status'] = stats_rollup.counts(db.session, 'case', 'status')
+        stats['judgments_by_type'] = stats_rollup.counts(db.session, 'judgment', 'judgment_type')
         
         # Recent cases (last 5)
         recent_cases = Case.query.order_by(Case.created_at.desc()).limit(5).all()
@@ -497,6 +800,21 @@ def get_statistics():
     except Exception as e:
         return jsonify({'error': 'حدث خطأ في جلب الإحصائيات'}), 500
 
+@app.route('/api/admin/query-stats', methods=['GET'])
+@jwt_required()
+def get_query_stats():
+    """Get query profiling summary: queries per request by endpoint, costliest statements, slow queries"""
+    try:
+        user = User.query.get(get_jwt_identity())
+        if not user or user.role != 'admin':
+            return jsonify({'error': 'هذه العملية متاحة للمسؤولين فقط'}), 403
+        
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        return jsonify(query_profiler.summary(limit)), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'حدث خطأ في جلب إحصائيات الاستعلامات'}), 500
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark for ArabicTextProcessor.normalize_arabic
+Compares the current normalizer with the previous regex/replace chain
+on multi-megabyte judgment-like texts and checks that the outputs are identical
+"""
+
+import argparse
+import random
+import re
+import sys
+import os
+import timeit
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.text_processing import ArabicTextProcessor
+
+SAMPLE_WORDS = [
+    'المحكمة', 'الابتدائية', 'حكمت', 'بإلزام', 'المدعى', 'عليه', 'بأداء', 'مبلغ',
+    'وقدره', 'الاستئناف', 'مُؤيَّد', 'القضائية', 'إلغاء', 'آثار', 'ٱلقرار', 'مسؤولية',
+    'هيئة', 'الدعوى', 'Article', 'CASE-2024', '١٢٣', 'رقم', 'قانون', 'المرافعات',
+]
+
+def legacy_normalize(text):
+    """The regex and chained str.replace normalizer this benchmark replaces"""
+    if not text:
+        return ""
+    text = text.lower()
+    text = ArabicTextProcessor.ARABIC_DIACRITICS.sub('', text)
+    for old, new in ArabicTextProcessor.NORMALIZE_MAP.items():
+        text = text.replace(old, new)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+def make_text(size_mb, seed=0):
+    """Build a judgment-like text of roughly the given size"""
+    rng = random.Random(seed)
+    separators = [' ', ' ', ' ', '  ', '\n', '\t', '، ']
+    parts = []
+    length = 0
+    target = int(size_mb * 1024 * 1024)
+    while length < target:
+        part = rng.choice(SAMPLE_WORDS) + rng.choice(separators)
+        parts.append(part)
+        length += len(part.encode('utf-8'))
+    return ''.join(parts)
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description='Benchmark Arabic normalization')
+    parser.add_argument('--size-mb', type=float, default=4.0, help='Size of each text in megabytes')
+    parser.add_argument('--texts', type=int, default=3, help='Number of texts per run')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions')
+    args = parser.parse_args()
+
+    texts = [make_text(args.size_mb, seed) for seed in range(args.texts)]
+
+    # Outputs must be identical before timings mean anything
+    for text in texts:
+        assert ArabicTextProcessor.normalize_arabic(text) == legacy_normalize(text)
+    assert list(ArabicTextProcessor.normalize_many(texts)) == [legacy_normalize(text) for text in texts]
+
+    timings = {
+        'legacy': lambda: [legacy_normalize(text) for text in texts],
+        'normalize_arabic': lambda: [ArabicTextProcessor.normalize_arabic(text) for text in texts],
+        'normalize_many': lambda: list(ArabicTextProcessor.normalize_many(texts)),
+    }
+
+    print(f"{args.texts} texts x {args.size_mb} MB, best of {args.repeat}")
+    results = {name: min(timeit.repeat(func, number=1, repeat=args.repeat)) for name, func in timings.items()}
+    for name, seconds in results.items():
+        speedup = results['legacy'] / seconds if seconds else float('inf')
+        print(f"  {name:<18} {seconds * 1000:9.1f} ms  {speedup:5.2f}x")
+
+if __name__ == '__main__':
+    main()
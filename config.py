@@ -50,6 +50,25 @@ class Config:
     # Elasticsearch configuration (for advanced search)
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL') or 'http://localhost:9200'
     
+    # Persistent inverted index for full-text search
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH') or 'search_index.db'
+    
+    # Judgment vectors for "similar judgments", built by database/build_similarity_index.py
+    SIMILARITY_INDEX_PATH = os.environ.get('SIMILARITY_INDEX_PATH') or 'similarity_index'
+    
+    # Seconds before the in-memory autocomplete indexes are rebuilt from the database
+    AUTOCOMPLETE_MAX_AGE = int(os.environ.get('AUTOCOMPLETE_MAX_AGE') or 3600)
+    
+    # Pagination totals: filtered counts are cached this many seconds and stop counting past the budget
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL') or 30)
+    COUNT_SCAN_BUDGET = int(os.environ.get('COUNT_SCAN_BUDGET') or 10000)
+    
+    # Performance monitoring: per-request query counts and a rotating slow-query log
+    ENABLE_QUERY_PROFILING = os.environ.get('ENABLE_QUERY_PROFILING', 'false').lower() in ['true', 'on', '1']
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD') or 1.0)  # seconds
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG') or 'slow_queries.log'
+    QUERY_PROFILING_EXPLAIN = os.environ.get('QUERY_PROFILING_EXPLAIN', 'false').lower() in ['true', 'on', '1']
+    
     # Security settings
     BCRYPT_LOG_ROUNDS = 12
     SESSION_COOKIE_SECURE = True
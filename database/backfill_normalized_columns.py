@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Add and backfill the normalized *_norm shadow columns on cases and judgments
+New writes fill them automatically; this covers rows written before they existed
+and drops the shadow columns of earlier versions that nothing reads any more
+"""
+
+import argparse
+import sys
+import os
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import and_, inspect, or_, text
+
+from app import app, db
+from models import NORMALIZED_COLUMNS
+from utils.text_processing import ArabicTextProcessor
+
+def ensure_columns(engine):
+    """Create missing shadow columns and their indexes"""
+    inspector = inspect(engine)
+
+    for model, columns in NORMALIZED_COLUMNS.items():
+        table = model.__table__
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+
+        with engine.begin() as conn:
+            for shadow in columns.values():
+                if shadow in existing:
+                    continue
+                column_type = table.c[shadow].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {shadow} {column_type}"))
+                print(f"  + {table.name}.{shadow}")
+
+        for index in table.indexes:
+            if any(column.name in columns.values() for column in index.columns):
+                index.create(bind=engine, checkfirst=True)
+
+# Shadow columns of earlier versions, by table
+OBSOLETE_COLUMNS = {
+    'cases': ('title_norm', 'description_norm'),
+    'judgments': ('title_norm', 'content_norm'),
+}
+
+def drop_obsolete_columns(engine):
+    """Drop obsolete shadow columns and their indexes"""
+    inspector = inspect(engine)
+
+    for table_name, columns in OBSOLETE_COLUMNS.items():
+        existing = {column['name'] for column in inspector.get_columns(table_name)}
+        indexes = inspector.get_indexes(table_name)
+
+        with engine.begin() as conn:
+            for column in columns:
+                if column not in existing:
+                    continue
+                for index in indexes:
+                    if column in index['column_names']:
+                        on_table = f" ON {table_name}" if engine.dialect.name == 'mysql' else ''
+                        conn.execute(text(f"DROP INDEX {index['name']}{on_table}"))
+                conn.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {column}"))
+                print(f"  - {table_name}.{column}")
+
+def backfill(model, columns, batch_size, recompute=False):
+    """Fill the shadow columns of a model in primary-key ordered batches"""
+    sources = [getattr(model, source) for source in columns]
+    missing = or_(*(and_(getattr(model, shadow).is_(None), getattr(model, source).isnot(None))
+                    for source, shadow in columns.items()))
+
+    total = 0
+    last_id = 0
+    while True:
+        query = db.session.query(model.id, *sources).filter(model.id > last_id)
+        if not recompute:
+            query = query.filter(missing)
+        rows = query.order_by(model.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        # Bulk mappings skip mapper events, so the search indexes are not rebuilt
+        normalized = ArabicTextProcessor.normalize_many(value for row in rows for value in row[1:])
+        db.session.bulk_update_mappings(model, [
+            dict({'id': row[0]}, **{
+                shadow: next(normalized) or None
+                for shadow in columns.values()
+            })
+            for row in rows
+        ])
+        db.session.commit()
+
+        total += len(rows)
+        last_id = rows[-1][0]
+        print(f"  {total} {model.__tablename__} rows normalized")
+
+    return total
+
+def main():
+    """Add and backfill the shadow columns"""
+    parser = argparse.ArgumentParser(description='Backfill normalized search columns')
+    parser.add_argument('--all', action='store_true',
+                        help='Recompute every row, e.g. after the normalization rules change')
+    args = parser.parse_args()
+
+    with app.app_context():
+        batch_size = app.config.get('BATCH_SIZE', 1000)
+
+        print("Checking shadow columns...")
+        ensure_columns(db.engine)
+        drop_obsolete_columns(db.engine)
+
+        for model, columns in NORMALIZED_COLUMNS.items():
+            print(f"Backfilling {model.__tablename__}...")
+            total = backfill(model, columns, batch_size, recompute=args.all)
+            print(f"✓ Normalized {total} {model.__tablename__} rows")
+
+    print("✓ Normalized columns are up to date")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Build the vector index behind /api/judgments/<id>/similar
+Vectorizes judgment content and cited articles offline; run it after bulk
+imports or on a schedule, the API picks up the new build automatically
+"""
+
+import argparse
+import sys
+import os
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import Judgment
+from utils.similarity_index import SimilarityIndex
+
+def iter_judgments(batch_size):
+    """Yield (id, text) for every judgment in primary-key ordered batches"""
+    last_id = 0
+    while True:
+        rows = db.session.query(Judgment.id, Judgment.content, Judgment.legal_articles)\
+                         .filter(Judgment.id > last_id)\
+                         .order_by(Judgment.id)\
+                         .limit(batch_size)\
+                         .all()
+        if not rows:
+            break
+
+        for judgment_id, content, legal_articles in rows:
+            yield judgment_id, '\n'.join(part for part in (content, legal_articles) if part)
+
+        last_id = rows[-1][0]
+        print(f"  read {last_id} ...", end='\r')
+
+def main():
+    """Vectorize all judgments and publish a new index build"""
+    parser = argparse.ArgumentParser(description='Build the similar-judgments vector index')
+    parser.add_argument('--components', type=int, default=SimilarityIndex.COMPONENTS,
+                        help='TruncatedSVD dimensions (0 keeps raw TF-IDF vectors)')
+    parser.add_argument('--tables', type=int, default=SimilarityIndex.TABLES,
+                        help='Random-projection hash tables (more tables: better recall, slower queries)')
+    parser.add_argument('--max-features', type=int, default=SimilarityIndex.MAX_FEATURES,
+                        help='Vocabulary size limit')
+    args = parser.parse_args()
+
+    with app.app_context():
+        index_path = app.config.get('SIMILARITY_INDEX_PATH')
+        batch_size = app.config.get('BATCH_SIZE', 1000)
+
+        print(f"Building similarity index in {index_path}...")
+        try:
+            meta = SimilarityIndex.build(
+                index_path,
+                iter_judgments(batch_size),
+                components=args.components,
+                tables=args.tables,
+                max_features=args.max_features
+            )
+        except ValueError as e:
+            # scikit-learn refuses an empty corpus or vocabulary
+            print(f"✗ Could not build the index: {e}")
+            sys.exit(1)
+
+    print(f"✓ Indexed {meta['count']} judgments: {meta['dimensions']} dimensions, "
+          f"{meta['tables']} tables x {meta['bits']} bits")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Check that list endpoints run the same number of SQL queries whatever the page size
+A count that grows with per_page means rows are loading relations one at a time (N+1)
+"""
+
+import argparse
+import sys
+import os
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+
+from app import app, db
+from models import User
+from utils.query_counter import assert_queries_constant
+
+ENDPOINTS = [
+    '/api/cases?per_page={size}',
+    '/api/cases?cursor=&per_page={size}',
+    '/api/judgments?per_page={size}',
+    '/api/judgments?cursor=&per_page={size}'
+]
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Fail if an endpoint\'s query count grows with page size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 50],
+                        help='Page sizes to compare (default: 5 50)')
+    return parser.parse_args()
+
+def main():
+    """Compare query counts across page sizes for each list endpoint"""
+    args = parse_args()
+    failures = 0
+
+    with app.app_context():
+        user = User.query.first()
+        if user is None:
+            print("✗ No users found; run database/init_db.py first")
+            sys.exit(1)
+
+        headers = {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+        client = app.test_client()
+
+        for endpoint in ENDPOINTS:
+            def fetch(size):
+                response = client.get(endpoint.format(size=size), headers=headers)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{endpoint} returned {response.status_code}')
+
+            try:
+                counts = assert_queries_constant(db.engine, fetch, args.sizes)
+                print(f"✓ {endpoint}: {counts}")
+            except (AssertionError, RuntimeError) as e:
+                failures += 1
+                print(f"✗ {endpoint}: {e}")
+
+    if failures:
+        sys.exit(1)
+    print("✓ Query counts do not depend on page size")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Find near-duplicate judgments in one streaming pass over the table
+Computes missing MinHash signatures, looks each batch up in the LSH band
+table and flags duplicates of earlier judgments; --delete removes the
+near-identical ones that belong to the same case as the judgment they copy
+"""
+
+import argparse
+import sys
+import os
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import bindparam, inspect, select, text
+from sqlalchemy.orm import aliased
+
+from app import app, db
+from models import Judgment, JudgmentMinHashBand, Document
+from utils.near_duplicates import JudgmentDeduplicator
+
+# SQLite accepts at most 999 bound parameters in older versions
+LOOKUP_CHUNK = 900
+
+def ensure_schema(engine):
+    """Add the signature columns and the band table to existing databases"""
+    inspector = inspect(engine)
+    table = Judgment.__table__
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+
+    with engine.begin() as conn:
+        for name in ('minhash', 'duplicate_of_id'):
+            if name not in existing:
+                column_type = table.c[name].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+                print(f"  + {table.name}.{name}")
+
+    for index in table.indexes:
+        if any(column.name == 'duplicate_of_id' for column in index.columns):
+            index.create(bind=engine, checkfirst=True)
+    JudgmentMinHashBand.__table__.create(bind=engine, checkfirst=True)
+
+def banded_candidates(connection, buckets):
+    """Judgment ids per bucket for the buckets already in the band table"""
+    found = {}
+    buckets = list(buckets)
+    for start in range(0, len(buckets), LOOKUP_CHUNK):
+        rows = connection.execute(
+            select(JudgmentMinHashBand.bucket, JudgmentMinHashBand.judgment_id)
+            .where(JudgmentMinHashBand.bucket.in_(buckets[start:start + LOOKUP_CHUNK]))
+        )
+        for bucket, judgment_id in rows:
+            found.setdefault(bucket, set()).add(judgment_id)
+    return found
+
+def stored_signatures(connection, judgment_ids):
+    """Signatures of banded judgments"""
+    signatures = {}
+    judgment_ids = list(judgment_ids)
+    for start in range(0, len(judgment_ids), LOOKUP_CHUNK):
+        rows = connection.execute(
+            select(Judgment.id, Judgment.minhash).where(Judgment.id.in_(judgment_ids[start:start + LOOKUP_CHUNK]))
+        )
+        for judgment_id, blob in rows:
+            signatures[judgment_id] = JudgmentDeduplicator.hasher.from_bytes(blob)
+    return signatures
+
+def deduplicate(batch_size, threshold, rescan=False):
+    """Stream judgments in id order; each one is compared only against earlier canonical judgments"""
+    hasher = JudgmentDeduplicator.hasher
+    table = Judgment.__table__
+    bands = JudgmentMinHashBand.__table__
+
+    if rescan:
+        with db.engine.begin() as conn:
+            conn.execute(bands.delete())
+            conn.execute(table.update().values(duplicate_of_id=None, updated_at=table.c.updated_at))
+
+    processed = flagged = 0
+    last_id = 0
+    while True:
+        query = db.session.query(Judgment.id, Judgment.content, Judgment.minhash, Judgment.updated_at)\
+                          .filter(Judgment.id > last_id)
+        if not rescan:
+            # Judgments with a signature were banded or flagged when they were written
+            query = query.filter(Judgment.minhash.is_(None))
+        rows = query.order_by(Judgment.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        signatures = {}
+        for judgment_id, content, blob, _ in rows:
+            signatures[judgment_id] = (hasher.from_bytes(blob) if blob and rescan else None) \
+                or JudgmentDeduplicator.signature(content)
+
+        keys = {judgment_id: hasher.band_keys(signature)
+                for judgment_id, signature in signatures.items() if signature}
+
+        connection = db.session.connection()
+        existing = banded_candidates(connection, {bucket for buckets in keys.values() for bucket in buckets})
+        known = stored_signatures(connection, {judgment_id for ids in existing.values() for judgment_id in ids})
+
+        updates, band_rows = [], []
+        for judgment_id, _, _, updated_at in rows:
+            signature = signatures[judgment_id]
+            duplicate_of = None
+
+            if signature:
+                # Earlier canonical rows from the table and from this batch
+                candidates = set()
+                for bucket in keys[judgment_id]:
+                    candidates.update(existing.get(bucket, ()))
+                best = 0.0
+                for candidate in candidates:
+                    score = hasher.similarity(signature, known.get(candidate))
+                    if score >= threshold and score > best:
+                        duplicate_of, best = candidate, score
+
+                if duplicate_of is None:
+                    # Canonical: later rows in this batch can match it too
+                    known[judgment_id] = signature
+                    for bucket in keys[judgment_id]:
+                        existing.setdefault(bucket, set()).add(judgment_id)
+                    band_rows.extend(JudgmentDeduplicator.band_rows(judgment_id, signature))
+                else:
+                    flagged += 1
+
+            updates.append({
+                'row_id': judgment_id,
+                'minhash': hasher.to_bytes(signature) if signature else None,
+                'duplicate_of_id': duplicate_of,
+                'kept_updated_at': updated_at,
+            })
+
+        # Core statements skip the mapper events: no reindexing, updated_at is kept as is
+        connection.execute(
+            table.update().where(table.c.id == bindparam('row_id')).values(
+                minhash=bindparam('minhash'),
+                duplicate_of_id=bindparam('duplicate_of_id'),
+                updated_at=bindparam('kept_updated_at')
+            ),
+            updates
+        )
+        if band_rows:
+            connection.execute(bands.insert(), band_rows)
+        db.session.commit()
+
+        processed += len(rows)
+        last_id = rows[-1][0]
+        print(f"  {processed} judgments scanned, {flagged} duplicates flagged", end='\r')
+
+    print()
+    return processed, flagged
+
+def delete_duplicates(batch_size):
+    """Delete flagged duplicates that are near-identical copies within the same case.
+
+    Only rows at or above MERGE_THRESHOLD whose kept judgment belongs to
+    the same case are deleted, after moving their documents to it. Other
+    flagged rows stay flagged through duplicate_of_id for review.
+    """
+    hasher = JudgmentDeduplicator.hasher
+    kept = aliased(Judgment)
+    deleted = kept_flagged = 0
+    last_id = 0
+    while True:
+        pairs = db.session.query(Judgment, kept.case_id, kept.minhash)\
+                          .join(kept, kept.id == Judgment.duplicate_of_id)\
+                          .filter(Judgment.id > last_id)\
+                          .order_by(Judgment.id).limit(batch_size).all()
+        if not pairs:
+            break
+        last_id = pairs[-1][0].id
+
+        for judgment, kept_case_id, kept_minhash in pairs:
+            score = hasher.similarity(hasher.from_bytes(judgment.minhash), hasher.from_bytes(kept_minhash))
+            if judgment.case_id is None or judgment.case_id != kept_case_id \
+                    or score < JudgmentDeduplicator.MERGE_THRESHOLD:
+                kept_flagged += 1
+                continue
+
+            Document.query.filter(Document.judgment_id == judgment.id)\
+                          .update({'judgment_id': judgment.duplicate_of_id}, synchronize_session=False)
+            db.session.delete(judgment)
+            deleted += 1
+
+        # Deleting through the session keeps the search indexes in sync
+        db.session.commit()
+        print(f"  {deleted} duplicates deleted, {kept_flagged} left flagged for review", end='\r')
+
+    print()
+    return deleted, kept_flagged
+
+def main():
+    """Flag, and optionally delete, near-duplicate judgments"""
+    parser = argparse.ArgumentParser(description='Deduplicate judgments with MinHash LSH')
+    parser.add_argument('--threshold', type=float, default=JudgmentDeduplicator.FLAG_THRESHOLD,
+                        help='Estimated Jaccard similarity at which a judgment is a duplicate')
+    parser.add_argument('--rescan', action='store_true',
+                        help='Clear all flags and bands and compare every judgment again')
+    parser.add_argument('--delete', action='store_true',
+                        help='Delete near-identical duplicates within the same case after moving their documents')
+    args = parser.parse_args()
+
+    with app.app_context():
+        batch_size = app.config.get('BATCH_SIZE', 1000)
+
+        print("Checking schema...")
+        ensure_schema(db.engine)
+
+        print("Scanning judgments...")
+        processed, flagged = deduplicate(batch_size, args.threshold, rescan=args.rescan)
+        print(f"✓ Scanned {processed} judgments, flagged {flagged} near-duplicates")
+
+        if args.delete:
+            deleted, kept_flagged = delete_duplicates(batch_size)
+            print(f"✓ Deleted {deleted} duplicates, left {kept_flagged} flagged for review")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rebuild the statistics rollup (stats_rollups) from the cases and judgments tables
+Writes through the ORM keep it current; this repairs it after bulk loads or raw SQL
+"""
+
+import argparse
+import sys
+import os
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, stats_rollup
+
+def main():
+    """Rebuild the rollup of each resource type"""
+    parser = argparse.ArgumentParser(description='Rebuild the pre-aggregated statistics')
+    parser.add_argument('--type', choices=sorted(stats_rollup.DIMENSIONS), action='append',
+                        help='Resource type to rebuild (repeatable, default: all)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+
+        for resource_type in args.type or list(stats_rollup.DIMENSIONS):
+            print(f"Rebuilding {resource_type} statistics...")
+            buckets = stats_rollup.rebuild(db.session, resource_type)
+            print(f"✓ {buckets} {resource_type} buckets")
+
+    print("✓ Statistics rollup is up to date")
+
+if __name__ == '__main__':
+    main()
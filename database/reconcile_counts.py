@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Add and recompute the denormalized child counts (case_count, judgment_count, document_count)
+Writes through the ORM keep them current; this repairs drift from bulk loads or raw SQL
+"""
+
+import argparse
+import sys
+import os
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, inspect, text
+
+from app import app, db, row_counter
+from models import CHILD_COUNTERS
+
+def parent_counters():
+    """Counters grouped by parent model: parent -> [(child model, foreign key, counter column)]"""
+    parents = {}
+    for child, counters in CHILD_COUNTERS.items():
+        for foreign_key, parent, counter in counters:
+            parents.setdefault(parent, []).append((child, foreign_key, counter))
+    return parents
+
+def ensure_columns(engine):
+    """Create missing counter columns, zero-filled"""
+    inspector = inspect(engine)
+
+    for parent, counters in parent_counters().items():
+        table = parent.__table__
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+
+        with engine.begin() as conn:
+            for _, _, counter in counters:
+                if counter in existing:
+                    continue
+                column_type = table.c[counter].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {counter} {column_type} NOT NULL DEFAULT 0"))
+                print(f"  + {table.name}.{counter}")
+
+def reconcile(parent, counters, batch_size, dry_run=False):
+    """Recount the counters of a parent model in primary-key ordered batches; returns rows changed"""
+    columns = [getattr(parent, counter) for _, _, counter in counters]
+
+    changed = 0
+    scanned = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(parent.id, *columns).filter(parent.id > last_id)\
+                         .order_by(parent.id).limit(batch_size).all()
+        if not rows:
+            break
+        first_id, last_id = rows[0][0], rows[-1][0]
+
+        # One grouped count per counter over the batch's id range
+        actual = {}
+        for child, foreign_key, counter in counters:
+            column = getattr(child, foreign_key)
+            grouped = db.session.query(column, func.count(child.id))\
+                                .filter(column.between(first_id, last_id))\
+                                .group_by(column)
+            actual[counter] = dict(grouped)
+
+        mappings = []
+        for row in rows:
+            values = {
+                counter: actual[counter].get(row[0], 0)
+                for _, _, counter in counters
+            }
+            if any(values[counter] != stored for (_, _, counter), stored in zip(counters, row[1:])):
+                mappings.append(dict(values, id=row[0]))
+
+        if mappings and not dry_run:
+            # Bulk mappings skip mapper events, so nothing else is recounted or reindexed
+            db.session.bulk_update_mappings(parent, mappings)
+            db.session.commit()
+        else:
+            db.session.rollback()
+
+        changed += len(mappings)
+        scanned += len(rows)
+        print(f"  {scanned} {parent.__tablename__} rows checked, {changed} off")
+
+    return changed
+
+def main():
+    """Add and recompute the child counts"""
+    parser = argparse.ArgumentParser(description='Recompute denormalized child counts')
+    parser.add_argument('--batch-size', type=int,
+                        help='Parent rows per batch (default: BATCH_SIZE setting)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Report drifted rows without fixing them')
+    args = parser.parse_args()
+
+    with app.app_context():
+        batch_size = args.batch_size or app.config.get('BATCH_SIZE', 1000)
+
+        print("Checking counter columns...")
+        ensure_columns(db.engine)
+
+        for parent, counters in parent_counters().items():
+            print(f"Recounting {parent.__tablename__}...")
+            changed = reconcile(parent, counters, batch_size, dry_run=args.dry_run)
+            verb = 'would be corrected' if args.dry_run else 'corrected'
+            print(f"✓ {changed} {parent.__tablename__} rows {verb}")
+
+        if not args.dry_run:
+            # The whole-table counters behind page totals drift the same way
+            for model in row_counter.counters.models().values():
+                total = row_counter.counters.reconcile(db.session, model)
+                print(f"✓ {model.__tablename__}: {total} rows")
+
+    print("✓ Counts are up to date")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bring the search tables up to date with the database
+Writes are indexed automatically on commit; this catches up rows changed
+after they were last indexed (indexing failed, or they were written outside
+the application), or rebuilds everything
+"""
+
+import argparse
+import sys
+import os
+from datetime import datetime
+
+# Add the parent directory to the path to import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect, text
+
+from app import app, db, search_indexer
+from models import Document
+
+def ensure_columns(engine):
+    """Add the documents change column to databases created before it existed"""
+    table = Document.__table__
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    if 'updated_at' in existing:
+        return
+
+    column_type = table.c.updated_at.type.compile(dialect=engine.dialect)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN updated_at {column_type}"))
+        conn.execute(text(f"UPDATE {table.name} SET updated_at = uploaded_at"))
+    print(f"  + {table.name}.updated_at")
+
+    for index in table.indexes:
+        if any(column.name == 'updated_at' for column in index.columns):
+            index.create(bind=engine, checkfirst=True)
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Reindex cases, judgments, documents and precedents')
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help='Reindex rows changed since this ISO date (default: rows changed since they were indexed)')
+    parser.add_argument('--full', action='store_true',
+                        help='Clear and rebuild the whole index')
+    parser.add_argument('--type', choices=sorted(search_indexer.models()), action='append',
+                        help='Resource type to reindex (repeatable, default: all)')
+    return parser.parse_args()
+
+def main():
+    """Reindex changed rows"""
+    args = parse_args()
+    resource_types = args.type or list(search_indexer.models())
+
+    with app.app_context():
+        print(f"Search index: {search_indexer.search_index.index_path}")
+
+        ensure_columns(db.engine)
+
+        for resource_type in resource_types:
+            if args.full:
+                search_indexer.clear(db.session, resource_type)
+                print(f"Indexing every {resource_type} row...")
+                total = search_indexer.reindex(db.session, resource_type)
+            elif args.since:
+                print(f"Indexing {resource_type} rows changed since {args.since.isoformat()}...")
+                total = search_indexer.reindex(db.session, resource_type, args.since)
+            else:
+                print(f"Indexing {resource_type} rows changed since they were last indexed...")
+                total = search_indexer.reindex(db.session, resource_type, stale=True)
+            print(f"✓ Indexed {total} {resource_type} rows")
+
+    print("✓ Search index is up to date")
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
 from datetime import datetime
 import uuid
 
+from utils.text_processing import ArabicTextProcessor
+from utils.near_duplicates import JudgmentDeduplicator
+
 db = SQLAlchemy()
 
 # User Model
@@ -38,6 +43,9 @@ class Category(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Maintained by CHILD_COUNTERS below; database/reconcile_counts.py recomputes them
+    case_count = db.Column(db.Integer, nullable=False, default=0)
+    
     # Self-referential relationship for subcategories
     children = db.relationship('Category', backref=db.backref('parent', remote_side=[id]))
     
@@ -59,6 +67,10 @@ class Court(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Maintained by CHILD_COUNTERS below; database/reconcile_counts.py recomputes them
+    case_count = db.Column(db.Integer, nullable=False, default=0)
+    judgment_count = db.Column(db.Integer, nullable=False, default=0)
+    
     # Relationships
     cases = db.relationship('Case', backref='court', lazy=True)
     judgments = db.relationship('Judgment', backref='court', lazy=True)
@@ -78,6 +90,10 @@ class Case(db.Model):
     case_date = db.Column(db.DateTime)
     filing_date = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Normalized shadow columns for name fragments too short for the trigram index
+    plaintiff_norm = db.Column(db.String(200), index=True)
+    defendant_norm = db.Column(db.String(200), index=True)
+    
     # Status and priority
     status = db.Column(db.String(50), default='جديدة')  # جديدة، قيد النظر، محكومة، مؤجلة، مغلقة
     priority = db.Column(db.String(20), default='متوسط')  # عاجل، عالي، متوسط، منخفض
@@ -93,8 +109,12 @@ class Case(db.Model):
     fees = db.Column(db.Decimal(10, 2))
     notes = db.Column(db.Text)
     
+    # Maintained by CHILD_COUNTERS below; database/reconcile_counts.py recomputes them
+    judgment_count = db.Column(db.Integer, nullable=False, default=0)
+    document_count = db.Column(db.Integer, nullable=False, default=0)
+    
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # keyset pagination key
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Foreign Keys
@@ -117,10 +137,17 @@ class Judgment(db.Model):
     
     # Judgment details
     judgment_type = db.Column(db.String(50), nullable=False)  # حكم، قرار، أمر
-    judgment_date = db.Column(db.DateTime)
+    judgment_date = db.Column(db.DateTime, index=True)  # keyset pagination key
     judge_name = db.Column(db.String(150))
     court_level = db.Column(db.String(50))  # ابتدائية، استئناف، نقض
     
+    # Normalized shadow columns for name fragments too short for the trigram index
+    judge_name_norm = db.Column(db.String(150), index=True)
+    
+    # Near-duplicate detection: MinHash of the content, and the judgment this one duplicates
+    minhash = db.Column(db.LargeBinary)
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('judgments.id', ondelete='SET NULL'), index=True)
+    
     # Status and appeal
     status = db.Column(db.String(50), default='نهائي')  # نهائي، قابل للاستئناف، مستأنف
     appeal_status = db.Column(db.String(50))  # لم يستأنف، مستأنف، مؤيد، منقوض
@@ -175,6 +202,7 @@ class Document(db.Model):
     
     # Timestamps
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_accessed = db.Column(db.DateTime)
     
     # Foreign Keys
@@ -344,3 +372,174 @@ class SearchIndex(db.Model):
         db.Index('idx_resource_type_id', 'resource_type', 'resource_id'),
         db.Index('idx_content_search', 'normalized_content'),
     )
+
+# MinHash LSH bands of canonical judgments, for sub-linear near-duplicate lookup
+class JudgmentMinHashBand(db.Model):
+    __tablename__ = 'judgment_minhash_bands'
+    
+    bucket = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    judgment_id = db.Column(db.Integer, db.ForeignKey('judgments.id'), primary_key=True,
+                            autoincrement=False, index=True)
+
+# Row counts of whole tables, kept current by the writing transactions
+class TableRowCount(db.Model):
+    __tablename__ = 'table_row_counts'
+    
+    table_name = db.Column(db.String(64), primary_key=True)
+    row_count = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Daily counts of cases and judgments per reporting dimension, behind the statistics endpoints
+class StatsRollup(db.Model):
+    __tablename__ = 'stats_rollups'
+    __table_args__ = (
+        db.Index('idx_stats_rollup_resource_day', 'resource_type', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.String(40), unique=True, nullable=False)  # digest of every column below
+    resource_type = db.Column(db.String(20), nullable=False)  # case, judgment
+    day = db.Column(db.Date)  # creation day
+    status = db.Column(db.String(100))
+    priority = db.Column(db.String(50))
+    judgment_type = db.Column(db.String(100))
+    category_id = db.Column(db.Integer)
+    court_id = db.Column(db.Integer)
+    row_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+# Normalized shadow columns and the columns they mirror
+NORMALIZED_COLUMNS = {
+    Case: {
+        'plaintiff': 'plaintiff_norm',
+        'defendant': 'defendant_norm',
+    },
+    Judgment: {
+        'judge_name': 'judge_name_norm',
+    },
+}
+
+def fill_normalized_columns(mapper, connection, target):
+    """Refresh the normalized shadow columns whose source column changed"""
+    state = inspect(target)
+    for source, shadow in NORMALIZED_COLUMNS[mapper.class_].items():
+        if state.attrs[source].history.has_changes():
+            value = getattr(target, source)
+            setattr(target, shadow, ArabicTextProcessor.normalize_arabic(value) if value else None)
+
+for model in NORMALIZED_COLUMNS:
+    event.listen(model, 'before_insert', fill_normalized_columns)
+    event.listen(model, 'before_update', fill_normalized_columns)
+
+def fill_minhash(mapper, connection, target):
+    """Recompute the MinHash signature when the content changed and none was supplied"""
+    state = inspect(target)
+    if state.attrs['content'].history.has_changes() and not state.attrs['minhash'].history.has_changes():
+        signature = JudgmentDeduplicator.signature(target.content)
+        target.minhash = JudgmentDeduplicator.hasher.to_bytes(signature) if signature else None
+
+def sync_minhash_bands(mapper, connection, target):
+    """Keep the band rows of a judgment in step with its signature and duplicate flag"""
+    state = inspect(target)
+    if not (state.attrs['minhash'].history.has_changes() or state.attrs['duplicate_of_id'].history.has_changes()):
+        return
+    
+    bands = JudgmentMinHashBand.__table__
+    connection.execute(bands.delete().where(bands.c.judgment_id == target.id))
+    
+    # Duplicates are not banded, so lookups only ever find canonical judgments
+    signature = JudgmentDeduplicator.hasher.from_bytes(target.minhash)
+    if signature and target.duplicate_of_id is None:
+        connection.execute(bands.insert(), JudgmentDeduplicator.band_rows(target.id, signature))
+
+def delete_minhash_bands(mapper, connection, target):
+    """Drop the band rows of a deleted judgment"""
+    bands = JudgmentMinHashBand.__table__
+    connection.execute(bands.delete().where(bands.c.judgment_id == target.id))
+
+def release_duplicates(mapper, connection, target):
+    """Make the first surviving duplicate of a deleted judgment canonical and re-point the others to it.
+
+    Runs before the DELETE, since ON DELETE SET NULL would otherwise
+    unflag them without banding any of them.
+    """
+    table = Judgment.__table__
+    session = object_session(target)
+    deleted = {obj.id for obj in session.deleted if isinstance(obj, Judgment)} if session else set()
+    duplicates = [row[0] for row in connection.execute(
+        select(table.c.id).where(table.c.duplicate_of_id == target.id).order_by(table.c.id)
+    ) if row[0] not in deleted]
+    if not duplicates:
+        return
+    
+    # Flag changes keep updated_at, so the search indexes are not rebuilt
+    canonical = duplicates[0]
+    connection.execute(table.update().where(table.c.duplicate_of_id == target.id)
+                       .values(duplicate_of_id=canonical, updated_at=table.c.updated_at))
+    connection.execute(table.update().where(table.c.id == canonical)
+                       .values(duplicate_of_id=None, updated_at=table.c.updated_at))
+    
+    minhash = connection.execute(select(table.c.minhash).where(table.c.id == canonical)).scalar()
+    signature = JudgmentDeduplicator.hasher.from_bytes(minhash)
+    if signature:
+        connection.execute(JudgmentMinHashBand.__table__.insert(), JudgmentDeduplicator.band_rows(canonical, signature))
+
+event.listen(Judgment, 'before_insert', fill_minhash)
+event.listen(Judgment, 'before_update', fill_minhash)
+event.listen(Judgment, 'after_insert', sync_minhash_bands)
+event.listen(Judgment, 'after_update', sync_minhash_bands)
+event.listen(Judgment, 'before_delete', delete_minhash_bands)
+event.listen(Judgment, 'before_delete', release_duplicates)
+
+# Child rows counted on their parents: child model -> (foreign key, parent model, counter column)
+CHILD_COUNTERS = {
+    Case: [
+        ('category_id', Category, 'case_count'),
+        ('court_id', Court, 'case_count'),
+    ],
+    Judgment: [
+        ('case_id', Case, 'judgment_count'),
+        ('court_id', Court, 'judgment_count'),
+    ],
+    Document: [
+        ('case_id', Case, 'document_count'),
+    ],
+}
+
+def adjust_child_count(connection, parent, counter, parent_id, delta):
+    """Add delta to one parent's counter in the writing transaction"""
+    if parent_id is None:
+        return
+    table = parent.__table__
+    connection.execute(
+        table.update().where(table.c.id == parent_id).values({counter: table.c[counter] + delta})
+    )
+
+def count_inserted_child(mapper, connection, target):
+    """Count a new child row on each of its parents"""
+    for foreign_key, parent, counter in CHILD_COUNTERS[mapper.class_]:
+        adjust_child_count(connection, parent, counter, getattr(target, foreign_key), 1)
+
+def count_moved_child(mapper, connection, target):
+    """Move a child row's count when it is reassigned to another parent"""
+    state = inspect(target)
+    for foreign_key, parent, counter in CHILD_COUNTERS[mapper.class_]:
+        history = state.attrs[foreign_key].history
+        if not history.has_changes():
+            continue
+        for old_id in history.deleted:
+            adjust_child_count(connection, parent, counter, old_id, -1)
+        for new_id in history.added:
+            adjust_child_count(connection, parent, counter, new_id, 1)
+
+def count_deleted_child(mapper, connection, target):
+    """Uncount a deleted child row on the parents it had when loaded"""
+    state = inspect(target)
+    for foreign_key, parent, counter in CHILD_COUNTERS[mapper.class_]:
+        history = state.attrs[foreign_key].history
+        parent_ids = history.deleted or history.unchanged or [getattr(target, foreign_key)]
+        adjust_child_count(connection, parent, counter, parent_ids[0], -1)
+
+for model in CHILD_COUNTERS:
+    event.listen(model, 'after_insert', count_inserted_child)
+    event.listen(model, 'after_update', count_moved_child)
+    event.listen(model, 'after_delete', count_deleted_child)
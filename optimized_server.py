@@ -13,22 +13,97 @@ from urllib.parse import urlparse, parse_qs
 import sys
 import sqlite3
 import os
+import re
 from datetime import datetime
 import threading
+import queue
+
+from utils.near_duplicates import MinHasher, MinHashLSH, JudgmentDeduplicator
+from utils.pagination import CursorError, decode_cursor, encode_cursor
+
+# تطبيع النص العربي للبحث: إزالة التشكيل وتوحيد أشكال الحروف
+ARABIC_DIACRITICS = re.compile(r'[\u064B-\u0652\u0670\u0640]')
+ARABIC_NORMALIZE_TABLE = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ئ': 'ي', 'ؤ': 'و'
+})
+
+def normalize_search_text(text):
+    """تطبيع النص قبل الفهرسة أو البحث"""
+    if not text:
+        return ''
+    text = ARABIC_DIACRITICS.sub('', str(text).lower())
+    return text.translate(ARABIC_NORMALIZE_TABLE)
+
+class ConnectionPool:
+    """مجمّع اتصالات SQLite محدود الحجم: يُعاد استخدام الاتصالات بين الطلبات بدل فتح اتصال لكل استدعاء"""
+    
+    # ذاكرة صفحات لكل اتصال (بالكيلوبايت عند القيمة السالبة) وحجم الملف المعيّن في الذاكرة
+    CACHE_SIZE_KB = 64 * 1024
+    MMAP_SIZE = 256 * 1024 * 1024
+    BUSY_TIMEOUT = 30
+    
+    def __init__(self, db_path, size=8):
+        self.db_path = db_path
+        self.idle = queue.LifoQueue(maxsize=size)
+    
+    def _connect(self):
+        """فتح اتصال جديد وضبط إعداداته مرة واحدة"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        
+        # WAL يسمح للقراء بالعمل أثناء الكتابة، وNORMAL يكتفي بمزامنة القرص عند نقاط التثبيت
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{self.CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={self.MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+    
+    def acquire(self):
+        """اتصال خامل من المجمّع، أو اتصال جديد إن لم يوجد"""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+    
+    def release(self, conn):
+        """إعادة الاتصال إلى المجمّع بعد إنهاء أي معاملة مفتوحة، وإغلاقه إن كان المجمّع ممتلئاً"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    def close_all(self):
+        """إغلاق جميع الاتصالات الخاملة"""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
 
 class DatabaseManager:
     """مدير قاعدة البيانات لتخزين البيانات الكبيرة بكفاءة"""
     
-    def __init__(self, db_path='legal_judgments.db'):
+    def __init__(self, db_path='legal_judgments.db', pool_size=8):
         self.db_path = db_path
-        self.lock = threading.Lock()
+        self.lock = threading.Lock()  # كاتب واحد في كل مرة؛ القراءة لا تنتظره في وضع WAL
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.fts_enabled = False
         self.init_database()
     
     def get_connection(self):
-        """إنشاء اتصال جديد بقاعدة البيانات"""
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """استعارة اتصال من المجمّع؛ يُعاد عبر release_connection"""
+        return self.pool.acquire()
+    
+    def release_connection(self, conn):
+        """إعادة اتصال مستعار إلى المجمّع"""
+        self.pool.release(conn)
     
     def init_database(self):
         """إنشاء جداول قاعدة البيانات"""
@@ -55,17 +130,117 @@ class DatabaseManager:
                 )
             ''')
             
+            # أعمدة كشف التكرار للقواعد المنشأة قبل إضافتها: بصمة MinHash ورقم الحكم الأصلي
+            columns = {row['name'] for row in cursor.execute('PRAGMA table_info(judgments)')}
+            if 'minhash' not in columns:
+                cursor.execute('ALTER TABLE judgments ADD COLUMN minhash BLOB')
+            if 'duplicate_of' not in columns:
+                cursor.execute('ALTER TABLE judgments ADD COLUMN duplicate_of INTEGER')
+            
             # إنشاء فهارس للبحث السريع
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_judgments_created 
                 ON judgments(created_at DESC)
             ''')
             
+            # فهرس البحث النصي الكامل (FTS5) - بدون نسخة من المحتوى لأن البيانات مخزنة في judgments
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'judgments_fts'"
+            )
+            fts_exists = cursor.fetchone() is not None
+            
+            try:
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS judgments_fts 
+                    USING fts5(content, content='', tokenize='unicode61')
+                ''')
+                self.fts_enabled = True
+            except sqlite3.OperationalError:
+                # نسخة SQLite بدون FTS5 - البحث يعود إلى LIKE
+                self.fts_enabled = False
+            
             conn.commit()
-            conn.close()
+            
+            # بناء الفهرس للبيانات المخزنة قبل إضافة FTS5
+            if self.fts_enabled and not fts_exists:
+                self._rebuild_search_index(conn)
+            
+            self.release_connection(conn)
+    
+    # أسماء أعمدة رقم القضية في ملفات CSV (بعد التطبيع)
+    CASE_COLUMNS = {'case_id', 'case_number', 'case_no', 'رقم القضيه', 'رقم الدعوي', 'القضيه'}
+    
+    @classmethod
+    def _case_key(cls, judgment):
+        """رقم القضية في صف الحكم، أو None إن لم يوجد عمود له"""
+        if not isinstance(judgment, dict):
+            return None
+        for column, value in judgment.items():
+            if normalize_search_text(str(column).strip()) in cls.CASE_COLUMNS and value not in (None, ''):
+                return normalize_search_text(str(value).strip())
+        return None
+    
+    @staticmethod
+    def _search_text(judgment):
+        """استخراج النصوص من الحكم لفهرستها"""
+        if isinstance(judgment, dict):
+            values = judgment.values()
+        elif isinstance(judgment, (list, tuple)):
+            values = judgment
+        else:
+            values = [judgment]
+        return normalize_search_text(' '.join(str(v) for v in values if v is not None))
+    
+    @staticmethod
+    def _fts_query(search):
+        """تحويل نص البحث إلى تعبير MATCH آمن: العبارات بين علامتي تنصيص متتالية، وNEAR/n للتقارب، وباقي الكلمات كبادئات مع AND ضمني"""
+        groups = []
+        pending_near = None
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', search or ''):
+            near = re.match(r'^NEAR(?:/(\d+))?$', word) if word else None
+            if near:
+                if groups:
+                    pending_near = int(near.group(1) or 10)
+                continue
+
+            terms = re.findall(r'\w+', normalize_search_text(phrase or word))
+            if not terms:
+                continue
+            if phrase:
+                phrases = ['"' + ' '.join(terms) + '"']
+            else:
+                phrases = ['"' + term + '"*' for term in terms]
+
+            if pending_near is not None:
+                groups[-1][0].extend(phrases)
+                groups[-1][1] = pending_near
+                pending_near = None
+            else:
+                groups.append([phrases, None])
+
+        return ' '.join(
+            ' '.join(phrases) if distance is None else 'NEAR(' + ' '.join(phrases) + ', ' + str(distance) + ')'
+            for phrases, distance in groups
+        )
+    
+    def _rebuild_search_index(self, conn):
+        """إعادة بناء فهرس البحث من جدول الأحكام"""
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO judgments_fts(judgments_fts) VALUES('delete-all')")
+        
+        rows = conn.execute('SELECT id, data FROM judgments')
+        while True:
+            batch = rows.fetchmany(5000)
+            if not batch:
+                break
+            cursor.executemany(
+                'INSERT INTO judgments_fts (rowid, content) VALUES (?, ?)',
+                [(row['id'], self._search_text(json.loads(row['data']))) for row in batch]
+            )
+        conn.commit()
     
     def store_judgments(self, judgments_data, headers):
-        """تخزين الأحكام القانونية في قاعدة البيانات"""
+        """تخزين الأحكام القانونية في قاعدة البيانات مع دمج الصفوف شبه المكررة"""
         with self.lock:
             conn = self.get_connection()
             cursor = conn.cursor()
@@ -73,13 +248,50 @@ class DatabaseManager:
             try:
                 # حذف البيانات القديمة
                 cursor.execute('DELETE FROM judgments')
+                if self.fts_enabled:
+                    cursor.execute("INSERT INTO judgments_fts(judgments_fts) VALUES('delete-all')")
                 
-                # إدراج البيانات الجديدة
-                for judgment in judgments_data:
+                # ملفات CSV المتداخلة تكرر الأحكام: فهرس LSH للملف المرفوع يجد المرشحين دون مقارنة كل الصفوف
+                hasher = MinHasher()
+                lsh = MinHashLSH(hasher)
+                stats = {'stored': 0, 'merged': 0, 'flagged': 0, 'merges': []}
+                case_keys = {}
+                
+                # إدراج البيانات الجديدة مع فهرستها للبحث
+                for row_number, judgment in enumerate(judgments_data, 1):
+                    search_text = self._search_text(judgment)
+                    signature = hasher.signature(re.findall(r'\w+', search_text))
+                    match = lsh.best_match(signature, JudgmentDeduplicator.FLAG_THRESHOLD) if signature else None
+                    case_key = self._case_key(judgment)
+                    
+                    # التطابق شبه التام في القضية نفسها يُدمج مع الحكم الأول ولا يُخزن؛ حكم قضية أخرى يُخزن معلّماً فقط
+                    if match and match[1] >= JudgmentDeduplicator.MERGE_THRESHOLD \
+                            and case_key is not None and case_keys.get(match[0]) == case_key:
+                        stats['merged'] += 1
+                        stats['merges'].append({'row': row_number, 'merged_into': match[0]})
+                        continue
+                    
                     cursor.execute(
-                        'INSERT INTO judgments (data) VALUES (?)',
-                        (json.dumps(judgment, ensure_ascii=False),)
+                        'INSERT INTO judgments (data, minhash, duplicate_of) VALUES (?, ?, ?)',
+                        (json.dumps(judgment, ensure_ascii=False),
+                         hasher.to_bytes(signature) if signature else None,
+                         match[0] if match else None)
                     )
+                    judgment_id = cursor.lastrowid
+                    case_keys[judgment_id] = case_key
+                    stats['stored'] += 1
+                    
+                    # الأحكام المتشابهة تُخزن مع الإشارة إلى الأصل، ولا تدخل الفهرس حتى تبقى المرشحات أصلية
+                    if match:
+                        stats['flagged'] += 1
+                    elif signature:
+                        lsh.insert(judgment_id, signature)
+                    
+                    if self.fts_enabled:
+                        cursor.execute(
+                            'INSERT INTO judgments_fts (rowid, content) VALUES (?, ?)',
+                            (judgment_id, search_text)
+                        )
                 
                 # حفظ البيانات الوصفية
                 cursor.execute('''
@@ -90,16 +302,16 @@ class DatabaseManager:
                 cursor.execute('''
                     INSERT OR REPLACE INTO metadata (key, value, updated_at)
                     VALUES (?, ?, CURRENT_TIMESTAMP)
-                ''', ('total_count', str(len(judgments_data))))
+                ''', ('total_count', str(stats['stored'])))
                 
                 conn.commit()
-                return True, len(judgments_data)
+                return True, stats
                 
             except Exception as e:
                 conn.rollback()
                 return False, str(e)
             finally:
-                conn.close()
+                self.release_connection(conn)
     
     def get_judgments_paginated(self, page=1, per_page=20, search=''):
         """جلب الأحكام مع الصفحات والبحث"""
@@ -108,32 +320,50 @@ class DatabaseManager:
         
         try:
             offset = (page - 1) * per_page
+            fts_query = self._fts_query(search) if search and self.fts_enabled else ''
             
-            if search:
+            if fts_query:
+                # البحث عبر فهرس FTS5 مرتباً حسب الصلة (bm25)
+                cursor.execute('''
+                    SELECT judgments.id, judgments.data FROM judgments_fts
+                    JOIN judgments ON judgments.id = judgments_fts.rowid
+                    WHERE judgments_fts MATCH ?
+                    ORDER BY bm25(judgments_fts)
+                    LIMIT ? OFFSET ?
+                ''', (fts_query, per_page, offset))
+                rows = cursor.fetchall()
+                
+                cursor.execute('''
+                    SELECT COUNT(*) FROM judgments_fts 
+                    WHERE judgments_fts MATCH ?
+                ''', (fts_query,))
+                total = cursor.fetchone()[0]
+            elif search and not self.fts_enabled:
                 # البحث في البيانات
                 cursor.execute('''
                     SELECT id, data FROM judgments 
                     WHERE data LIKE ? 
-                    ORDER BY created_at DESC
+                    ORDER BY created_at DESC, id DESC
                     LIMIT ? OFFSET ?
                 ''', (f'%{search}%', per_page, offset))
+                rows = cursor.fetchall()
                 
                 cursor.execute('''
                     SELECT COUNT(*) FROM judgments 
                     WHERE data LIKE ?
                 ''', (f'%{search}%',))
+                total = cursor.fetchone()[0]
             else:
                 # جلب جميع البيانات
                 cursor.execute('''
                     SELECT id, data FROM judgments 
-                    ORDER BY created_at DESC
+                    ORDER BY created_at DESC, id DESC
                     LIMIT ? OFFSET ?
                 ''', (per_page, offset))
+                rows = cursor.fetchall()
                 
                 cursor.execute('SELECT COUNT(*) FROM judgments')
-            
-            rows = cursor.fetchall()
-            total = cursor.fetchone()[0]
+                total = cursor.fetchone()[0]
             
             judgments = []
             for row in rows:
@@ -150,7 +380,68 @@ class DatabaseManager:
             }
             
         finally:
-            conn.close()
+            self.release_connection(conn)
+    
+    def get_judgments_after(self, cursor_token, per_page=20, search=''):
+        """جلب صفحة الأحكام التالية للمؤشر دون COUNT(*) أو OFFSET، فتكلفة الصفحة العاشرة آلاف كتكلفة الأولى"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            fts_query = self._fts_query(search) if search and self.fts_enabled else ''
+            
+            if fts_query:
+                # الترتيب حسب الصلة: المؤشر يحمل (bm25، id) لآخر نتيجة
+                ordering = 'judgments.bm25'
+                sql = '''
+                    SELECT judgments.id, judgments.data, bm25(judgments_fts) AS sort_key FROM judgments_fts
+                    JOIN judgments ON judgments.id = judgments_fts.rowid
+                    WHERE judgments_fts MATCH ?
+                '''
+                params = [fts_query]
+                if cursor_token:
+                    last_rank, last_id = decode_cursor(cursor_token, ordering)
+                    sql += ' AND (bm25(judgments_fts) > ? OR (bm25(judgments_fts) = ? AND judgments.id > ?))'
+                    params += [last_rank, last_rank, last_id]
+                sql += ' ORDER BY sort_key, judgments.id LIMIT ?'
+            else:
+                # الأحدث أولاً: المؤشر يحمل (created_at، id) ويُخدم من الفهرس idx_judgments_created
+                ordering = 'judgments.created_at'
+                sql = 'SELECT id, data, created_at AS sort_key FROM judgments WHERE 1 = 1'
+                params = []
+                if search:
+                    sql += ' AND data LIKE ?'
+                    params.append(f'%{search}%')
+                if cursor_token:
+                    last_created, last_id = decode_cursor(cursor_token, ordering)
+                    sql += ' AND (created_at < ? OR (created_at = ? AND id < ?))'
+                    params += [last_created, last_created, last_id]
+                sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+            
+            # صف إضافي يكفي لمعرفة وجود صفحة تالية
+            cursor.execute(sql, params + [per_page + 1])
+            rows = cursor.fetchall()
+            
+            next_cursor = None
+            if len(rows) > per_page:
+                rows = rows[:per_page]
+                next_cursor = encode_cursor(ordering, [rows[-1]['sort_key'], rows[-1]['id']])
+            
+            judgments = []
+            for row in rows:
+                judgment = json.loads(row['data'])
+                judgment['_id'] = row['id']
+                judgments.append(judgment)
+            
+            return {
+                'judgments': judgments,
+                'per_page': per_page,
+                'cursor': cursor_token or None,
+                'next_cursor': next_cursor
+            }
+            
+        finally:
+            self.release_connection(conn)
     
     def get_metadata(self, key):
         """جلب البيانات الوصفية"""
@@ -162,7 +453,7 @@ class DatabaseManager:
             row = cursor.fetchone()
             return json.loads(row['value']) if row else None
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def get_total_count(self):
         """جلب إجمالي عدد الأحكام"""
@@ -173,7 +464,7 @@ class DatabaseManager:
             cursor.execute('SELECT COUNT(*) FROM judgments')
             return cursor.fetchone()[0]
         finally:
-            conn.close()
+            self.release_connection(conn)
     
     def clear_all_data(self):
         """حذف جميع البيانات"""
@@ -184,13 +475,15 @@ class DatabaseManager:
             try:
                 cursor.execute('DELETE FROM judgments')
                 cursor.execute('DELETE FROM metadata')
+                if self.fts_enabled:
+                    cursor.execute("INSERT INTO judgments_fts(judgments_fts) VALUES('delete-all')")
                 conn.commit()
                 return True
             except Exception as e:
                 conn.rollback()
                 return False
             finally:
-                conn.close()
+                self.release_connection(conn)
 
 
 class OptimizedLegalSystemHandler(http.server.SimpleHTTPRequestHandler):
@@ -251,6 +544,29 @@ class OptimizedLegalSystemHandler(http.server.SimpleHTTPRequestHandler):
             per_page = int(query_params.get('per_page', [20])[0])
             search = query_params.get('search', [''])[0]
             
+            # وجود المعامل cursor (ولو فارغاً للصفحة الأولى) يفعّل الترقيم بالمفاتيح
+            cursor_token = parse_qs(parsed_url.query, keep_blank_values=True).get('cursor', [None])[0]
+            if cursor_token is not None:
+                try:
+                    result = self.db_manager.get_judgments_after(cursor_token, per_page, search)
+                except CursorError as e:
+                    self.send_json_response({'success': False, 'error': str(e)}, 400)
+                    return
+                
+                self.send_json_response({
+                    'success': True,
+                    'judgments': result['judgments'],
+                    'headers': self.db_manager.get_metadata('headers') or [],
+                    'pagination': {
+                        'per_page': result['per_page'],
+                        'cursor': result['cursor'],
+                        'next_cursor': result['next_cursor'],
+                        'has_next': result['next_cursor'] is not None,
+                        'has_prev': result['cursor'] is not None
+                    }
+                })
+                return
+            
             # جلب البيانات من قاعدة البيانات
             result = self.db_manager.get_judgments_paginated(page, per_page, search)
             headers = self.db_manager.get_metadata('headers') or []
@@ -348,14 +664,18 @@ class OptimizedLegalSystemHandler(http.server.SimpleHTTPRequestHandler):
                 
                 if success:
                     print(f"\n✅ تم تخزين البيانات بنجاح!")
-                    print(f"   💾 عدد الأحكام المخزنة: {result}")
+                    print(f"   💾 عدد الأحكام المخزنة: {result['stored']}")
+                    print(f"   🔁 أحكام مكررة مدمجة: {result['merged']}، متشابهة معلّمة: {result['flagged']}")
                     print(f"   🗄️  حجم قاعدة البيانات: {os.path.getsize(self.db_manager.db_path) / 1024 / 1024:.2f} MB")
                     
                     self.send_json_response({
                         'success': True,
-                        'message': f'تم تخزين {result} حكم قانوني بنجاح في قاعدة البيانات',
+                        'message': f'تم تخزين {result["stored"]} حكم قانوني بنجاح في قاعدة البيانات',
                         'totalRows': len(all_data),
-                        'loadedJudgments': result,
+                        'loadedJudgments': result['stored'],
+                        'duplicatesMerged': result['merged'],
+                        'mergedRows': result['merges'],
+                        'duplicatesFlagged': result['flagged'],
                         'headers': headers,
                         'loadingPercentage': 100,
                         'database': 'SQLite',
@@ -402,6 +722,12 @@ class OptimizedLegalSystemHandler(http.server.SimpleHTTPRequestHandler):
             self.send_json_response({'error': 'نقطة النهاية غير موجودة'}, 404)
 
 
+class ThreadingServer(socketserver.ThreadingTCPServer):
+    """خادم بخيط لكل طلب: القراءات تجري بالتوازي عبر مجمّع الاتصالات حتى أثناء الكتابة"""
+    
+    daemon_threads = True
+
+
 def find_free_port(start_port=5000, max_tries=10):
     """البحث عن منفذ متاح"""
     import socket
@@ -442,7 +768,7 @@ if __name__ == "__main__":
     
     print("=" * 70)
     
-    with socketserver.TCPServer(("", PORT), OptimizedLegalSystemHandler) as httpd:
+    with ThreadingServer(("", PORT), OptimizedLegalSystemHandler) as httpd:
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory prefix indexes for type-ahead on party, judge, lawyer, court and law names
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from utils.text_processing import ArabicTextProcessor
+
+class PrefixIndex:
+    """Sorted array of normalized values with a frequency weight per value.
+
+    Every value is entered once per word start, so "بالرياض" completes
+    "محكمة الاستئناف بالرياض". A prefix is a binary-searched range of the
+    array; short ranges are ranked directly, while the top completions of
+    prefixes spanning more than SCAN_LIMIT entries are cached and kept
+    current as weights change.
+    """
+
+    SCAN_LIMIT = 256
+    CACHE_SIZE = 20
+
+    # Word starts entered per value, enough for long law and court names
+    MAX_WORDS = 6
+
+    # Sorts after every character, closing a prefix range
+    RANGE_END = '\U0010ffff'
+
+    def __init__(self):
+        self.entries: List[Tuple[str, str]] = []
+        self.weights: Dict[str, int] = {}
+        self.display: Dict[str, str] = {}
+        self.top: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def normalize(value: str) -> str:
+        """Normalized lookup key of a value or a typed prefix"""
+        if not value:
+            return ''
+        return ArabicTextProcessor.normalize_arabic(ArabicTextProcessor.remove_punctuation(str(value)))
+
+    @classmethod
+    def suffixes(cls, key: str) -> List[str]:
+        """The key from each of its first MAX_WORDS word starts"""
+        starts = [0] + [i + 1 for i, char in enumerate(key) if char == ' ']
+        return [key[start:] for start in starts[:cls.MAX_WORDS]]
+
+    def _rank(self, key: str) -> Tuple[int, str]:
+        return (-self.weights[key], key)
+
+    def load(self, counts: Iterable[Tuple[str, int]]):
+        """Replace the contents with (value, count) pairs; variants of one key are merged"""
+        weights, display, shown = {}, {}, {}
+        for value, count in counts:
+            key = self.normalize(value)
+            if not key or count <= 0:
+                continue
+            weights[key] = weights.get(key, 0) + count
+            # The most frequent spelling is the one suggested
+            if count > shown.get(key, 0):
+                display[key], shown[key] = value, count
+
+        self.entries = sorted((suffix, key) for key in weights for suffix in self.suffixes(key))
+        self.weights = weights
+        self.display = display
+        self.top = {}
+
+    def adjust(self, value: str, delta: int):
+        """Change the weight of a value, adding or dropping it as needed"""
+        key = self.normalize(value)
+        if not key or not delta:
+            return
+
+        old = self.weights.get(key, 0)
+        new = old + delta
+        if new <= 0:
+            if not old:
+                return
+            for suffix in self.suffixes(key):
+                position = bisect_left(self.entries, (suffix, key))
+                if position < len(self.entries) and self.entries[position] == (suffix, key):
+                    del self.entries[position]
+            del self.weights[key]
+            del self.display[key]
+            self._invalidate(key)
+            return
+
+        self.weights[key] = new
+        if not old:
+            self.display[key] = value
+            for suffix in self.suffixes(key):
+                insort(self.entries, (suffix, key))
+
+        if new > old:
+            self._promote(key)
+        else:
+            self._invalidate(key)
+
+    def _cached_prefixes(self, key: str):
+        """Cached prefix lists that could hold the key"""
+        prefixes = set()
+        for suffix in self.suffixes(key):
+            for length in range(1, len(suffix) + 1):
+                prefix = suffix[:length]
+                if prefix in self.top:
+                    prefixes.add(prefix)
+        return prefixes
+
+    def _promote(self, key: str):
+        """Move a key whose weight grew into the cached lists it now belongs to"""
+        rank = self._rank(key)
+        for prefix in self._cached_prefixes(key):
+            ranked = self.top[prefix]
+            if key in ranked:
+                ranked.sort(key=self._rank)
+            elif len(ranked) < self.CACHE_SIZE or rank < self._rank(ranked[-1]):
+                ranked.append(key)
+                ranked.sort(key=self._rank)
+                del ranked[self.CACHE_SIZE:]
+
+    def _invalidate(self, key: str):
+        """Drop cached lists holding a key whose weight fell; they are rebuilt on demand"""
+        for prefix in self._cached_prefixes(key):
+            if key in self.top[prefix]:
+                del self.top[prefix]
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """Top completions of a prefix as (value, weight), heaviest first"""
+        prefix = self.normalize(prefix)
+        if not prefix or limit <= 0:
+            return []
+
+        start = bisect_left(self.entries, (prefix,))
+        end = bisect_left(self.entries, (prefix + self.RANGE_END,))
+        if end - start <= self.SCAN_LIMIT:
+            keys = {key for _, key in self.entries[start:end]}
+            ranked = heapq.nsmallest(limit, keys, key=self._rank)
+        else:
+            ranked = self.top.get(prefix)
+            if ranked is None:
+                keys = {key for _, key in self.entries[start:end]}
+                ranked = self.top[prefix] = heapq.nsmallest(self.CACHE_SIZE, keys, key=self._rank)
+            ranked = ranked[:limit]
+
+        return [(self.display[key], self.weights[key]) for key in ranked]
+
+    def __len__(self):
+        return len(self.weights)
+
+class AutocompleteIndex:
+    """Prefix indexes for the type-ahead fields, built on first use.
+
+    Committed inserts, updates and deletes of the source rows adjust the
+    weights in place; a field is rebuilt from the database once it is
+    older than max_age, which also picks up writes made by other
+    processes or by bulk SQL.
+    """
+
+    QUEUE_KEY = 'autocomplete_queue'
+
+    # Field name -> (model, column) pairs whose values it completes
+    FIELDS = {
+        'plaintiff': (('Case', 'plaintiff'),),
+        'defendant': (('Case', 'defendant'),),
+        'judge_name': (('Judgment', 'judge_name'),),
+        'lawyer_name': (('Case', 'lawyer_name'),),
+        'court': (('Court', 'name'),),
+        'law_name': (('LegalArticle', 'law_name'),),
+    }
+
+    MAX_LIMIT = PrefixIndex.CACHE_SIZE
+
+    def __init__(self, max_age: Optional[float] = 3600):
+        self.max_age = max_age
+        self.indexes: Dict[str, PrefixIndex] = {}
+        self.built_at: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.build_locks = {field: threading.Lock() for field in self.FIELDS}
+        self.registered = False
+
+    @staticmethod
+    def models() -> Dict:
+        """Source model classes by name"""
+        from models import Case, Judgment, Court, LegalArticle
+        return {
+            'Case': Case,
+            'Judgment': Judgment,
+            'Court': Court,
+            'LegalArticle': LegalArticle,
+        }
+
+    def register(self):
+        """Attach the SQLAlchemy event hooks"""
+        if self.registered:
+            return
+
+        columns = {}
+        for field, sources in self.FIELDS.items():
+            for model_name, column in sources:
+                columns.setdefault(model_name, []).append((field, column))
+
+        models = self.models()
+        for model_name, fields in columns.items():
+            for _, column in fields:
+                # Replacing an expired value loads it first, so the old value's count can be lowered
+                event.listen(getattr(models[model_name], column), 'set', self._keep_history, active_history=True)
+            event.listen(models[model_name], 'after_insert', self._listener(fields, +1))
+            event.listen(models[model_name], 'after_update', self._update_listener(fields))
+            # Before the DELETE, while expired values can still be loaded
+            event.listen(models[model_name], 'before_delete', self._listener(fields, -1))
+
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+        self.registered = True
+
+    def _queue(self, target) -> Optional[list]:
+        session = inspect(target).session
+        if session is None:
+            return None
+        return session.info.setdefault(self.QUEUE_KEY, [])
+
+    @staticmethod
+    def _keep_history(target, value, oldvalue, initiator):
+        pass
+
+    def _listener(self, fields, delta: int):
+        def listener(mapper, connection, target):
+            queue = self._queue(target)
+            if queue is None:
+                return
+            for field, column in fields:
+                value = getattr(target, column)
+                if value:
+                    queue.append((field, value, delta))
+        return listener
+
+    def _update_listener(self, fields):
+        def listener(mapper, connection, target):
+            queue = self._queue(target)
+            if queue is None:
+                return
+            state = inspect(target)
+            for field, column in fields:
+                history = state.attrs[column].history
+                if not history.has_changes():
+                    continue
+                queue.extend((field, value, -1) for value in history.deleted if value)
+                queue.extend((field, value, +1) for value in history.added if value)
+        return listener
+
+    def _after_commit(self, session):
+        queue = session.info.pop(self.QUEUE_KEY, None)
+        if not queue:
+            return
+        with self.lock:
+            for field, value, delta in queue:
+                # Fields not built yet will read the committed rows
+                index = self.indexes.get(field)
+                if index is not None:
+                    index.adjust(value, delta)
+
+    def _after_rollback(self, session):
+        session.info.pop(self.QUEUE_KEY, None)
+
+    def build(self, session, field: str) -> PrefixIndex:
+        """Load a field's values and their frequencies from the database"""
+        models = self.models()
+        counts = []
+        for model_name, column_name in self.FIELDS[field]:
+            column = getattr(models[model_name], column_name)
+            counts.extend(
+                session.query(column, func.count()).filter(column.isnot(None)).group_by(column).all()
+            )
+
+        index = PrefixIndex()
+        index.load(counts)
+        with self.lock:
+            self.indexes[field] = index
+            self.built_at[field] = time.monotonic()
+        return index
+
+    def _index(self, session, field: str) -> PrefixIndex:
+        """Built index of a field, rebuilt when stale"""
+        index = self.indexes.get(field)
+        if index is None:
+            with self.build_locks[field]:
+                index = self.indexes.get(field)
+                if index is None:
+                    index = self.build(session, field)
+            return index
+
+        if self.max_age is not None and time.monotonic() - self.built_at[field] > self.max_age:
+            # One request rebuilds while the others keep using the current index
+            build_lock = self.build_locks[field]
+            if build_lock.acquire(blocking=False):
+                try:
+                    index = self.build(session, field)
+                finally:
+                    build_lock.release()
+        return index
+
+    def complete(self, session, field: str, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """Top completions of a prefix for a field as (value, weight)"""
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        index = self._index(session, field)
+        with self.lock:
+            return index.complete(prefix, min(limit, self.MAX_LIMIT))
+
+    def clear(self):
+        """Forget every built field"""
+        with self.lock:
+            self.indexes.clear()
+            self.built_at.clear()
+
+# Export autocomplete classes
+__all__ = [
+    'PrefixIndex',
+    'AutocompleteIndex'
+]
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Row counts for pagination: maintained table counters, cached and capped filtered counts
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from utils.text_processing import ArabicTextProcessor
+
+class TableCounters:
+    """Whole-table row counts kept in table_row_counts.
+
+    Inserts and deletes of the counted models adjust their counter in the
+    same transaction, with one UPDATE per table per flush. A counter
+    missing from the table is seeded with one COUNT(*) on first use;
+    reconcile() recounts after writes that bypass the ORM.
+    """
+
+    def __init__(self):
+        self.registered = False
+
+    @staticmethod
+    def models() -> Dict:
+        """Counted model classes by table name"""
+        from models import Case, Judgment, Document
+        return {model.__tablename__: model for model in (Case, Judgment, Document)}
+
+    def register(self):
+        """Attach the flush hook"""
+        if self.registered:
+            return
+        event.listen(Session, 'after_flush', self._after_flush)
+        self.registered = True
+
+    def _after_flush(self, session, flush_context):
+        # session.new and session.deleted still hold what this flush wrote
+        tables = self.models()
+        deltas = {}
+        for instance in session.new:
+            table_name = getattr(instance, '__tablename__', None)
+            if table_name in tables:
+                deltas[table_name] = deltas.get(table_name, 0) + 1
+        for instance in session.deleted:
+            table_name = getattr(instance, '__tablename__', None)
+            if table_name in tables:
+                deltas[table_name] = deltas.get(table_name, 0) - 1
+
+        if not deltas:
+            return
+
+        from models import TableRowCount
+        counts = TableRowCount.__table__
+        connection = session.connection()
+        for table_name, delta in deltas.items():
+            if delta:
+                connection.execute(
+                    counts.update().where(counts.c.table_name == table_name)
+                          .values(row_count=counts.c.row_count + delta)
+                )
+
+    def count(self, session, model) -> int:
+        """Row count of a counted model's table"""
+        from models import TableRowCount
+        counts = TableRowCount.__table__
+
+        row_count = session.execute(
+            select(counts.c.row_count).where(counts.c.table_name == model.__tablename__)
+        ).scalar()
+        if row_count is not None:
+            return row_count
+        return self.reconcile(session, model)
+
+    def reconcile(self, session, model) -> int:
+        """Recount a table exactly and store the result"""
+        from models import TableRowCount
+        counts = TableRowCount.__table__
+
+        row_count = session.query(func.count(model.id)).scalar()
+        # Written on its own connection so the caller's transaction stays untouched
+        with session.get_bind().begin() as connection:
+            updated = connection.execute(
+                counts.update().where(counts.c.table_name == model.__tablename__).values(row_count=row_count)
+            ).rowcount
+            if not updated:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(counts.insert().values(table_name=model.__tablename__,
+                                                                  row_count=row_count))
+                except IntegrityError:
+                    # Seeded concurrently by another request
+                    pass
+        return row_count
+
+class CountCache:
+    """Short-lived cache of filtered counts keyed by table and normalized filter set"""
+
+    def __init__(self, ttl: float = 30, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[Hashable, Tuple[float, Tuple[int, bool]]]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(table_name: str, filters: Dict) -> Tuple:
+        """Same key for filter sets that only differ in spelling, spacing or order"""
+        normalized = []
+        for name, value in filters.items():
+            if value in (None, '', [], ()):
+                continue
+            if isinstance(value, str):
+                value = ArabicTextProcessor.normalize_arabic(value)
+            elif isinstance(value, (list, tuple, set)):
+                value = tuple(sorted(str(item) for item in value))
+            normalized.append((name, value))
+        return (table_name, tuple(sorted(normalized, key=lambda item: item[0])))
+
+    def get(self, key: Hashable) -> Optional[Tuple[int, bool]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Tuple[int, bool]):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class CountedPagination:
+    """Offset page whose total may be a capped lower bound, shaped like Flask-SQLAlchemy's Pagination"""
+
+    def __init__(self, items: List, page: int, per_page: int, total: int, exact: bool = True,
+                 has_next: Optional[bool] = None):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.exact = exact
+        self.pages = max((total + per_page - 1) // per_page if per_page else 0, page if not exact else 0)
+        self.has_prev = page > 1
+        self.has_next = has_next if has_next is not None else page < self.pages
+
+    @property
+    def total_display(self) -> str:
+        """Total as shown to users: "10,000+" when the count was capped"""
+        return f'{self.total:,}' if self.exact else f'{self.total:,}+'
+
+class RowCounter:
+    """Totals for paginated lists without a COUNT(*) on every page request.
+
+    Unfiltered totals come from the maintained table counters. Filtered
+    totals are counted over at most scan_budget rows, so a broad filter
+    yields "scan_budget+" instead of a full scan, and are cached for a
+    few seconds per normalized filter set.
+    """
+
+    def __init__(self, ttl: float = 30, scan_budget: int = 10000):
+        self.counters = TableCounters()
+        self.cache = CountCache(ttl)
+        self.scan_budget = scan_budget
+
+    def register(self):
+        self.counters.register()
+
+    def capped_count(self, model, query) -> Tuple[int, bool]:
+        """Count matching rows, stopping after scan_budget; returns (count, exact)"""
+        limited = query.order_by(None).with_entities(model.id).limit(self.scan_budget + 1).subquery()
+        count = query.session.query(func.count()).select_from(limited).scalar()
+        if count > self.scan_budget:
+            return self.scan_budget, False
+        return count, True
+
+    def total(self, model, query, filters: Dict = None) -> Tuple[int, bool]:
+        """Total rows of a list query as (count, exact); filters describe how query was narrowed"""
+        key = CountCache.key(model.__tablename__, filters or {})
+        if not key[1]:
+            return self.counters.count(query.session, model), True
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = self.capped_count(model, query)
+        self.cache.put(key, result)
+        return result
+
+    def paginate(self, model, query, page: int, per_page: int, filters: Dict = None) -> CountedPagination:
+        """Offset page of an ordered query with a counter, cached or capped total"""
+        page = max(page, 1)
+        total, exact = self.total(model, query, filters)
+
+        # One extra row tells whether a next page exists even when the total is capped
+        items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+        has_next = len(items) > per_page
+        return CountedPagination(items[:per_page], page, per_page, total, exact, has_next=has_next)
+
+_row_counter = None
+_row_counter_lock = threading.Lock()
+
+def get_row_counter(ttl: float = 30, scan_budget: int = 10000) -> RowCounter:
+    """Return the shared row counter, attaching its write hooks on first use"""
+    global _row_counter
+    with _row_counter_lock:
+        if _row_counter is None:
+            _row_counter = RowCounter(ttl, scan_budget)
+            _row_counter.register()
+        return _row_counter
+
+# Export counting classes
+__all__ = [
+    'TableCounters',
+    'CountCache',
+    'CountedPagination',
+    'RowCounter',
+    'get_row_counter'
+]
@@ -4,10 +4,19 @@ Database service layer for the Arabic Legal Judgment System
 """
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import contains_eager
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
-from utils.text_processing import ArabicTextProcessor, SearchUtils
+from utils.text_processing import ArabicTextProcessor, SearchUtils, FuzzyMatchIndex, SnippetBuilder
+from utils.search_index import InvertedIndex, TrigramIndex, get_search_index, get_trigram_index
+from utils.facet_index import FacetIndex, RoaringBitmap, get_facet_index
+from utils.near_duplicates import JudgmentDeduplicator
+from utils.search_query import SearchQuery, QueryParseError, QueryPlanResult
+from utils.spelling import SpellingCorrector, get_spelling_corrector
+from utils.pagination import CursorError, KeysetPagination, keyset_paginate, ranked_paginate
+from utils.counting import RowCounter, get_row_counter
+from utils.stats_rollup import get_stats_rollup
 
 class DatabaseService:
     """Database operations service"""
@@ -16,6 +25,112 @@ class DatabaseService:
         self.db = db
         self.text_processor = ArabicTextProcessor()
         self.search_utils = SearchUtils()
+    
+    @property
+    def search_index(self) -> InvertedIndex:
+        """Shared persistent full-text index"""
+        from flask import current_app
+        return get_search_index(current_app.config.get('SEARCH_INDEX_PATH'))
+    
+    @property
+    def trigram_index(self) -> TrigramIndex:
+        """Shared trigram index for partial identifier lookup"""
+        from flask import current_app
+        return get_trigram_index(current_app.config.get('SEARCH_INDEX_PATH'))
+    
+    @property
+    def facet_index(self) -> FacetIndex:
+        """Shared facet bitmaps for result counts by value"""
+        from flask import current_app
+        return get_facet_index(current_app.config.get('SEARCH_INDEX_PATH'))
+    
+    @property
+    def spelling(self) -> SpellingCorrector:
+        """Shared "did you mean" corrector over the index vocabulary"""
+        from flask import current_app
+        return get_spelling_corrector(current_app.config.get('SEARCH_INDEX_PATH'))
+    
+    @property
+    def row_counter(self) -> RowCounter:
+        """Shared counter for page totals"""
+        from flask import current_app
+        return get_row_counter(current_app.config.get('COUNT_CACHE_TTL', 30),
+                               current_app.config.get('COUNT_SCAN_BUDGET', 10000))
+    
+    def did_you_mean(self, query: str, resource_type: str, pagination) -> Optional[str]:
+        """Spelling suggestion for a query that matched nothing"""
+        total = pagination.total
+        if total is None:
+            # Keyset pages are not counted: an empty first page means no hits
+            total = len(pagination.items) or int(pagination.has_prev)
+        if total or not query:
+            return None
+        return self.spelling.suggest(query, [resource_type])
+    
+    def facet_counts(self, model, resource_type: str, base_query, ranked=None, filters: Dict = None,
+                     restricted: bool = False) -> Dict:
+        """Facet value counts over every matching row, not just the current page.
+        
+        restricted marks a query narrowed by more than filters (a search plan
+        evaluated in SQL). Filters on facet columns alone are served from the
+        value bitmaps; other SQL-only matches fetch at most scan_budget ids,
+        and broader ones get no facet counts. Ranked pages whose filters were
+        not checked on every hit are counted the same way within their hits.
+        """
+        active = {name: value for name, value in (filters or {}).items() if value not in (None, '')}
+        matched = getattr(ranked, 'matched', None)
+        if ranked is not None and ranked.ids is not None:
+            ids = ranked.ids
+        elif not active and not restricted:
+            ids = matched
+        elif not restricted and set(active) <= set(FacetIndex.FACETS[resource_type]):
+            ids = self.facet_index.selection(resource_type, active)
+            if matched is not None:
+                ids = ids.intersection(RoaringBitmap.from_ids(list(matched)))
+        else:
+            budget = self.row_counter.scan_budget
+            ids = [row[0] for row in base_query.order_by(None).with_entities(model.id).limit(budget + 1)]
+            if len(ids) > budget:
+                return {}
+            if matched is not None:
+                ids = [resource_id for resource_id in ids if resource_id in matched]
+        return self.facet_index.counts(resource_type, ids)
+    
+    def filter_fragment(self, model, base_query, resource_type: str, field: str, fragment: str):
+        """Filter rows whose field contains a fragment, using the trigram index when it can serve it"""
+        from models import NORMALIZED_COLUMNS
+        
+        matched_ids = self.trigram_index.search(resource_type, fragment, fields=[field])
+        if matched_ids is not None:
+            return base_query.filter(model.id.in_(matched_ids))
+        
+        # Fragments too short for trigrams are matched anywhere in the normalized column, like longer ones
+        shadow = NORMALIZED_COLUMNS.get(model, {}).get(field)
+        if shadow:
+            normalized = self.text_processor.normalize_arabic(fragment)
+            return base_query.filter(getattr(model, shadow).contains(normalized))
+        return base_query.filter(getattr(model, field).contains(fragment))
+    
+    def plan_search(self, model, resource_type: str, query: str) -> Optional[QueryPlanResult]:
+        """Parse and execute a search query against the indexes; None for an empty query"""
+        if not query or not query.strip():
+            return None
+        return SearchQuery.parse(query).execute(model, resource_type, self.search_index, self.trigram_index)
+    
+    @staticmethod
+    def pagination_info(pagination) -> Dict:
+        """Pagination block of a response, for offset and keyset pages alike"""
+        if isinstance(pagination, KeysetPagination):
+            return pagination.to_dict()
+        return {
+            'page': pagination.page,
+            'pages': pagination.pages,
+            'per_page': pagination.per_page,
+            'total': pagination.total,
+            'total_exact': getattr(pagination, 'exact', True),
+            'has_next': pagination.has_next,
+            'has_prev': pagination.has_prev
+        }
 
 class CaseService(DatabaseService):
     """Case management service"""
@@ -47,6 +162,8 @@ class CaseService(DatabaseService):
             self.db.session.add(case)
             self.db.session.commit()
             
+            NameMatchService.add_names('party', [case.plaintiff, case.defendant])
+            
             return {
                 'success': True,
                 'case_id': case.id,
@@ -80,6 +197,8 @@ class CaseService(DatabaseService):
             case.updated_at = datetime.utcnow()
             self.db.session.commit()
             
+            NameMatchService.add_names('party', [case.plaintiff, case.defendant])
+            
             return {
                 'success': True,
                 'message': 'تم تحديث القضية بنجاح'
@@ -92,36 +211,22 @@ class CaseService(DatabaseService):
                 'error': f'حدث خطأ في تحديث القضية: {str(e)}'
             }
     
-    def search_cases(self, query: str, filters: Dict = None, page: int = 1, per_page: int = 20) -> Dict:
-        """Search cases with filters"""
+    def search_cases(self, query: str, filters: Dict = None, page: int = 1, per_page: int = 20,
+                     cursor: str = None) -> Dict:
+        """Search cases with filters; a cursor (empty for the first page) selects keyset pagination"""
         from models import Case, Category, Court
         
         try:
             # Base query
             base_query = Case.query.join(Category, Case.category_id == Category.id, isouter=True)\
-                                 .join(Court, Case.court_id == Court.id, isouter=True)
+                                 .join(Court, Case.court_id == Court.id, isouter=True)\
+                                 .options(contains_eager(Case.category), contains_eager(Case.court))
             
-            # Apply search query
-            if query:
-                normalized_query = self.text_processor.normalize_arabic(query)
-                query_words = normalized_query.split()
-                
-                search_conditions = []
-                for word in query_words:
-                    if word:
-                        search_conditions.append(
-                            or_(
-                                Case.title.contains(word),
-                                Case.description.contains(word),
-                                Case.case_number.contains(word),
-                                Case.plaintiff.contains(word),
-                                Case.defendant.contains(word),
-                                Case.legal_basis.contains(word)
-                            )
-                        )
-                
-                if search_conditions:
-                    base_query = base_query.filter(and_(*search_conditions))
+            # Run the query plan: text and fragment clauses on the indexes, field clauses in SQL
+            plan = self.plan_search(Case, 'case', query)
+            scores = plan.scores if plan else None
+            if plan:
+                base_query = plan.filter(base_query)
             
             # Apply filters
             if filters:
@@ -142,16 +247,33 @@ class CaseService(DatabaseService):
                 
                 if filters.get('date_to'):
                     base_query = base_query.filter(Case.case_date <= filters['date_to'])
-            
-            # Order by relevance and date
-            base_query = base_query.order_by(Case.created_at.desc())
-            
-            # Paginate
-            cases = base_query.paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
+                
+                # Partial case numbers and party names through the trigram index
+                for field in TrigramIndex.INDEXED_FIELDS['case']:
+                    if filters.get(field):
+                        base_query = self.filter_fragment(Case, base_query, 'case', field, filters[field])
+            
+            if scores is not None:
+                # Order by relevance
+                cases = ranked_paginate(Case, base_query, scores, page, per_page,
+                                        filtered=bool(filters) or plan.clause is not None, cursor=cursor)
+                facets = self.facet_counts(Case, 'case', base_query, ranked=cases, filters=filters,
+                                           restricted=plan.clause is not None)
+            else:
+                facets = self.facet_counts(Case, 'case', base_query, filters=filters,
+                                           restricted=plan is not None)
+                
+                if cursor is not None:
+                    # Seek by (created_at, id) instead of counting and skipping rows
+                    cases = keyset_paginate(base_query, Case.created_at, Case.id, cursor, per_page,
+                                            'case.created_at')
+                else:
+                    # Order by date
+                    base_query = base_query.order_by(Case.created_at.desc())
+                    
+                    # Paginate; the total comes from a counter or a cached, capped count
+                    cases = self.row_counter.paginate(Case, base_query, page, per_page,
+                                                      dict(filters or {}, query=query))
             
             return {
                 'success': True,
@@ -175,16 +297,16 @@ class CaseService(DatabaseService):
                         'name': case.court.name
                     } if case.court else None
                 } for case in cases.items],
-                'pagination': {
-                    'page': cases.page,
-                    'pages': cases.pages,
-                    'per_page': cases.per_page,
-                    'total': cases.total,
-                    'has_next': cases.has_next,
-                    'has_prev': cases.has_prev
-                }
+                'pagination': self.pagination_info(cases),
+                'facets': facets,
+                'did_you_mean': self.did_you_mean(query, 'case', cases)
             }
             
+        except (QueryParseError, CursorError) as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
         except Exception as e:
             return {
                 'success': False,
@@ -192,69 +314,49 @@ class CaseService(DatabaseService):
             }
     
     def get_case_statistics(self, filters: Dict = None) -> Dict:
-        """Get case statistics"""
-        from models import Case, Category, Court
+        """Get case statistics; filters on category_id, court_id and date_from/date_to (by creation day)"""
+        from models import Category
         
         try:
-            # Base query
-            base_query = Case.query
-            
-            # Apply filters
-            if filters:
-                if filters.get('category_id'):
-                    base_query = base_query.filter(Case.category_id == filters['category_id'])
-                
-                if filters.get('court_id'):
-                    base_query = base_query.filter(Case.court_id == filters['court_id'])
-                
-                if filters.get('date_from'):
-                    base_query = base_query.filter(Case.created_at >= filters['date_from'])
-                
-                if filters.get('date_to'):
-                    base_query = base_query.filter(Case.created_at <= filters['date_to'])
-            
-            # Total cases
-            total_cases = base_query.count()
-            
-            # Cases by status
-            status_stats = self.db.session.query(
-                Case.status, func.count(Case.id)
-            ).group_by(Case.status).all()
-            
-            # Cases by priority
-            priority_stats = self.db.session.query(
-                Case.priority, func.count(Case.id)
-            ).group_by(Case.priority).all()
+            # One filtered read of the daily rollup yields every figure below
+            summary = get_stats_rollup().summary(self.db.session, 'case', filters)
+            total_cases = summary['total']
+            status_stats = summary['by']['status']
+            priority_stats = summary['by']['priority']
             
             # Cases by category
-            category_stats = self.db.session.query(
-                Category.name, func.count(Case.id)
-            ).join(Case, Category.id == Case.category_id)\
-             .group_by(Category.name).all()
-            
-            # Monthly case creation trend (last 12 months)
-            twelve_months_ago = datetime.now() - timedelta(days=365)
-            monthly_stats = self.db.session.query(
-                func.extract('year', Case.created_at).label('year'),
-                func.extract('month', Case.created_at).label('month'),
-                func.count(Case.id).label('count')
-            ).filter(Case.created_at >= twelve_months_ago)\
-             .group_by('year', 'month')\
-             .order_by('year', 'month').all()
+            category_counts = summary['by']['category_id']
+            category_names = dict(
+                self.db.session.query(Category.id, Category.name)
+                               .filter(Category.id.in_([category_id for category_id in category_counts if category_id]))
+            ) if category_counts else {}
+            category_stats = {}
+            for category_id, count in category_counts.items():
+                if category_id in category_names:
+                    name = category_names[category_id]
+                    category_stats[name] = category_stats.get(name, 0) + count
+            
+            # Monthly case creation trend: the filtered date range, or the last 12 months without a start date
+            since = None if (filters or {}).get('date_from') else (datetime.now() - timedelta(days=365)).date()
+            monthly_counts = {}
+            for day, count in summary['daily']:
+                if since is None or day >= since:
+                    month = (day.year, day.month)
+                    monthly_counts[month] = monthly_counts.get(month, 0) + count
             
             return {
                 'success': True,
                 'statistics': {
                     'total_cases': total_cases,
-                    'by_status': dict(status_stats),
-                    'by_priority': dict(priority_stats),
-                    'by_category': dict(category_stats),
+                    'by_status': status_stats,
+                    'by_priority': priority_stats,
+                    'by_category': category_stats,
                     'monthly_trend': [
                         {
-                            'year': int(stat.year),
-                            'month': int(stat.month),
-                            'count': stat.count
-                        } for stat in monthly_stats
+                            'year': year,
+                            'month': month,
+                            'count': count
+                        } for (year, month), count in sorted(monthly_counts.items())
                     ]
                 }
             }
@@ -269,10 +371,27 @@ class JudgmentService(DatabaseService):
     """Judgment management service"""
     
     def create_judgment(self, judgment_data: Dict, created_by: int) -> Dict:
-        """Create a new judgment"""
+        """Create a new judgment, merging near-exact copies within its case and flagging other near-duplicates"""
         from models import Judgment
         
         try:
+            # Overlapping CSV exports resend the same judgment text; look it up by MinHash bands
+            signature = JudgmentDeduplicator.signature(judgment_data['content'])
+            match = JudgmentDeduplicator.find(self.db.session, signature)
+            existing = JudgmentDeduplicator.merge_target(self.db.session, match, judgment_data.get('case_id'))
+            
+            if existing is not None:
+                JudgmentDeduplicator.merge_into(existing, judgment_data)
+                self.db.session.commit()
+                
+                return {
+                    'success': True,
+                    'judgment_id': existing.id,
+                    'merged': True,
+                    'similarity': round(match[1], 3),
+                    'message': 'الحكم موجود مسبقاً وتم دمجه مع الحكم القائم'
+                }
+            
             judgment = Judgment(
                 case_id=judgment_data['case_id'],
                 title=judgment_data['title'],
@@ -290,7 +409,9 @@ class JudgmentService(DatabaseService):
                 keywords=judgment_data.get('keywords'),
                 notes=judgment_data.get('notes'),
                 court_id=judgment_data.get('court_id'),
-                created_by=created_by
+                created_by=created_by,
+                minhash=JudgmentDeduplicator.hasher.to_bytes(signature) if signature else None,
+                duplicate_of_id=match[0] if match else None
             )
             
             # Extract keywords from content if not provided
@@ -304,6 +425,7 @@ class JudgmentService(DatabaseService):
             return {
                 'success': True,
                 'judgment_id': judgment.id,
+                'duplicate_of': judgment.duplicate_of_id,
                 'message': 'تم إنشاء الحكم بنجاح'
             }
             
@@ -314,8 +436,9 @@ class JudgmentService(DatabaseService):
                 'error': f'حدث خطأ في إنشاء الحكم: {str(e)}'
             }
     
-    def search_judgments(self, query: str, filters: Dict = None, page: int = 1, per_page: int = 20) -> Dict:
-        """Search judgments with filters"""
+    def search_judgments(self, query: str, filters: Dict = None, page: int = 1, per_page: int = 20,
+                         cursor: str = None) -> Dict:
+        """Search judgments with filters; a cursor (empty for the first page) selects keyset pagination"""
         from models import Judgment, Case, Court
         
         try:
@@ -323,27 +446,11 @@ class JudgmentService(DatabaseService):
             base_query = Judgment.query.join(Case, Judgment.case_id == Case.id)\
                                      .join(Court, Judgment.court_id == Court.id, isouter=True)
             
-            # Apply search query
-            if query:
-                normalized_query = self.text_processor.normalize_arabic(query)
-                query_words = normalized_query.split()
-                
-                search_conditions = []
-                for word in query_words:
-                    if word:
-                        search_conditions.append(
-                            or_(
-                                Judgment.title.contains(word),
-                                Judgment.content.contains(word),
-                                Judgment.judge_name.contains(word),
-                                Judgment.legal_articles.contains(word),
-                                Judgment.keywords.contains(word),
-                                Case.case_number.contains(word)
-                            )
-                        )
-                
-                if search_conditions:
-                    base_query = base_query.filter(and_(*search_conditions))
+            # Run the query plan: text and fragment clauses on the indexes, field clauses in SQL
+            plan = self.plan_search(Judgment, 'judgment', query)
+            scores = plan.scores if plan else None
+            if plan:
+                base_query = plan.filter(base_query)
             
             # Apply filters
             if filters:
@@ -361,23 +468,41 @@ class JudgmentService(DatabaseService):
                 
                 if filters.get('date_to'):
                     base_query = base_query.filter(Judgment.judgment_date <= filters['date_to'])
-            
-            # Order by relevance and date
-            base_query = base_query.order_by(Judgment.judgment_date.desc())
-            
-            # Paginate
-            judgments = base_query.paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
+                
+                if filters.get('judge_name'):
+                    base_query = self.filter_fragment(Judgment, base_query, 'judgment', 'judge_name', filters['judge_name'])
+            
+            if scores is not None:
+                # Order by relevance
+                judgments = ranked_paginate(Judgment, base_query, scores, page, per_page,
+                                            filtered=bool(filters) or plan.clause is not None, cursor=cursor)
+                facets = self.facet_counts(Judgment, 'judgment', base_query, ranked=judgments, filters=filters,
+                                           restricted=plan.clause is not None)
+            else:
+                facets = self.facet_counts(Judgment, 'judgment', base_query, filters=filters,
+                                           restricted=plan is not None)
+                
+                if cursor is not None:
+                    # Seek by (judgment_date, id) instead of counting and skipping rows
+                    judgments = keyset_paginate(base_query, Judgment.judgment_date, Judgment.id, cursor, per_page,
+                                                'judgment.judgment_date', nullable=True)
+                else:
+                    # Order by date
+                    base_query = base_query.order_by(Judgment.judgment_date.desc())
+                    
+                    # Paginate; the total comes from a counter or a cached, capped count
+                    judgments = self.row_counter.paginate(Judgment, base_query, page, per_page,
+                                                          dict(filters or {}, query=query))
+            
+            # Only the best-matching window of each judgment is returned, highlighted
+            snippets = SnippetBuilder.for_texts(plan.ranking_texts if plan else [], length=500)
             
             return {
                 'success': True,
                 'judgments': [{
                     'id': judgment.id,
                     'title': judgment.title,
-                    'content': judgment.content[:500] + '...' if len(judgment.content) > 500 else judgment.content,
+                    'snippet': snippets.snippet(judgment.content),
                     'judgment_type': judgment.judgment_type,
                     'judgment_date': judgment.judgment_date.isoformat() if judgment.judgment_date else None,
                     'judge_name': judgment.judge_name,
@@ -393,16 +518,16 @@ class JudgmentService(DatabaseService):
                         'name': judgment.court.name
                     } if judgment.court else None
                 } for judgment in judgments.items],
-                'pagination': {
-                    'page': judgments.page,
-                    'pages': judgments.pages,
-                    'per_page': judgments.per_page,
-                    'total': judgments.total,
-                    'has_next': judgments.has_next,
-                    'has_prev': judgments.has_prev
-                }
+                'pagination': self.pagination_info(judgments),
+                'facets': facets,
+                'did_you_mean': self.did_you_mean(query, 'judgment', judgments)
             }
             
+        except (QueryParseError, CursorError) as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
         except Exception as e:
             return {
                 'success': False,
@@ -642,11 +767,81 @@ class NotificationService(DatabaseService):
                 'error': f'حدث خطأ في تحديث الإشعار: {str(e)}'
             }
 
+class NameMatchService(DatabaseService):
+    """Fuzzy lookup of party, court and category names"""
+    
+    # Fuzzy indexes are built once per process and extended as names are written
+    _indexes = {}
+    
+    def _load_names(self, kind: str) -> List[str]:
+        """Fetch the distinct names of one kind from the database"""
+        from models import Case, Court, Category
+        
+        if kind == 'party':
+            names = set()
+            for column in (Case.plaintiff, Case.defendant):
+                names.update(row[0] for row in self.db.session.query(column).distinct() if row[0])
+            return sorted(names)
+        
+        if kind == 'court':
+            return [row[0] for row in self.db.session.query(Court.name).filter(Court.is_active == True)]
+        
+        if kind == 'category':
+            return [row[0] for row in self.db.session.query(Category.name).filter(Category.is_active == True)]
+        
+        raise ValueError(f'Unknown name kind: {kind}')
+    
+    def get_index(self, kind: str) -> FuzzyMatchIndex:
+        """Return the fuzzy index for a kind of name, building it on first use"""
+        index = NameMatchService._indexes.get(kind)
+        if index is None:
+            index = FuzzyMatchIndex(self._load_names(kind))
+            NameMatchService._indexes[kind] = index
+        return index
+    
+    @classmethod
+    def add_names(cls, kind: str, names: List[str]):
+        """Add new names to an already built index"""
+        index = cls._indexes.get(kind)
+        if index is None:
+            return
+        for name in names:
+            if name and name not in index:
+                index.add(name)
+    
+    @classmethod
+    def invalidate(cls, kind: str = None):
+        """Drop cached indexes so they are rebuilt on next use"""
+        if kind:
+            cls._indexes.pop(kind, None)
+        else:
+            cls._indexes.clear()
+    
+    def match(self, kind: str, query: str, threshold: int = 60, limit: int = 10) -> Dict:
+        """Find names similar to the query"""
+        try:
+            matches = self.text_processor.fuzzy_search(query, self.get_index(kind), threshold)
+            
+            return {
+                'success': True,
+                'matches': [{
+                    'name': match['text'],
+                    'score': match['score']
+                } for match in matches[:limit]]
+            }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'حدث خطأ في البحث عن الأسماء: {str(e)}'
+            }
+
 # Export all services
 __all__ = [
     'CaseService',
     'JudgmentService', 
     'DocumentService',
     'UserService',
-    'NotificationService'
+    'NotificationService',
+    'NameMatchService'
 ]
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+"""
+Facet bitmaps for counting search results by status, type, court and category
+"""
+
+import os
+import sqlite3
+import struct
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from utils.search_index import InvertedIndex
+
+# Number of set bits in each byte value
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.int64)
+
+class RoaringBitmap:
+    """Compressed set of 32-bit ids in the roaring layout.
+
+    Ids are split by their high 16 bits into containers. A container with
+    up to ARRAY_LIMIT ids is a sorted uint16 array; a fuller one is an
+    8 KB bitset. Intersections only touch containers both sides share.
+    """
+
+    ARRAY_LIMIT = 4096
+    BITSET_BYTES = 8192
+
+    # Largest id range (in containers) turned into a dense boolean mask: 16M ids, 16 MB
+    MASK_CONTAINER_LIMIT = 256
+
+    # Serialized container kinds
+    ARRAY = 0
+    BITSET = 1
+
+    def __init__(self, containers: Dict[int, np.ndarray] = None):
+        self.containers = containers or {}
+        self._array = None
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> 'RoaringBitmap':
+        """Build a bitmap from any iterable of ids"""
+        if not isinstance(ids, np.ndarray):
+            count = len(ids) if hasattr(ids, '__len__') else -1
+            ids = np.fromiter(ids, dtype=np.int64, count=count)
+        if not ids.size:
+            return cls()
+
+        if int(ids.max()) >> 16 < cls.MASK_CONTAINER_LIMIT:
+            # Scatter into a mask instead of sorting
+            mask = np.zeros(((int(ids.max()) >> 16) + 1) << 16, dtype=bool)
+            mask[ids] = True
+            return cls.from_mask(mask)
+
+        values = np.unique(ids.astype(np.uint32))
+        containers = {}
+        boundaries = np.flatnonzero(np.diff(values >> 16)) + 1
+        for chunk in np.split(values, boundaries):
+            if chunk.size:
+                containers[int(chunk[0] >> 16)] = cls._container((chunk & 0xFFFF).astype(np.uint16))
+        return cls(containers)
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> 'RoaringBitmap':
+        """Build a bitmap from a boolean membership mask whose length is a multiple of 65536"""
+        containers = {}
+        for high in range(mask.size >> 16):
+            chunk = mask[high << 16:(high + 1) << 16]
+            count = np.count_nonzero(chunk)
+            if count > cls.ARRAY_LIMIT:
+                containers[high] = np.packbits(chunk, bitorder='little')
+            elif count:
+                containers[high] = np.flatnonzero(chunk).astype(np.uint16)
+        return cls(containers)
+
+    def to_mask(self) -> Optional[np.ndarray]:
+        """Dense boolean membership mask, or None when the id range is too wide"""
+        top = max(self.containers, default=-1)
+        if top >= self.MASK_CONTAINER_LIMIT:
+            return None
+
+        mask = np.zeros((top + 1) << 16, dtype=bool)
+        for high, container in self.containers.items():
+            base = high << 16
+            if self._is_bitset(container):
+                mask[base:base + (1 << 16)] = np.unpackbits(container, bitorder='little').view(bool)
+            else:
+                mask[base + container.astype(np.int64)] = True
+        return mask
+
+    @property
+    def is_sparse(self) -> bool:
+        """True when every container is an array"""
+        return not any(self._is_bitset(container) for container in self.containers.values())
+
+    @classmethod
+    def _container(cls, lows: np.ndarray) -> np.ndarray:
+        """Array or bitset container for sorted, distinct low halves"""
+        if lows.size <= cls.ARRAY_LIMIT:
+            return lows
+        bits = np.zeros(1 << 16, dtype=bool)
+        bits[lows] = True
+        return np.packbits(bits, bitorder='little')
+
+    @staticmethod
+    def _is_bitset(container: np.ndarray) -> bool:
+        return container.dtype == np.uint8
+
+    @classmethod
+    def _cardinality(cls, container: np.ndarray) -> int:
+        if cls._is_bitset(container):
+            return int(POPCOUNT[container].sum())
+        return int(container.size)
+
+    def __len__(self) -> int:
+        return sum(self._cardinality(container) for container in self.containers.values())
+
+    def __bool__(self) -> bool:
+        return bool(self.containers)
+
+    def __contains__(self, resource_id: int) -> bool:
+        container = self.containers.get(resource_id >> 16)
+        if container is None:
+            return False
+        low = resource_id & 0xFFFF
+        if self._is_bitset(container):
+            return bool(container[low >> 3] >> (low & 7) & 1)
+        index = np.searchsorted(container, low)
+        return index < container.size and container[index] == low
+
+    def add(self, resource_id: int):
+        """Add one id"""
+        self._array = None
+        high, low = resource_id >> 16, resource_id & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = np.array([low], dtype=np.uint16)
+        elif self._is_bitset(container):
+            container[low >> 3] |= 1 << (low & 7)
+        else:
+            index = np.searchsorted(container, low)
+            if index == container.size or container[index] != low:
+                self.containers[high] = self._container(np.insert(container, index, low))
+
+    def discard(self, resource_id: int):
+        """Remove one id if present"""
+        self._array = None
+        high, low = resource_id >> 16, resource_id & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            return
+
+        if self._is_bitset(container):
+            container[low >> 3] &= ~np.uint8(1 << (low & 7))
+            if self._cardinality(container) <= self.ARRAY_LIMIT:
+                # Shrunk enough to go back to an array
+                lows = np.flatnonzero(np.unpackbits(container, bitorder='little')).astype(np.uint16)
+                self._store(high, lows)
+        else:
+            index = np.searchsorted(container, low)
+            if index < container.size and container[index] == low:
+                self._store(high, np.delete(container, index))
+
+    def _store(self, high: int, lows: np.ndarray):
+        if lows.size:
+            self.containers[high] = lows
+        else:
+            del self.containers[high]
+
+    def to_array(self) -> np.ndarray:
+        """All ids in ascending order (cached until the bitmap changes)"""
+        if self._array is None:
+            parts = []
+            for high in sorted(self.containers):
+                container = self.containers[high]
+                if self._is_bitset(container):
+                    container = np.flatnonzero(np.unpackbits(container, bitorder='little'))
+                parts.append(container.astype(np.int64) | (high << 16))
+            self._array = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        return self._array
+
+    def count_in(self, mask: np.ndarray) -> int:
+        """Number of ids set in a boolean membership mask"""
+        ids = self.to_array()
+        ids = ids[:np.searchsorted(ids, mask.size)]
+        return int(np.count_nonzero(mask[ids]))
+
+    def intersection_count(self, other: 'RoaringBitmap') -> int:
+        """Size of the intersection, without materializing it"""
+        if len(other.containers) < len(self.containers):
+            self, other = other, self
+
+        total = 0
+        for high, left in self.containers.items():
+            right = other.containers.get(high)
+            if right is None:
+                continue
+            left_bitset, right_bitset = self._is_bitset(left), self._is_bitset(right)
+            if left_bitset and right_bitset:
+                total += int(POPCOUNT[left & right].sum())
+            elif left_bitset or right_bitset:
+                lows, bits = (right, left) if left_bitset else (left, right)
+                total += int(np.count_nonzero(bits[lows >> 3] >> (lows & 7).astype(np.uint8) & 1))
+            else:
+                total += int(np.intersect1d(left, right, assume_unique=True).size)
+        return total
+
+    def intersection(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        """Ids present in both bitmaps"""
+        containers = {}
+        for high, left in self.containers.items():
+            right = other.containers.get(high)
+            if right is None:
+                continue
+            left_bitset, right_bitset = self._is_bitset(left), self._is_bitset(right)
+            if left_bitset and right_bitset:
+                bits = left & right
+                if self._cardinality(bits) > self.ARRAY_LIMIT:
+                    containers[high] = bits
+                    continue
+                lows = np.flatnonzero(np.unpackbits(bits, bitorder='little')).astype(np.uint16)
+            elif left_bitset or right_bitset:
+                lows, bits = (right, left) if left_bitset else (left, right)
+                lows = lows[(bits[lows >> 3] >> (lows & 7).astype(np.uint8) & 1).astype(bool)]
+            else:
+                lows = np.intersect1d(left, right, assume_unique=True)
+            if lows.size:
+                containers[high] = lows
+        return RoaringBitmap(containers)
+
+    def to_bytes(self) -> bytes:
+        """Serialize as a container count followed by (high, kind, size, payload) entries"""
+        parts = [struct.pack('<I', len(self.containers))]
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if self._is_bitset(container):
+                parts.append(struct.pack('<HBI', high, self.BITSET, container.size))
+                parts.append(container.tobytes())
+            else:
+                parts.append(struct.pack('<HBI', high, self.ARRAY, container.size))
+                parts.append(container.astype('<u2').tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> 'RoaringBitmap':
+        """Inverse of to_bytes"""
+        (count,) = struct.unpack_from('<I', blob, 0)
+        offset = 4
+        containers = {}
+        for _ in range(count):
+            high, kind, size = struct.unpack_from('<HBI', blob, offset)
+            offset += struct.calcsize('<HBI')
+            if kind == cls.BITSET:
+                containers[high] = np.frombuffer(blob, dtype=np.uint8, count=size, offset=offset).copy()
+                offset += size
+            else:
+                containers[high] = np.frombuffer(blob, dtype='<u2', count=size, offset=offset).astype(np.uint16)
+                offset += size * 2
+        return cls(containers)
+
+class FacetIndex:
+    """Per-value id bitmaps of categorical fields, stored next to the search index.
+
+    Facet counts for a result set are intersection counts of the result
+    bitmap with each value bitmap, so no GROUP BY runs per facet.
+    """
+
+    # Facet columns of each resource type
+    FACETS = {
+        'case': ('status', 'priority', 'case_type', 'court_id', 'category_id'),
+        'judgment': ('status', 'judgment_type', 'court_level', 'court_id'),
+    }
+
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path or InvertedIndex.DEFAULT_PATH
+        self.lock = threading.Lock()
+
+        # Bitmaps loaded per resource type, with the version they were loaded at
+        self.bitmaps = {}
+        self.versions = {}
+
+        index_dir = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.init_schema()
+
+    def init_schema(self):
+        """Create the facet tables"""
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS facet_bitmaps (
+                    resource_type TEXT NOT NULL,
+                    facet TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    bitmap BLOB NOT NULL,
+                    PRIMARY KEY (resource_type, facet, value)
+                ) WITHOUT ROWID
+            ''')
+
+            # Current facet values of each document, used to update the bitmaps
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS facet_values (
+                    resource_type TEXT NOT NULL,
+                    resource_id INTEGER NOT NULL,
+                    facet TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (resource_type, resource_id, facet)
+                ) WITHOUT ROWID
+            ''')
+
+            # Bumped on every write so other processes reload their bitmaps
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS facet_versions (
+                    resource_type TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            ''')
+            self.conn.commit()
+
+    @staticmethod
+    def value_key(value) -> Optional[str]:
+        """Stored form of a facet value; None for values that are not counted"""
+        if value is None or value == '':
+            return None
+        return str(value)
+
+    @staticmethod
+    def values_for(resource_type: str, obj) -> Dict[str, object]:
+        """Extract the facet columns of a model row"""
+        return {facet: getattr(obj, facet, None) for facet in FacetIndex.FACETS[resource_type]}
+
+    def _version_locked(self, resource_type: str) -> int:
+        row = self.conn.execute(
+            'SELECT version FROM facet_versions WHERE resource_type = ?', (resource_type,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _begin_write_locked(self):
+        """Take the database write lock before the bitmaps are read (caller holds the lock).
+
+        Bitmaps are rewritten whole, so another process writing between our
+        read and our write would lose its changes; holding the write lock
+        from the start makes the version check in _load_locked current.
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def _load_locked(self, resource_type: str) -> Dict[str, Dict[str, RoaringBitmap]]:
+        """Bitmaps of a resource type, reloaded when another process changed them (caller holds the lock)"""
+        version = self._version_locked(resource_type)
+        if resource_type not in self.bitmaps or self.versions.get(resource_type) != version:
+            facets = {facet: {} for facet in self.FACETS[resource_type]}
+            rows = self.conn.execute(
+                'SELECT facet, value, bitmap FROM facet_bitmaps WHERE resource_type = ?', (resource_type,)
+            )
+            for facet, value, blob in rows:
+                facets.setdefault(facet, {})[value] = RoaringBitmap.from_bytes(blob)
+            self.bitmaps[resource_type] = facets
+            self.versions[resource_type] = version
+        return self.bitmaps[resource_type]
+
+    def _remove_locked(self, resource_type: str, resource_id: int, facets, dirty: set):
+        """Remove a document from its value bitmaps (caller holds the lock)"""
+        old_values = self.conn.execute(
+            'SELECT facet, value FROM facet_values WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        ).fetchall()
+        for facet, value in old_values:
+            bitmap = facets.get(facet, {}).get(value)
+            if bitmap is not None:
+                bitmap.discard(resource_id)
+                dirty.add((facet, value))
+        self.conn.execute(
+            'DELETE FROM facet_values WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        )
+
+    def _write_locked(self, resource_type: str, facets, dirty: set):
+        """Persist changed bitmaps and bump the version (caller holds the lock)"""
+        for facet, value in dirty:
+            bitmap = facets[facet].get(value)
+            if bitmap:
+                self.conn.execute(
+                    '''INSERT OR REPLACE INTO facet_bitmaps (resource_type, facet, value, bitmap)
+                       VALUES (?, ?, ?, ?)''',
+                    (resource_type, facet, value, bitmap.to_bytes())
+                )
+            else:
+                facets[facet].pop(value, None)
+                self.conn.execute(
+                    'DELETE FROM facet_bitmaps WHERE resource_type = ? AND facet = ? AND value = ?',
+                    (resource_type, facet, value)
+                )
+
+        version = self._version_locked(resource_type) + 1
+        self.conn.execute(
+            'INSERT OR REPLACE INTO facet_versions (resource_type, version) VALUES (?, ?)',
+            (resource_type, version)
+        )
+        self.versions[resource_type] = version
+
+    def index_document(self, resource_type: str, resource_id: int, values: Dict[str, object]):
+        """Add or replace a single document"""
+        self.index_documents(resource_type, [(resource_id, values)])
+
+    def index_documents(self, resource_type: str, documents: Iterable[Tuple[int, Dict[str, object]]]):
+        """Add or replace a batch of documents in one transaction"""
+        with self.lock:
+            try:
+                self._begin_write_locked()
+                facets = self._load_locked(resource_type)
+                dirty = set()
+                for resource_id, values in documents:
+                    self._remove_locked(resource_type, resource_id, facets, dirty)
+                    rows = []
+                    for facet in self.FACETS[resource_type]:
+                        value = self.value_key(values.get(facet))
+                        if value is None:
+                            continue
+                        facets[facet].setdefault(value, RoaringBitmap()).add(resource_id)
+                        dirty.add((facet, value))
+                        rows.append((resource_type, resource_id, facet, value))
+                    self.conn.executemany(
+                        'INSERT INTO facet_values (resource_type, resource_id, facet, value) VALUES (?, ?, ?, ?)',
+                        rows
+                    )
+                self._write_locked(resource_type, facets, dirty)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                # The in-memory bitmaps may hold the failed changes
+                self.bitmaps.pop(resource_type, None)
+                raise
+
+    def remove_document(self, resource_type: str, resource_id: int):
+        """Remove a document from the index"""
+        with self.lock:
+            try:
+                self._begin_write_locked()
+                facets = self._load_locked(resource_type)
+                dirty = set()
+                self._remove_locked(resource_type, resource_id, facets, dirty)
+                self._write_locked(resource_type, facets, dirty)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                self.bitmaps.pop(resource_type, None)
+                raise
+
+    def clear(self, resource_type: str = None):
+        """Drop all facet data, optionally for one resource type only"""
+        with self.lock:
+            for table in ('facet_bitmaps', 'facet_values'):
+                if resource_type:
+                    self.conn.execute(f'DELETE FROM {table} WHERE resource_type = ?', (resource_type,))
+                else:
+                    self.conn.execute(f'DELETE FROM {table}')
+
+            for cleared in ([resource_type] if resource_type else list(self.FACETS)):
+                self.bitmaps.pop(cleared, None)
+                self.conn.execute(
+                    '''INSERT OR REPLACE INTO facet_versions (resource_type, version)
+                       VALUES (?, COALESCE((SELECT version FROM facet_versions WHERE resource_type = ?), 0) + 1)''',
+                    (cleared, cleared)
+                )
+            self.conn.commit()
+
+    def selection(self, resource_type: str, values: Dict[str, object]) -> RoaringBitmap:
+        """Documents having every given facet value, from the stored value bitmaps"""
+        with self.lock:
+            bitmaps = self._load_locked(resource_type)
+            result = None
+            for facet, value in values.items():
+                bitmap = bitmaps.get(facet, {}).get(self.value_key(value))
+                if bitmap is None:
+                    return RoaringBitmap()
+                result = bitmap if result is None else result.intersection(bitmap)
+        # A copy, so later index writes cannot change the selection
+        if result is None:
+            return RoaringBitmap()
+        return RoaringBitmap({high: container.copy() for high, container in result.containers.items()})
+
+    def counts(self, resource_type: str, ids: Iterable[int] = None,
+               facets: Iterable[str] = None) -> Dict[str, Dict[str, int]]:
+        """Matching documents per value of each facet, most frequent first.
+
+        ``ids`` restricts the counts to a result set; None counts every
+        indexed document.
+        """
+        selection = mask = None
+        if ids is not None:
+            selection = ids if isinstance(ids, RoaringBitmap) else RoaringBitmap.from_ids(ids)
+            mask = selection.to_mask()
+
+        result = {}
+        with self.lock:
+            bitmaps = self._load_locked(resource_type)
+            for facet in facets or self.FACETS[resource_type]:
+                counts = {}
+                for value, bitmap in bitmaps.get(facet, {}).items():
+                    if selection is None:
+                        count = len(bitmap)
+                    elif mask is not None and bitmap.is_sparse:
+                        # Rare values: one lookup of their ids in the result mask
+                        count = bitmap.count_in(mask)
+                    else:
+                        count = bitmap.intersection_count(selection)
+                    if count:
+                        counts[value] = count
+                result[facet] = dict(sorted(counts.items(), key=lambda item: -item[1]))
+        return result
+
+_facet_indexes = {}
+_facet_indexes_lock = threading.Lock()
+
+def get_facet_index(index_path: str = None) -> FacetIndex:
+    """Return the shared facet index instance for a path"""
+    path = index_path or InvertedIndex.DEFAULT_PATH
+    with _facet_indexes_lock:
+        if path not in _facet_indexes:
+            _facet_indexes[path] = FacetIndex(path)
+        return _facet_indexes[path]
+
+# Export facet index classes
+__all__ = [
+    'RoaringBitmap',
+    'FacetIndex',
+    'get_facet_index'
+]
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+MinHash signatures and LSH banding for near-duplicate judgment detection
+"""
+
+import hashlib
+import struct
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+class MinHasher:
+    """One-permutation MinHash signatures over word shingles.
+
+    Each shingle is hashed once and kept as the minimum of one of
+    NUM_HASHES bins; empty bins borrow the next filled bin, so two texts
+    agree in a fraction of slots that estimates their Jaccard similarity.
+    Standard library only, so the standalone servers can use it too.
+    """
+
+    NUM_HASHES = 128
+    SHINGLE_SIZE = 3
+
+    # 16 bands of 8 rows: pairs above ~0.7 similarity almost always share a band
+    BANDS = 16
+
+    # Added per bin when an empty bin borrows from a neighbour
+    BORROW_OFFSET = 1 << 32
+
+    def __init__(self, num_hashes: int = NUM_HASHES, shingle_size: int = SHINGLE_SIZE, bands: int = BANDS):
+        if num_hashes % bands:
+            raise ValueError('num_hashes must be a multiple of bands')
+        self.num_hashes = num_hashes
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.format = f'<{num_hashes}Q'
+
+    def shingles(self, tokens: Sequence[str]) -> set:
+        """Distinct word n-grams of a token sequence"""
+        size = self.shingle_size
+        if len(tokens) <= size:
+            return {' '.join(tokens)} if tokens else set()
+        return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+    def signature(self, tokens: Sequence[str]) -> Optional[Tuple[int, ...]]:
+        """MinHash signature of a token sequence; None when there is nothing to hash"""
+        shingles = self.shingles(tokens)
+        if not shingles:
+            return None
+
+        bins = [None] * self.num_hashes
+        for shingle in shingles:
+            value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+            slot = value % self.num_hashes
+            value >>= 32
+            if bins[slot] is None or value < bins[slot]:
+                bins[slot] = value
+
+        # Densify: an empty bin takes the next filled bin's value, shifted by the distance
+        for slot in range(self.num_hashes):
+            if bins[slot] is None:
+                for distance in range(1, self.num_hashes):
+                    value = bins[(slot + distance) % self.num_hashes]
+                    if value is not None and value < self.BORROW_OFFSET:
+                        bins[slot] = value + distance * self.BORROW_OFFSET
+                        break
+        return tuple(bins)
+
+    def band_keys(self, signature: Sequence[int]) -> List[int]:
+        """One signed 64-bit bucket key per band; the band number is part of the key"""
+        keys = []
+        for band in range(self.bands):
+            chunk = struct.pack(f'<H{self.rows}Q', band, *signature[band * self.rows:(band + 1) * self.rows])
+            keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'little', signed=True))
+        return keys
+
+    @staticmethod
+    def similarity(left: Sequence[int], right: Sequence[int]) -> float:
+        """Estimated Jaccard similarity: share of equal slots"""
+        if not left or not right:
+            return 0.0
+        return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+    def to_bytes(self, signature: Sequence[int]) -> bytes:
+        return struct.pack(self.format, *signature)
+
+    def from_bytes(self, blob: bytes) -> Optional[Tuple[int, ...]]:
+        if not blob or len(blob) != struct.calcsize(self.format):
+            return None
+        return struct.unpack(self.format, blob)
+
+class MinHashLSH:
+    """In-memory band index: two signatures are candidates when they share a band"""
+
+    def __init__(self, hasher: MinHasher = None):
+        self.hasher = hasher or MinHasher()
+        self.buckets: Dict[int, List[Hashable]] = {}
+        self.signatures: Dict[Hashable, Tuple[int, ...]] = {}
+
+    def insert(self, key: Hashable, signature: Sequence[int]):
+        """Add a signature under a key"""
+        self.signatures[key] = tuple(signature)
+        for bucket in self.hasher.band_keys(signature):
+            self.buckets.setdefault(bucket, []).append(key)
+
+    def candidates(self, signature: Sequence[int]) -> set:
+        """Keys sharing at least one band with the signature"""
+        found = set()
+        for bucket in self.hasher.band_keys(signature):
+            found.update(self.buckets.get(bucket, ()))
+        return found
+
+    def best_match(self, signature: Sequence[int], threshold: float) -> Optional[Tuple[Hashable, float]]:
+        """Most similar indexed key at or above the threshold"""
+        best = None
+        for key in self.candidates(signature):
+            score = self.hasher.similarity(signature, self.signatures[key])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+class JudgmentDeduplicator:
+    """Near-duplicate lookup for judgments through the persisted band table.
+
+    Only canonical judgments (not flagged as duplicates) are banded, so
+    every candidate found is the row a duplicate should point at.
+    """
+
+    # Estimated similarity at which a new judgment is flagged, and at which it is merged instead
+    FLAG_THRESHOLD = 0.8
+    MERGE_THRESHOLD = 0.95
+
+    # Fields a merged duplicate may fill in on the kept judgment
+    MERGE_FIELDS = ('judge_name', 'court_level', 'court_id', 'appeal_status', 'judgment_amount',
+                    'fees_awarded', 'legal_articles', 'precedents', 'keywords', 'notes')
+
+    hasher = MinHasher()
+
+    @classmethod
+    def signature(cls, content: str) -> Optional[Tuple[int, ...]]:
+        """Signature of judgment content (normalized, unstemmed tokens)"""
+        from utils.text_processing import ArabicTextProcessor
+        return cls.hasher.signature(ArabicTextProcessor.tokenize(content, stem=False))
+
+    @classmethod
+    def band_rows(cls, judgment_id: int, signature: Sequence[int]) -> List[Dict]:
+        """Rows of the band table for a judgment"""
+        return [{'bucket': bucket, 'judgment_id': judgment_id} for bucket in cls.hasher.band_keys(signature)]
+
+    @classmethod
+    def find(cls, connection, signature: Sequence[int], exclude_id: int = None) -> Optional[Tuple[int, float]]:
+        """Best canonical judgment at or above FLAG_THRESHOLD, as (id, similarity)"""
+        from sqlalchemy import select
+        from models import Judgment, JudgmentMinHashBand
+
+        if not signature:
+            return None
+
+        candidate_ids = set(connection.execute(
+            select(JudgmentMinHashBand.judgment_id)
+            .where(JudgmentMinHashBand.bucket.in_(cls.hasher.band_keys(signature)))
+        ).scalars())
+        candidate_ids.discard(exclude_id)
+        if not candidate_ids:
+            return None
+
+        best = None
+        rows = connection.execute(
+            select(Judgment.id, Judgment.minhash).where(Judgment.id.in_(candidate_ids))
+        )
+        for judgment_id, blob in rows:
+            score = cls.hasher.similarity(signature, cls.hasher.from_bytes(blob))
+            if score >= cls.FLAG_THRESHOLD and (best is None or score > best[1]):
+                best = (judgment_id, score)
+        return best
+
+    @classmethod
+    def merge_target(cls, session, match: Optional[Tuple[int, float]], case_id) -> Optional[object]:
+        """Judgment a new one may be merged into: a near-exact match filed under the same case, else None"""
+        from models import Judgment
+
+        if not match or match[1] < cls.MERGE_THRESHOLD or case_id in (None, ''):
+            return None
+        existing = session.get(Judgment, match[0])
+        if existing is None or existing.case_id is None:
+            return None
+        try:
+            same_case = int(existing.case_id) == int(case_id)
+        except (TypeError, ValueError):
+            return None
+        # A matching ruling of another case is only flagged; merging would leave that case without it
+        return existing if same_case else None
+
+    @classmethod
+    def merge_into(cls, judgment, data: Dict) -> List[str]:
+        """Fill empty fields of a kept judgment from a duplicate's data; returns the fields set"""
+        filled = []
+        for field in cls.MERGE_FIELDS:
+            if getattr(judgment, field, None) in (None, '') and data.get(field) not in (None, ''):
+                setattr(judgment, field, data[field])
+                filled.append(field)
+        return filled
+
+# Export near-duplicate detection classes
+__all__ = [
+    'MinHasher',
+    'MinHashLSH',
+    'JudgmentDeduplicator'
+]
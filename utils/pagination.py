@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset (seek) pagination with opaque cursor tokens
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Dict, List, Optional, Sequence
+
+class CursorError(ValueError):
+    """Raised when a pagination cursor is malformed or belongs to another ordering"""
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        raise ValueError('unknown cursor value')
+    return value
+
+def encode_cursor(ordering: str, values: Sequence[Any]) -> str:
+    """Opaque token for the sort key of the last row of a page"""
+    payload = json.dumps({'o': ordering, 'v': [_encode_value(value) for value in values]},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token: str, ordering: str, size: int = 2) -> List[Any]:
+    """Sort key values of a cursor issued for the given ordering"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if payload['o'] != ordering or len(payload['v']) != size:
+            raise ValueError('cursor ordering mismatch')
+        return [_decode_value(value) for value in payload['v']]
+    except (ValueError, TypeError, KeyError, AttributeError, UnicodeError):
+        raise CursorError('مؤشر الصفحة غير صالح')
+
+class KeysetPagination:
+    """Page of rows after a cursor; no COUNT(*) and no OFFSET, so every page costs the same"""
+
+    def __init__(self, items: List, per_page: int, next_cursor: Optional[str] = None,
+                 cursor: Optional[str] = None, total: Optional[int] = None, ids=None, matched=None):
+        self.items = items
+        self.ids = ids
+        self.matched = matched
+        self.per_page = per_page
+        self.total = total  # only set when it is known without counting
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        self.has_prev = bool(cursor)
+
+    def to_dict(self) -> dict:
+        """Pagination block of an API response"""
+        return {
+            'per_page': self.per_page,
+            'total': self.total,
+            'cursor': self.cursor,
+            'next_cursor': self.next_cursor,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev
+        }
+
+def keyset_paginate(query, column, id_column, cursor: Optional[str], per_page: int,
+                    ordering: str, nullable: bool = False) -> KeysetPagination:
+    """Newest-first page of a query ordered by (column, id), continuing after a cursor.
+
+    The seek condition is spelled out with OR/AND rather than a row-value
+    comparison so MySQL and SQLite both range-scan the column's index,
+    whose entries already end with the primary key. For nullable columns,
+    NULLs come last in descending order, as on MySQL and SQLite.
+    """
+    # Imported here so the standalone servers can use the cursor helpers without SQLAlchemy
+    from sqlalchemy import and_, or_
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, ordering)
+        if value is None:
+            query = query.filter(and_(column.is_(None), id_column < last_id))
+        else:
+            condition = or_(column < value, and_(column == value, id_column < last_id))
+            if nullable:
+                condition = or_(condition, column.is_(None))
+            query = query.filter(condition)
+
+    rows = query.order_by(None).order_by(column.desc(), id_column.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(ordering, [getattr(last, column.key), getattr(last, id_column.key)])
+
+    return KeysetPagination(rows, per_page, next_cursor=next_cursor, cursor=cursor or None)
+
+class RankedPagination:
+    """Page of rows ordered by relevance, shaped like Flask-SQLAlchemy's Pagination.
+
+    ids are the hits left after filtering, or None when the filters were
+    only checked far enough to fill the page; total is then a lower bound
+    (exact is False) and matched holds the unfiltered hits.
+    """
+
+    def __init__(self, items: List, page: int, per_page: int, total: int, ids=None, exact: bool = True,
+                 has_next: Optional[bool] = None, matched=None):
+        self.items = items
+        self.ids = ids
+        self.matched = matched
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.exact = exact
+        self.pages = max((total + per_page - 1) // per_page if per_page else 0, page if not exact else 0)
+        self.has_prev = page > 1
+        self.has_next = has_next if has_next is not None else page < self.pages
+
+    @property
+    def total_display(self) -> str:
+        """Total as shown to users: "40+" when only part of the hits were filtered"""
+        return f'{self.total:,}' if self.exact else f'{self.total:,}+'
+
+def ranked_paginate(model, query, scores: Dict[int, float], page: int, per_page: int,
+                    filtered: bool = False, cursor: Optional[str] = None):
+    """Paginate search hits by relevance, loading only the rows of the requested page.
+
+    With a cursor (empty for the first page) hits are ranked by (score, id)
+    and the page starts after the cursor's hit instead of at an offset.
+    Structured filters are checked in the database on the best hits only,
+    a bounded chunk of ids at a time, until the page is full.
+    """
+    from utils.search_index import InvertedIndex
+    from utils.search_query import filter_ids
+
+    page = max(page, 1)
+
+    hits = scores
+    if cursor:
+        last_score, last_id = decode_cursor(cursor, 'relevance')
+        hits = {resource_id: score for resource_id, score in scores.items()
+                if score < last_score or (score == last_score and resource_id < last_id)}
+    offset = 0 if cursor is not None else (page - 1) * per_page
+
+    # One hit past the page tells whether another page follows
+    candidates = InvertedIndex.ranked(hits)
+    if filtered:
+        ranked, exhausted = filter_ids(query, model.id, candidates, offset + per_page + 1)
+    else:
+        ranked, exhausted = list(islice(candidates, offset + per_page + 1)), True
+    page_ids = ranked[offset:offset + per_page]
+    has_next = len(ranked) > offset + per_page
+
+    # The filtered hits are only all known when every hit was checked
+    if not filtered:
+        ids = scores.keys()
+    elif exhausted and not cursor:
+        ids = ranked
+    else:
+        ids = None
+
+    rows = {}
+    if page_ids:
+        rows = {row.id: row for row in query.filter(model.id.in_(page_ids)).all()}
+    items = [rows[resource_id] for resource_id in page_ids if resource_id in rows]
+
+    if cursor is not None:
+        next_cursor = encode_cursor('relevance', [hits[page_ids[-1]], page_ids[-1]]) if has_next else None
+        return KeysetPagination(
+            items=items,
+            per_page=per_page,
+            next_cursor=next_cursor,
+            cursor=cursor or None,
+            total=len(ids) if ids is not None else None,
+            ids=ids,
+            matched=scores.keys()
+        )
+
+    return RankedPagination(
+        items=items,
+        page=page,
+        per_page=per_page,
+        total=len(ids) if ids is not None else len(ranked),
+        ids=ids,
+        exact=ids is not None,
+        has_next=has_next,
+        matched=scores.keys()
+    )
+
+# Export pagination helpers
+__all__ = [
+    'CursorError',
+    'encode_cursor',
+    'decode_cursor',
+    'KeysetPagination',
+    'keyset_paginate',
+    'RankedPagination',
+    'ranked_paginate'
+]
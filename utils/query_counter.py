@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Count the SQL statements a block of code runs, to catch N+1 loading
+"""
+
+from typing import Callable, Dict, Iterable, List
+
+from sqlalchemy import event
+
+class QueryCounter:
+    """Context manager counting statements executed on an engine while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+        return False
+
+def count_queries(engine, call: Callable, *args, **kwargs) -> int:
+    """Number of statements one call runs"""
+    with QueryCounter(engine) as counter:
+        call(*args, **kwargs)
+    return counter.count
+
+def assert_queries_constant(engine, call: Callable[[int], object], sizes: Iterable[int] = (5, 50)) -> Dict[int, int]:
+    """Run call(size) for each page size; raise AssertionError if the statement count grows with it.
+
+    Each size is run twice and the second run is counted, so one-time work
+    such as seeding counters or loading indexes does not show up as growth.
+    """
+    counts = {}
+    for size in sizes:
+        call(size)
+        counts[size] = count_queries(engine, call, size)
+
+    smallest = counts[min(counts)]
+    grown = {size: count for size, count in counts.items() if count > smallest}
+    if grown:
+        raise AssertionError(f'query count grows with page size: {counts}')
+    return counts
+
+# Export query counting helpers
+__all__ = [
+    'QueryCounter',
+    'count_queries',
+    'assert_queries_constant'
+]
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+SQL profiling: per-request query counts and database time, and a rotating slow-query log
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+class QueryProfiler:
+    """Times every statement run through SQLAlchemy while enabled.
+
+    Each request collects its query count, total database time and its
+    slowest statements; the totals go out as X-Query-Count and X-DB-Time
+    response headers and into per-endpoint aggregates. Statements slower
+    than the threshold are written with their parameters, and an EXPLAIN
+    of SELECTs if requested, to a rotating log. summary() reports the
+    endpoints with the most queries per request and the statement shapes
+    with the most database time, which is where N+1 loading and unindexed
+    LIKE scans show up.
+    """
+
+    SLOWEST_PER_REQUEST = 5
+    RECENT_SLOW = 50
+    MAX_STATEMENTS = 500
+
+    # Literals are dropped so the same statement shape aggregates together
+    LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    PLACEHOLDER = r'(?:\?|%s|%\(\w+\)s|:\w+)'
+    IN_LISTS = re.compile(r'\bIN\s*\(\s*' + PLACEHOLDER + r'(?:\s*,\s*' + PLACEHOLDER + r')*\s*\)', re.IGNORECASE)
+    SPACES = re.compile(r'\s+')
+
+    def __init__(self, slow_threshold: float = 1.0, log_file: Optional[str] = None,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, explain: bool = False):
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started_at = time.time()
+        self.endpoints: Dict[str, Dict] = {}
+        self.statements: 'OrderedDict[str, Dict]' = OrderedDict()
+        self.recent_slow = deque(maxlen=self.RECENT_SLOW)
+        self.enabled = False
+
+        self.logger = logging.getLogger('slow_queries')
+
+    def _open_log(self):
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.log_file or self.logger.handlers:
+            return
+        directory = os.path.dirname(self.log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(self.log_file, maxBytes=self.max_bytes, backupCount=self.backup_count,
+                                      encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.logger.addHandler(handler)
+
+    def init_app(self, app):
+        """Time every engine's statements and every request of the app"""
+        if self.enabled:
+            return
+        self._open_log()
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        self.enabled = True
+
+    @classmethod
+    def fingerprint(cls, statement: str) -> str:
+        """Statement with literals and IN lists collapsed"""
+        statement = cls.LITERALS.sub('?', statement)
+        statement = cls.IN_LISTS.sub('IN (...)', statement)
+        return cls.SPACES.sub(' ', statement).strip()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start_time')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if conn.info.get('explaining'):
+            return
+
+        request = getattr(self.local, 'request', None)
+        if request is not None:
+            request['count'] += 1
+            request['time'] += elapsed
+            slowest = request['slowest']
+            if len(slowest) < self.SLOWEST_PER_REQUEST or elapsed > slowest[-1]['time']:
+                slowest.append({'time': elapsed, 'statement': statement, 'parameters': repr(parameters)[:2000]})
+                slowest.sort(key=lambda entry: -entry['time'])
+                del slowest[self.SLOWEST_PER_REQUEST:]
+
+        self._record_statement(statement, elapsed)
+        if elapsed >= self.slow_threshold:
+            self._log_slow(conn, statement, parameters, elapsed, executemany)
+
+    def _record_statement(self, statement: str, elapsed: float):
+        key = self.fingerprint(statement)
+        with self.lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = {'count': 0, 'time': 0.0, 'max_time': 0.0}
+                while len(self.statements) > self.MAX_STATEMENTS:
+                    self.statements.popitem(last=False)
+            else:
+                self.statements.move_to_end(key)
+            stats['count'] += 1
+            stats['time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def _explain(self, conn, statement: str, parameters) -> Optional[List]:
+        if not self.explain or not statement.lstrip().upper().startswith('SELECT'):
+            return None
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        conn.info['explaining'] = True
+        try:
+            return [tuple(row) for row in conn.exec_driver_sql(prefix + statement, parameters)]
+        except Exception as e:
+            return [f'EXPLAIN failed: {e}']
+        finally:
+            conn.info['explaining'] = False
+
+    def _log_slow(self, conn, statement: str, parameters, elapsed: float, executemany: bool):
+        request = getattr(self.local, 'request', None)
+        entry = {
+            'time': round(elapsed, 4),
+            'endpoint': request['endpoint'] if request else None,
+            'statement': statement,
+            'parameters': repr(parameters)[:2000],
+        }
+        plan = None if executemany else self._explain(conn, statement, parameters)
+        if plan is not None:
+            entry['plan'] = plan
+
+        with self.lock:
+            self.recent_slow.append(dict(entry, at=time.time()))
+        self.logger.info('%.4fs %s %s params=%s%s', elapsed, entry['endpoint'] or '-',
+                         self.SPACES.sub(' ', statement), entry['parameters'],
+                         f' plan={plan}' if plan is not None else '')
+
+    def _start_request(self):
+        from flask import request
+        self.local.request = {
+            'endpoint': request.endpoint or request.path,
+            'count': 0,
+            'time': 0.0,
+            'slowest': [],
+        }
+
+    def _finish_request(self, response):
+        profile = getattr(self.local, 'request', None)
+        self.local.request = None
+        if profile is None:
+            return response
+
+        response.headers['X-Query-Count'] = str(profile['count'])
+        response.headers['X-DB-Time'] = f"{profile['time'] * 1000:.1f}ms"
+
+        with self.lock:
+            stats = self.endpoints.setdefault(profile['endpoint'], {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'time': 0.0, 'max_time': 0.0, 'slowest': []
+            })
+            stats['requests'] += 1
+            stats['queries'] += profile['count']
+            stats['max_queries'] = max(stats['max_queries'], profile['count'])
+            stats['time'] += profile['time']
+            stats['max_time'] = max(stats['max_time'], profile['time'])
+            slowest = stats['slowest'] + profile['slowest']
+            slowest.sort(key=lambda entry: -entry['time'])
+            stats['slowest'] = slowest[:self.SLOWEST_PER_REQUEST]
+        return response
+
+    def summary(self, limit: int = 20) -> Dict:
+        """Endpoints by queries per request, statement shapes by total time, and recent slow queries"""
+        with self.lock:
+            endpoints = [{
+                'endpoint': endpoint,
+                'requests': stats['requests'],
+                'avg_queries': round(stats['queries'] / stats['requests'], 2),
+                'max_queries': stats['max_queries'],
+                'avg_db_time_ms': round(stats['time'] * 1000 / stats['requests'], 2),
+                'max_db_time_ms': round(stats['max_time'] * 1000, 2),
+                'slowest': [dict(entry, time=round(entry['time'], 4)) for entry in stats['slowest']]
+            } for endpoint, stats in self.endpoints.items()]
+            statements = [{
+                'statement': statement,
+                'count': stats['count'],
+                'total_time_ms': round(stats['time'] * 1000, 2),
+                'avg_time_ms': round(stats['time'] * 1000 / stats['count'], 3),
+                'max_time_ms': round(stats['max_time'] * 1000, 2)
+            } for statement, stats in self.statements.items()]
+            recent_slow = list(self.recent_slow)
+
+        endpoints.sort(key=lambda entry: -entry['avg_queries'])
+        statements.sort(key=lambda entry: -entry['total_time_ms'])
+        return {
+            'enabled': self.enabled,
+            'since': self.started_at,
+            'slow_threshold': self.slow_threshold,
+            'endpoints': endpoints[:limit],
+            'statements': statements[:limit],
+            'slow_queries': recent_slow[-limit:][::-1]
+        }
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+            self.statements.clear()
+            self.recent_slow.clear()
+            self.started_at = time.time()
+
+# Export query profiling classes
+__all__ = [
+    'QueryProfiler'
+]
@@ -0,0 +1,833 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent inverted index for case and judgment full-text search
+"""
+
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from collections import defaultdict
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from utils.text_processing import ArabicTextProcessor
+
+class InvertedIndex:
+    """On-disk inverted index over normalized tokens of text fields"""
+
+    DEFAULT_PATH = 'search_index.db'
+
+    # Bump when the on-disk layout changes; old files are reset and must be rebuilt
+    SCHEMA_VERSION = 5
+
+    # Text fields indexed for each resource type
+    INDEXED_FIELDS = {
+        'case': ('title', 'description', 'case_number', 'plaintiff', 'defendant', 'legal_basis'),
+        'judgment': ('title', 'content', 'judge_name', 'legal_articles', 'keywords', 'case_number'),
+        'document': ('original_filename', 'description', 'extracted_text'),
+    }
+
+    # BM25F field weights (title > keywords > content)
+    FIELD_WEIGHTS = {
+        'title': 3.0,
+        'case_number': 2.5,
+        'keywords': 2.0,
+        'original_filename': 2.0,
+        'plaintiff': 1.5,
+        'defendant': 1.5,
+        'judge_name': 1.5,
+        'legal_articles': 1.5,
+        'legal_basis': 1.2,
+        'description': 1.0,
+        'content': 1.0,
+        'extracted_text': 1.0,
+    }
+
+    # BM25 parameters
+    K1 = 1.2
+    B = 0.75
+
+    # Query syntax: quoted phrases, NEAR/n proximity operators and plain words
+    QUERY_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+    NEAR_OPERATOR = re.compile(r'^NEAR(?:/(\d+))?$')
+    DEFAULT_NEAR_DISTANCE = 10
+
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path or self.DEFAULT_PATH
+        self.lock = threading.Lock()
+
+        index_dir = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.init_schema()
+
+    def init_schema(self):
+        """Create the postings and statistics tables"""
+        with self.lock:
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                for table in ('postings', 'field_lengths', 'term_stats', 'surface_forms', 'field_stats',
+                              'document_stats'):
+                    self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    resource_type TEXT NOT NULL,
+                    resource_id INTEGER NOT NULL,
+                    field TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    positions BLOB NOT NULL,
+                    surfaces TEXT NOT NULL,
+                    PRIMARY KEY (term, resource_type, resource_id, field)
+                ) WITHOUT ROWID
+            ''')
+
+            # Lookup by document, used when a row is re-indexed or removed
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_postings_document
+                ON postings(resource_type, resource_id)
+            ''')
+
+            # Token count of every indexed field of every document
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS field_lengths (
+                    resource_type TEXT NOT NULL,
+                    resource_id INTEGER NOT NULL,
+                    field TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (resource_type, resource_id, field)
+                ) WITHOUT ROWID
+            ''')
+
+            # Number of documents containing each term
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS term_stats (
+                    term TEXT NOT NULL,
+                    resource_type TEXT NOT NULL,
+                    doc_freq INTEGER NOT NULL,
+                    PRIMARY KEY (term, resource_type)
+                ) WITHOUT ROWID
+            ''')
+
+            # Number of documents writing each normalized token in a given way (before normalization)
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS surface_forms (
+                    token TEXT NOT NULL,
+                    resource_type TEXT NOT NULL,
+                    surface TEXT NOT NULL,
+                    doc_freq INTEGER NOT NULL,
+                    PRIMARY KEY (token, resource_type, surface)
+                ) WITHOUT ROWID
+            ''')
+
+            # Totals used for average field lengths
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS field_stats (
+                    resource_type TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    total_length INTEGER NOT NULL,
+                    doc_count INTEGER NOT NULL,
+                    PRIMARY KEY (resource_type, field)
+                ) WITHOUT ROWID
+            ''')
+
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS document_stats (
+                    resource_type TEXT PRIMARY KEY,
+                    doc_count INTEGER NOT NULL
+                )
+            ''')
+
+            self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+            self.conn.commit()
+
+    @staticmethod
+    def case_fields(case) -> Dict[str, str]:
+        """Extract indexed text fields from a Case row"""
+        return {field: getattr(case, field, None) for field in InvertedIndex.INDEXED_FIELDS['case']}
+
+    @staticmethod
+    def judgment_fields(judgment) -> Dict[str, str]:
+        """Extract indexed text fields from a Judgment row"""
+        fields = {
+            field: getattr(judgment, field, None)
+            for field in InvertedIndex.INDEXED_FIELDS['judgment']
+            if field != 'case_number'
+        }
+        case = getattr(judgment, 'case', None)
+        fields['case_number'] = case.case_number if case else None
+        return fields
+
+    @staticmethod
+    def surface_form(word: str) -> str:
+        """A word as written, without diacritics and punctuation; normalize_arabic() of it is its token"""
+        return ArabicTextProcessor.ARABIC_DIACRITICS.sub('', ArabicTextProcessor.remove_punctuation(word))
+
+    @classmethod
+    def _analyze(cls, fields: Dict[str, str]) -> Tuple[Dict[str, Dict[str, List[int]]],
+                                                       Dict[str, Dict[str, Set[str]]]]:
+        """Tokenize every non-empty field into the token positions of each term, and the words written for it"""
+        analyzed = {}
+        surfaces = {}
+        for field, text in fields.items():
+            if not text:
+                continue
+            text = str(text)
+            positions = defaultdict(list)
+            written = defaultdict(set)
+            for position, (token, start, end) in enumerate(ArabicTextProcessor.token_spans(text, stem=False)):
+                term = ArabicTextProcessor.stem(token)
+                positions[term].append(position)
+                written[term].add(cls.surface_form(text[start:end]))
+            if positions:
+                analyzed[field] = positions
+                surfaces[field] = written
+        return analyzed, surfaces
+
+    @staticmethod
+    def _encode_positions(positions: List[int]) -> bytes:
+        return array('I', positions).tobytes()
+
+    @staticmethod
+    def _decode_positions(blob: bytes) -> array:
+        positions = array('I')
+        positions.frombytes(blob)
+        return positions
+
+    def _remove_locked(self, resource_type: str, resource_id: int):
+        """Remove a document and roll back its statistics (caller holds the lock)"""
+        old_lengths = self.conn.execute(
+            'SELECT field, length FROM field_lengths WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        ).fetchall()
+        if not old_lengths:
+            return
+
+        old_postings = self.conn.execute(
+            'SELECT term, surfaces FROM postings WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        ).fetchall()
+        old_terms = [(term,) for term in {term for term, _ in old_postings}]
+        old_surfaces = [
+            (ArabicTextProcessor.normalize_arabic(surface), resource_type, surface)
+            for surface in {surface for _, surfaces in old_postings for surface in surfaces.split()}
+        ]
+
+        self.conn.executemany(
+            'UPDATE term_stats SET doc_freq = doc_freq - 1 WHERE term = ? AND resource_type = ?',
+            [(term, resource_type) for (term,) in old_terms]
+        )
+        self.conn.executemany(
+            'DELETE FROM term_stats WHERE term = ? AND resource_type = ? AND doc_freq <= 0',
+            [(term, resource_type) for (term,) in old_terms]
+        )
+        self.conn.executemany(
+            'UPDATE surface_forms SET doc_freq = doc_freq - 1 WHERE token = ? AND resource_type = ? AND surface = ?',
+            old_surfaces
+        )
+        self.conn.executemany(
+            'DELETE FROM surface_forms WHERE token = ? AND resource_type = ? AND surface = ? AND doc_freq <= 0',
+            old_surfaces
+        )
+        self.conn.executemany(
+            '''UPDATE field_stats SET total_length = total_length - ?, doc_count = doc_count - 1
+               WHERE resource_type = ? AND field = ?''',
+            [(length, resource_type, field) for field, length in old_lengths]
+        )
+        self.conn.execute(
+            'UPDATE document_stats SET doc_count = doc_count - 1 WHERE resource_type = ?',
+            (resource_type,)
+        )
+        self.conn.execute(
+            'DELETE FROM postings WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        )
+        self.conn.execute(
+            'DELETE FROM field_lengths WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        )
+
+    def _add_locked(self, resource_type: str, resource_id: int, fields: Dict[str, str]):
+        """Insert a document and its statistics (caller holds the lock)"""
+        analyzed, surfaces = self._analyze(fields)
+        if not analyzed:
+            return
+
+        self.conn.executemany(
+            '''INSERT INTO postings (term, resource_type, resource_id, field, tf, positions, surfaces)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            [(term, resource_type, resource_id, field, len(positions), self._encode_positions(positions),
+              ' '.join(sorted(surfaces[field][term])))
+             for field, terms in analyzed.items()
+             for term, positions in terms.items()]
+        )
+
+        lengths = [
+            (field, sum(len(positions) for positions in terms.values()))
+            for field, terms in analyzed.items()
+        ]
+        self.conn.executemany(
+            'INSERT INTO field_lengths (resource_type, resource_id, field, length) VALUES (?, ?, ?, ?)',
+            [(resource_type, resource_id, field, length) for field, length in lengths]
+        )
+
+        terms = set()
+        for field_terms in analyzed.values():
+            terms.update(field_terms)
+        self.conn.executemany(
+            '''INSERT INTO term_stats (term, resource_type, doc_freq) VALUES (?, ?, 1)
+               ON CONFLICT (term, resource_type) DO UPDATE SET doc_freq = doc_freq + 1''',
+            [(term, resource_type) for term in terms]
+        )
+        written = set()
+        for field_terms in surfaces.values():
+            for words in field_terms.values():
+                written.update(words)
+        self.conn.executemany(
+            '''INSERT INTO surface_forms (token, resource_type, surface, doc_freq) VALUES (?, ?, ?, 1)
+               ON CONFLICT (token, resource_type, surface) DO UPDATE SET doc_freq = doc_freq + 1''',
+            [(ArabicTextProcessor.normalize_arabic(surface), resource_type, surface) for surface in written]
+        )
+        self.conn.executemany(
+            '''INSERT INTO field_stats (resource_type, field, total_length, doc_count) VALUES (?, ?, ?, 1)
+               ON CONFLICT (resource_type, field)
+               DO UPDATE SET total_length = total_length + excluded.total_length, doc_count = doc_count + 1''',
+            [(resource_type, field, length) for field, length in lengths]
+        )
+        self.conn.execute(
+            '''INSERT INTO document_stats (resource_type, doc_count) VALUES (?, 1)
+               ON CONFLICT (resource_type) DO UPDATE SET doc_count = doc_count + 1''',
+            (resource_type,)
+        )
+
+    def index_document(self, resource_type: str, resource_id: int, fields: Dict[str, str]):
+        """Add or replace a single document in the index"""
+        self.index_documents(resource_type, [(resource_id, fields)])
+
+    def index_documents(self, resource_type: str, documents: Iterable[Tuple[int, Dict[str, str]]]):
+        """Add or replace a batch of documents in one transaction"""
+        with self.lock:
+            try:
+                for resource_id, fields in documents:
+                    self._remove_locked(resource_type, resource_id)
+                    self._add_locked(resource_type, resource_id, fields)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def remove_document(self, resource_type: str, resource_id: int):
+        """Remove a document from the index"""
+        with self.lock:
+            try:
+                self._remove_locked(resource_type, resource_id)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def clear(self, resource_type: str = None):
+        """Drop all postings, optionally for one resource type only"""
+        with self.lock:
+            for table in ('postings', 'field_lengths', 'term_stats', 'surface_forms', 'field_stats',
+                          'document_stats'):
+                if resource_type:
+                    self.conn.execute(f'DELETE FROM {table} WHERE resource_type = ?', (resource_type,))
+                else:
+                    self.conn.execute(f'DELETE FROM {table}')
+            self.conn.commit()
+
+    def vocabulary(self, min_doc_freq: int = 1) -> List[Tuple[str, str, int]]:
+        """Indexed terms as (term, resource_type, doc_freq) rows"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT term, resource_type, doc_freq FROM term_stats WHERE doc_freq >= ?',
+                (min_doc_freq,)
+            ).fetchall()
+
+    def surface_forms(self) -> List[Tuple[str, str, str, int]]:
+        """Indexed ways of writing each normalized token as (token, resource_type, surface, doc_freq) rows"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT token, resource_type, surface, doc_freq FROM surface_forms'
+            ).fetchall()
+
+    @classmethod
+    def parse_query(cls, query: str) -> Tuple[Set[str], List[List[str]], List[Tuple[str, str, int]]]:
+        """Split a query into its terms, quoted phrases and NEAR/n constraints.
+
+        Every term is required. Phrases must appear as consecutive tokens of
+        one field; NEAR/n allows at most n tokens between its operands.
+        """
+        terms = set()
+        phrases = []
+        nears = []
+        operands = []
+        pending_near = None
+
+        for phrase, word in cls.QUERY_TOKEN.findall(query or ''):
+            near = cls.NEAR_OPERATOR.match(word) if word else None
+            if near:
+                if operands:
+                    pending_near = int(near.group(1)) if near.group(1) else cls.DEFAULT_NEAR_DISTANCE
+                continue
+
+            tokens = ArabicTextProcessor.tokenize(phrase if phrase else word)
+            if not tokens:
+                continue
+            terms.update(tokens)
+            if phrase and len(tokens) > 1:
+                phrases.append(tokens)
+            if pending_near is not None:
+                nears.append((operands[-1][-1], tokens[0], pending_near))
+                pending_near = None
+            operands.append(tokens)
+
+        return terms, phrases, nears
+
+    def _term_positions(self, resource_type: str, term: str,
+                        candidates: Set[int]) -> Dict[Tuple[int, str], array]:
+        """Position lists of a term per (document, field), restricted to candidates"""
+        positions = {}
+        for resource_id, field, blob in self.conn.execute(
+            'SELECT resource_id, field, positions FROM postings WHERE term = ? AND resource_type = ?',
+            (term, resource_type)
+        ):
+            if resource_id in candidates:
+                positions[(resource_id, field)] = self._decode_positions(blob)
+        return positions
+
+    def _phrase_documents(self, resource_type: str, tokens: List[str], candidates: Set[int]) -> Set[int]:
+        """Documents where the tokens occur consecutively within one field"""
+        starts = None
+        for offset, term in enumerate(tokens):
+            postings = self._term_positions(resource_type, term, candidates)
+            if starts is None:
+                starts = {key: set(positions) for key, positions in postings.items()}
+            else:
+                starts = {
+                    key: matched
+                    for key, phrase_starts in starts.items() if key in postings
+                    for matched in [phrase_starts.intersection(p - offset for p in postings[key])]
+                    if matched
+                }
+            if not starts:
+                return set()
+            candidates = {resource_id for resource_id, _ in starts}
+        return candidates
+
+    @staticmethod
+    def _within(left: array, right: array, distance: int) -> bool:
+        """Merge two sorted position lists looking for a pair at most distance tokens apart"""
+        i = j = 0
+        while i < len(left) and j < len(right):
+            if abs(left[i] - right[j]) <= distance + 1:
+                return True
+            if left[i] < right[j]:
+                i += 1
+            else:
+                j += 1
+        return False
+
+    def _near_documents(self, resource_type: str, left: str, right: str,
+                        distance: int, candidates: Set[int]) -> Set[int]:
+        """Documents where two terms occur close together within one field"""
+        left_postings = self._term_positions(resource_type, left, candidates)
+        right_postings = self._term_positions(resource_type, right, candidates)
+        return {
+            resource_id for (resource_id, field), positions in left_postings.items()
+            if (resource_id, field) in right_postings
+            and self._within(positions, right_postings[(resource_id, field)], distance)
+        }
+
+    def _apply_positional(self, resource_type: str, phrases: List[List[str]],
+                          nears: List[Tuple[str, str, int]], candidates: Set[int]) -> Set[int]:
+        """Narrow candidates to documents satisfying every phrase and NEAR constraint"""
+        for tokens in phrases:
+            if not candidates:
+                break
+            candidates = self._phrase_documents(resource_type, tokens, candidates)
+        for left, right, distance in nears:
+            if not candidates:
+                break
+            candidates = self._near_documents(resource_type, left, right, distance, candidates)
+        return candidates
+
+    def _documents_for_term(self, resource_type: str, term: str) -> Set[int]:
+        """Fetch the ids of documents containing a term in any field"""
+        rows = self.conn.execute(
+            'SELECT DISTINCT resource_id FROM postings WHERE term = ? AND resource_type = ?',
+            (term, resource_type)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def estimate(self, resource_type: str, query: str) -> Optional[int]:
+        """Upper bound on the number of matches: the document frequency of the rarest term.
+
+        Returns None when the query has no searchable tokens.
+        """
+        terms, _, _ = self.parse_query(query)
+        if not terms:
+            return None
+
+        with self.lock:
+            doc_freqs = []
+            for term in terms:
+                row = self.conn.execute(
+                    'SELECT doc_freq FROM term_stats WHERE term = ? AND resource_type = ?',
+                    (term, resource_type)
+                ).fetchone()
+                if not row:
+                    return 0
+                doc_freqs.append(row[0])
+
+        return min(doc_freqs)
+
+    def search(self, resource_type: str, query: str) -> Optional[Set[int]]:
+        """Return ids of documents matching every query term, phrase and NEAR constraint.
+
+        Returns None when the query has no searchable tokens, so callers
+        can skip text filtering altogether.
+        """
+        terms, phrases, nears = self.parse_query(query)
+        if not terms:
+            return None
+
+        with self.lock:
+            result = None
+            for term in terms:
+                matches = self._documents_for_term(resource_type, term)
+                result = matches if result is None else result & matches
+                if not result:
+                    return set()
+
+            return self._apply_positional(resource_type, phrases, nears, result)
+
+    def score(self, resource_type: str, query: str) -> Optional[Dict[int, float]]:
+        """BM25F scores of the documents matching every query term, phrase and NEAR constraint.
+
+        Returns None when the query has no searchable tokens.
+        """
+        terms, phrases, nears = self.parse_query(query)
+        if not terms:
+            return None
+
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT doc_count FROM document_stats WHERE resource_type = ?',
+                (resource_type,)
+            ).fetchone()
+            total_docs = row[0] if row else 0
+            if not total_docs:
+                return {}
+
+            avg_lengths = {
+                field: total_length / doc_count
+                for field, total_length, doc_count in self.conn.execute(
+                    'SELECT field, total_length, doc_count FROM field_stats WHERE resource_type = ?',
+                    (resource_type,)
+                )
+                if doc_count
+            }
+
+            # Rarest terms first so the candidate set shrinks as early as possible
+            doc_freqs = {}
+            for term in terms:
+                row = self.conn.execute(
+                    'SELECT doc_freq FROM term_stats WHERE term = ? AND resource_type = ?',
+                    (term, resource_type)
+                ).fetchone()
+                if not row:
+                    return {}
+                doc_freqs[term] = row[0]
+
+            scores = None
+            for term in sorted(terms, key=doc_freqs.get):
+                idf = math.log(1 + (total_docs - doc_freqs[term] + 0.5) / (doc_freqs[term] + 0.5))
+
+                weighted_tf = defaultdict(float)
+                for resource_id, field, tf, length in self.conn.execute(
+                    '''SELECT p.resource_id, p.field, p.tf, l.length
+                       FROM postings p
+                       JOIN field_lengths l ON l.resource_type = p.resource_type
+                            AND l.resource_id = p.resource_id AND l.field = p.field
+                       WHERE p.term = ? AND p.resource_type = ?''',
+                    (term, resource_type)
+                ):
+                    if scores is not None and resource_id not in scores:
+                        continue
+                    avg_length = avg_lengths.get(field) or 1.0
+                    norm = 1 - self.B + self.B * length / avg_length
+                    weighted_tf[resource_id] += self.FIELD_WEIGHTS.get(field, 1.0) * tf / norm
+
+                term_scores = {
+                    resource_id: idf * wtf / (self.K1 + wtf)
+                    for resource_id, wtf in weighted_tf.items()
+                }
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        resource_id: scores[resource_id] + term_score
+                        for resource_id, term_score in term_scores.items()
+                    }
+                if not scores:
+                    return {}
+
+            if phrases or nears:
+                matched = self._apply_positional(resource_type, phrases, nears, set(scores))
+                scores = {resource_id: score for resource_id, score in scores.items() if resource_id in matched}
+
+        return scores or {}
+
+    @staticmethod
+    def top_k(scores: Dict[int, float], k: int, offset: int = 0) -> List[int]:
+        """Select the ids ranked offset..offset+k by score with a bounded heap"""
+        if not scores or k <= 0:
+            return []
+        best = heapq.nlargest(offset + k, scores.items(), key=itemgetter(1))
+        return [resource_id for resource_id, _ in best[offset:]]
+
+    @staticmethod
+    def ranked(scores: Dict[int, float]) -> Iterator[int]:
+        """Ids by descending (score, id), popped lazily from a heap so only the ids consumed are ordered"""
+        heap = [(-score, -resource_id) for resource_id, score in scores.items()]
+        heapq.heapify(heap)
+        while heap:
+            yield -heapq.heappop(heap)[1]
+
+class TrigramIndex:
+    """Trigram posting index for substring lookup on short identifier fields"""
+
+    # Fields that users search by fragment (partial case numbers, party names)
+    INDEXED_FIELDS = {
+        'case': ('case_number', 'plaintiff', 'defendant', 'lawyer_name'),
+        'judgment': ('judge_name',),
+    }
+
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path or InvertedIndex.DEFAULT_PATH
+        self.lock = threading.Lock()
+
+        index_dir = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.init_schema()
+
+    def init_schema(self):
+        """Create the trigram tables"""
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS trigram_postings (
+                    trigram TEXT NOT NULL,
+                    resource_type TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    resource_id INTEGER NOT NULL,
+                    PRIMARY KEY (trigram, resource_type, field, resource_id)
+                ) WITHOUT ROWID
+            ''')
+
+            # Normalized field values, used to verify candidates
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS trigram_values (
+                    resource_type TEXT NOT NULL,
+                    resource_id INTEGER NOT NULL,
+                    field TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (resource_type, resource_id, field)
+                ) WITHOUT ROWID
+            ''')
+            self.conn.commit()
+
+    @staticmethod
+    def normalize(text) -> str:
+        """Normalize a value or fragment, keeping separators such as '-'"""
+        return ArabicTextProcessor.normalize_arabic(str(text)) if text else ''
+
+    @staticmethod
+    def trigrams(text: str) -> Set[str]:
+        """Distinct trigrams of a normalized string"""
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    @staticmethod
+    def boost(scores: Dict[int, float], ids: Iterable[int]) -> Dict[int, float]:
+        """Add fragment matches to BM25 scores, each worth the best text score rather than a fixed amount"""
+        weight = max(scores.values(), default=0.0) or 1.0
+        for resource_id in ids:
+            scores[resource_id] = scores.get(resource_id, 0.0) + weight
+        return scores
+
+    @staticmethod
+    def fields_for(resource_type: str, obj) -> Dict[str, str]:
+        """Extract trigram-indexed fields from a model row"""
+        return {field: getattr(obj, field, None) for field in TrigramIndex.INDEXED_FIELDS[resource_type]}
+
+    def _remove_locked(self, resource_type: str, resource_id: int):
+        """Remove a document (caller holds the lock)"""
+        old_values = self.conn.execute(
+            'SELECT field, value FROM trigram_values WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        ).fetchall()
+        for field, value in old_values:
+            self.conn.executemany(
+                '''DELETE FROM trigram_postings
+                   WHERE trigram = ? AND resource_type = ? AND field = ? AND resource_id = ?''',
+                [(trigram, resource_type, field, resource_id) for trigram in self.trigrams(value)]
+            )
+        self.conn.execute(
+            'DELETE FROM trigram_values WHERE resource_type = ? AND resource_id = ?',
+            (resource_type, resource_id)
+        )
+
+    def index_document(self, resource_type: str, resource_id: int, fields: Dict[str, str]):
+        """Add or replace a single document"""
+        self.index_documents(resource_type, [(resource_id, fields)])
+
+    def index_documents(self, resource_type: str, documents: Iterable[Tuple[int, Dict[str, str]]]):
+        """Add or replace a batch of documents in one transaction"""
+        with self.lock:
+            try:
+                for resource_id, fields in documents:
+                    self._remove_locked(resource_type, resource_id)
+                    for field, text in fields.items():
+                        value = self.normalize(text)
+                        if not value:
+                            continue
+                        self.conn.execute(
+                            'INSERT INTO trigram_values (resource_type, resource_id, field, value) VALUES (?, ?, ?, ?)',
+                            (resource_type, resource_id, field, value)
+                        )
+                        self.conn.executemany(
+                            '''INSERT OR IGNORE INTO trigram_postings (trigram, resource_type, field, resource_id)
+                               VALUES (?, ?, ?, ?)''',
+                            [(trigram, resource_type, field, resource_id) for trigram in self.trigrams(value)]
+                        )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def remove_document(self, resource_type: str, resource_id: int):
+        """Remove a document from the index"""
+        with self.lock:
+            try:
+                self._remove_locked(resource_type, resource_id)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def clear(self, resource_type: str = None):
+        """Drop all trigram data, optionally for one resource type only"""
+        with self.lock:
+            for table in ('trigram_postings', 'trigram_values'):
+                if resource_type:
+                    self.conn.execute(f'DELETE FROM {table} WHERE resource_type = ?', (resource_type,))
+                else:
+                    self.conn.execute(f'DELETE FROM {table}')
+            self.conn.commit()
+
+    def _trigram_sizes_locked(self, resource_type: str, grams: Set[str], fields: Tuple[str, ...]) -> Dict[str, int]:
+        """Posting list length of each trigram (caller holds the lock)"""
+        field_marks = ', '.join('?' for _ in fields)
+        return {
+            trigram: self.conn.execute(
+                f'''SELECT COUNT(*) FROM trigram_postings
+                    WHERE trigram = ? AND resource_type = ? AND field IN ({field_marks})''',
+                (trigram, resource_type) + fields
+            ).fetchone()[0]
+            for trigram in grams
+        }
+
+    def estimate(self, resource_type: str, fragment: str, fields: Iterable[str] = None) -> Optional[int]:
+        """Upper bound on the number of matches: the rarest trigram's posting count.
+
+        Returns None for fragments the trigram index cannot serve.
+        """
+        grams = self.trigrams(self.normalize(fragment).strip())
+        if not grams:
+            return None
+
+        fields = tuple(fields or self.INDEXED_FIELDS[resource_type])
+        with self.lock:
+            return min(self._trigram_sizes_locked(resource_type, grams, fields).values())
+
+    def search(self, resource_type: str, fragment: str, fields: Iterable[str] = None) -> Optional[Set[int]]:
+        """Return ids whose field values contain the fragment.
+
+        Returns None for fragments shorter than three characters, which the
+        trigram index cannot serve; callers fall back to a LIKE filter.
+        """
+        needle = self.normalize(fragment).strip()
+        grams = self.trigrams(needle)
+        if not grams:
+            return None
+
+        fields = tuple(fields or self.INDEXED_FIELDS[resource_type])
+        field_marks = ', '.join('?' for _ in fields)
+
+        with self.lock:
+            # Intersect the posting lists of the rarest trigrams first
+            sizes = self._trigram_sizes_locked(resource_type, grams, fields)
+
+            candidates = None
+            for trigram in sorted(grams, key=sizes.get):
+                if sizes[trigram] == 0:
+                    return set()
+                rows = self.conn.execute(
+                    f'''SELECT field, resource_id FROM trigram_postings
+                        WHERE trigram = ? AND resource_type = ? AND field IN ({field_marks})''',
+                    (trigram, resource_type) + fields
+                ).fetchall()
+                matches = set(rows)
+                candidates = matches if candidates is None else candidates & matches
+                if not candidates:
+                    return set()
+
+            # Trigrams only prove co-occurrence; verify the real substring
+            result = set()
+            for field, resource_id in candidates:
+                row = self.conn.execute(
+                    'SELECT value FROM trigram_values WHERE resource_type = ? AND resource_id = ? AND field = ?',
+                    (resource_type, resource_id, field)
+                ).fetchone()
+                if row and needle in row[0]:
+                    result.add(resource_id)
+
+        return result
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_search_index(index_path: str = None) -> InvertedIndex:
+    """Return the shared index instance for a path"""
+    path = index_path or InvertedIndex.DEFAULT_PATH
+    with _indexes_lock:
+        if ('inverted', path) not in _indexes:
+            _indexes[('inverted', path)] = InvertedIndex(path)
+        return _indexes[('inverted', path)]
+
+def get_trigram_index(index_path: str = None) -> TrigramIndex:
+    """Return the shared trigram index instance for a path"""
+    path = index_path or InvertedIndex.DEFAULT_PATH
+    with _indexes_lock:
+        if ('trigram', path) not in _indexes:
+            _indexes[('trigram', path)] = TrigramIndex(path)
+        return _indexes[('trigram', path)]
+
+# Export search index classes
+__all__ = [
+    'InvertedIndex',
+    'TrigramIndex',
+    'get_search_index',
+    'get_trigram_index'
+]
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental indexing pipeline that keeps the search tables in sync with the models
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from utils.text_processing import ArabicTextProcessor
+from utils.search_index import InvertedIndex, TrigramIndex, get_search_index, get_trigram_index
+from utils.facet_index import FacetIndex, get_facet_index
+
+logger = logging.getLogger(__name__)
+
+class SearchIndexer:
+    """Queues changed rows during a flush and indexes them in batches after commit"""
+
+    QUEUE_KEY = 'search_index_queue'
+    BATCH_SIZE = 500
+
+    # Text fields stored in the search_indexes table for each resource type
+    RESOURCE_FIELDS = {
+        'case': InvertedIndex.INDEXED_FIELDS['case'] + ('lawyer_name',),
+        'judgment': InvertedIndex.INDEXED_FIELDS['judgment'],
+        'document': InvertedIndex.INDEXED_FIELDS['document'],
+        'precedent': ('title', 'summary', 'full_text', 'legal_principle', 'keywords',
+                      'court_name', 'case_reference', 'cited_articles'),
+    }
+
+    # Column used to find rows changed since a point in time
+    CHANGE_COLUMNS = {
+        'case': 'updated_at',
+        'judgment': 'updated_at',
+        'document': 'updated_at',
+        'precedent': 'updated_at',
+    }
+
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path
+        self.registered = False
+
+    @staticmethod
+    def models() -> Dict:
+        """Indexed model classes by resource type"""
+        from models import Case, Judgment, Document, LegalPrecedent
+        return {
+            'case': Case,
+            'judgment': Judgment,
+            'document': Document,
+            'precedent': LegalPrecedent,
+        }
+
+    @property
+    def search_index(self) -> InvertedIndex:
+        return get_search_index(self.index_path)
+
+    @property
+    def trigram_index(self) -> TrigramIndex:
+        return get_trigram_index(self.index_path)
+
+    @property
+    def facet_index(self) -> FacetIndex:
+        return get_facet_index(self.index_path)
+
+    def register(self):
+        """Attach the SQLAlchemy event hooks"""
+        if self.registered:
+            return
+
+        for resource_type, model in self.models().items():
+            event.listen(model, 'after_insert', self._upsert_listener(resource_type))
+            event.listen(model, 'after_update', self._upsert_listener(resource_type))
+            event.listen(model, 'after_delete', self._delete_listener(resource_type))
+
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+        self.registered = True
+
+    def _upsert_listener(self, resource_type: str):
+        def listener(mapper, connection, target):
+            session = inspect(target).session
+            if session is None:
+                return
+            queue = session.info.setdefault(self.QUEUE_KEY, {})
+            queue[(resource_type, target.id)] = self.fields_for(resource_type, target, connection)
+        return listener
+
+    def _delete_listener(self, resource_type: str):
+        def listener(mapper, connection, target):
+            session = inspect(target).session
+            if session is None:
+                return
+            queue = session.info.setdefault(self.QUEUE_KEY, {})
+            queue[(resource_type, target.id)] = None
+        return listener
+
+    def _after_commit(self, session):
+        queue = session.info.pop(self.QUEUE_KEY, None)
+        if not queue:
+            return
+
+        # The committed session cannot emit SQL any more; index on a fresh connection
+        try:
+            self.apply(session.get_bind(), queue)
+        except Exception:
+            logger.exception('Failed to index %d changed rows; run database/reindex.py to catch up', len(queue))
+
+    def _after_rollback(self, session):
+        session.info.pop(self.QUEUE_KEY, None)
+
+    def fields_for(self, resource_type: str, target, connection=None) -> Dict[str, str]:
+        """Extract the indexed text fields and facet values of a row"""
+        fields = {
+            field: getattr(target, field, None)
+            for field in self.RESOURCE_FIELDS[resource_type]
+            if field != 'case_number' or resource_type == 'case'
+        }
+
+        if resource_type == 'judgment':
+            fields['case_number'] = self._judgment_case_number(target, connection)
+
+        if resource_type in FacetIndex.FACETS:
+            fields.update(FacetIndex.values_for(resource_type, target))
+
+        return fields
+
+    def _judgment_case_number(self, judgment, connection=None) -> Optional[str]:
+        """Case number of a judgment without lazy-loading inside a flush"""
+        state = inspect(judgment)
+        case = state.dict.get('case')
+        if case is not None:
+            return case.case_number
+        if judgment.case_id is None or connection is None:
+            return None
+
+        case_model = self.models()['case']
+        return connection.execute(
+            select(case_model.case_number).where(case_model.id == judgment.case_id)
+        ).scalar()
+
+    def apply(self, bind, changes: Dict[Tuple[str, int], Optional[Dict[str, str]]]):
+        """Write queued changes to the search_indexes table and the search index files"""
+        grouped = {}
+        for (resource_type, resource_id), fields in changes.items():
+            grouped.setdefault(resource_type, []).append((resource_id, fields))
+
+        for resource_type, items in grouped.items():
+            for start in range(0, len(items), self.BATCH_SIZE):
+                batch = items[start:start + self.BATCH_SIZE]
+                with bind.begin() as connection:
+                    self.write_search_rows(connection, resource_type, batch)
+                self.write_index_files(resource_type, batch)
+
+    def write_search_rows(self, connection, resource_type: str, batch: List[Tuple[int, Optional[Dict[str, str]]]]):
+        """Replace the search_indexes rows of a batch"""
+        from models import SearchIndex
+
+        table = SearchIndex.__table__
+        now = datetime.utcnow()
+
+        text_fields = self.RESOURCE_FIELDS[resource_type]
+        contents = [
+            (resource_id, '\n'.join(str(value) for field, value in fields.items()
+                                    if value and field in text_fields))
+            for resource_id, fields in batch if fields is not None
+        ]
+        normalized = ArabicTextProcessor.normalize_many(content for _, content in contents)
+
+        rows = [{
+            'resource_type': resource_type,
+            'resource_id': resource_id,
+            'content': content,
+            'normalized_content': normalized_content,
+            'keywords': ', '.join(ArabicTextProcessor.extract_keywords(content)),
+            'language': 'ar',
+            'last_indexed': now,
+        } for (resource_id, content), normalized_content in zip(contents, normalized)]
+
+        connection.execute(
+            table.delete().where(
+                table.c.resource_type == resource_type,
+                table.c.resource_id.in_([resource_id for resource_id, _ in batch])
+            )
+        )
+        if rows:
+            connection.execute(table.insert(), rows)
+
+    def write_index_files(self, resource_type: str, batch: List[Tuple[int, Optional[Dict[str, str]]]]):
+        """Update the inverted, trigram and facet indexes for a batch"""
+        if resource_type not in InvertedIndex.INDEXED_FIELDS:
+            return
+
+        # Documents are only full-text indexed; cases and judgments have trigrams and facets too
+        indexes = [(self.search_index, InvertedIndex.INDEXED_FIELDS[resource_type])]
+        if resource_type in TrigramIndex.INDEXED_FIELDS:
+            indexes.append((self.trigram_index, TrigramIndex.INDEXED_FIELDS[resource_type]))
+        if resource_type in FacetIndex.FACETS:
+            indexes.append((self.facet_index, FacetIndex.FACETS[resource_type]))
+
+        for resource_id, fields in batch:
+            if fields is None:
+                for index, _ in indexes:
+                    index.remove_document(resource_type, resource_id)
+
+        upserts = [(resource_id, fields) for resource_id, fields in batch if fields is not None]
+        if not upserts:
+            return
+
+        for index, columns in indexes:
+            index.index_documents(resource_type, [
+                (resource_id, {column: fields.get(column) for column in columns})
+                for resource_id, fields in upserts
+            ])
+
+    def clear(self, session, resource_type: str):
+        """Drop everything indexed for a resource type"""
+        from models import SearchIndex
+
+        SearchIndex.query.filter(SearchIndex.resource_type == resource_type).delete(synchronize_session=False)
+        session.commit()
+        self.search_index.clear(resource_type)
+        self.trigram_index.clear(resource_type)
+        self.facet_index.clear(resource_type)
+
+    def reindex(self, session, resource_type: str, since: datetime = None, stale: bool = False) -> int:
+        """Index rows in primary-key ordered batches.
+
+        Rows changed since a point in time, or with stale=True the rows
+        changed after their own search_indexes row was written (or never
+        indexed), so a failed batch is retried however old its rows are.
+        """
+        from models import SearchIndex
+
+        model = self.models()[resource_type]
+        change_column = getattr(model, self.CHANGE_COLUMNS[resource_type])
+
+        total = 0
+        last_id = 0
+        while True:
+            query = model.query.filter(model.id > last_id)
+            if since is not None:
+                query = query.filter(change_column >= since)
+            if stale:
+                query = query.outerjoin(SearchIndex, and_(SearchIndex.resource_type == resource_type,
+                                                          SearchIndex.resource_id == model.id))\
+                             .filter(or_(SearchIndex.id.is_(None), change_column > SearchIndex.last_indexed))
+            rows = query.order_by(model.id).limit(self.BATCH_SIZE).all()
+            if not rows:
+                break
+
+            connection = session.connection()
+            batch = [(row.id, self.fields_for(resource_type, row, connection)) for row in rows]
+            self.write_search_rows(connection, resource_type, batch)
+            session.commit()
+            self.write_index_files(resource_type, batch)
+
+            total += len(rows)
+            last_id = rows[-1].id
+            session.expunge_all()
+
+        return total
+
+# Export indexing pipeline
+__all__ = [
+    'SearchIndexer'
+]
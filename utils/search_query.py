@@ -0,0 +1,536 @@
+# -*- coding: utf-8 -*-
+"""
+Search query language compiled into an execution plan over the search indexes
+
+Syntax: free text (with "quoted phrases" and NEAR/n), field clauses such as
+judge:name, court:name, type:value, status:value and date:[2020-01-01 TO 2021-12-31],
+-exclusion (or NOT), OR and parentheses. Adjacent clauses are ANDed.
+"""
+
+import re
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, not_, or_, select
+
+class QueryParseError(ValueError):
+    """Raised when a search query cannot be parsed or uses an unsupported field"""
+
+# Fields understood by the parser, per resource type: (kind, column)
+QUERY_FIELDS = {
+    'judgment': {
+        'judge': ('fragment', 'judge_name'),
+        'court': ('court', 'court_id'),
+        'type': ('equals', 'judgment_type'),
+        'status': ('equals', 'status'),
+        'date': ('range', 'judgment_date'),
+    },
+    'case': {
+        'court': ('court', 'court_id'),
+        'type': ('equals', 'case_type'),
+        'status': ('equals', 'status'),
+        'date': ('range', 'case_date'),
+    },
+}
+
+FIELD_NAMES = {name for fields in QUERY_FIELDS.values() for name in fields}
+
+# Most ids written into one SQL IN list (SQLite's default limit was 999 variables)
+MAX_SQL_IDS = 900
+
+# Most rows a structured clause is expanded to when it has to be combined with index ids as a set
+MAX_CLAUSE_IDS = 10000
+
+# Estimated cost of clauses that are pushed down to the database as SQL
+SQL_CLAUSE_COST = 0
+UNKNOWN_COST = float('inf')
+
+Match = Tuple[Optional[Set[int]], Optional[object], Optional[Set[int]]]
+
+def filter_ids(query, id_column, ids: Iterable[int], wanted: Optional[int] = None) -> Tuple[List[int], bool]:
+    """Ids that also match a query's filters, in the order given, checked MAX_SQL_IDS at a time.
+
+    Stops once wanted ids are found. Returns the ids and whether every
+    given id was checked.
+    """
+    query = query.order_by(None).with_entities(id_column)
+    iterator = iter(ids)
+    found = []
+    while wanted is None or len(found) < wanted:
+        chunk = list(islice(iterator, MAX_SQL_IDS))
+        if not chunk:
+            return found, True
+        allowed = {row[0] for row in query.filter(id_column.in_(chunk))}
+        found.extend(resource_id for resource_id in chunk if resource_id in allowed)
+    return found, next(iterator, None) is None
+
+class QueryContext:
+    """Indexes and model a query is executed against, with per-query caches"""
+
+    def __init__(self, model, resource_type: str, search_index, trigram_index):
+        self.model = model
+        self.resource_type = resource_type
+        self.search_index = search_index
+        self.trigram_index = trigram_index
+        self.fields = QUERY_FIELDS.get(resource_type, {})
+        self.text_scores = {}
+
+    def score(self, text: str) -> Optional[Dict[int, float]]:
+        """BM25 scores of a free-text clause, computed once per query"""
+        if text not in self.text_scores:
+            self.text_scores[text] = self.search_index.score(self.resource_type, text)
+        return self.text_scores[text]
+
+    def clause_ids(self, clause) -> Set[int]:
+        """Ids of the rows matching a structured clause (None for every row), up to MAX_CLAUSE_IDS"""
+        query = self.model.query.with_entities(self.model.id)
+        if clause is not None:
+            query = query.filter(clause)
+        ids = {row[0] for row in query.limit(MAX_CLAUSE_IDS + 1)}
+        if len(ids) > MAX_CLAUSE_IDS:
+            raise QueryParseError('البحث واسع جداً: أضف كلمات أو حقولاً لتضييق النتائج')
+        return ids
+
+    def resolve(self, match: Match) -> Set[int]:
+        """Ids matching an (ids, clause, excluded) match; the clause is only checked on known ids"""
+        ids, clause, excluded = match
+        if ids is None:
+            ids = self.clause_ids(clause)
+        elif clause is not None:
+            ids = set(filter_ids(self.model.query.filter(clause), self.model.id, ids)[0])
+        return ids - excluded if excluded else ids
+
+class Node:
+    """Query plan node"""
+
+    def estimate(self, context: QueryContext) -> float:
+        """Upper bound on the number of matching documents, used to order evaluation"""
+        return UNKNOWN_COST
+
+    def compile(self, context: QueryContext) -> Match:
+        """Evaluate index clauses to id sets and translate structured clauses to SQL.
+
+        Returns (ids, clause, excluded): a document matches when it is in ids
+        (if not None), satisfies clause (if not None) and is not in excluded
+        (if not None); (None, None, None) matches all. Negated and ORed text
+        stays id sets, so index hits are never written into SQL whole.
+        """
+        raise NotImplementedError
+
+class Text(Node):
+    """Free text, phrases and NEAR/n, answered by the inverted index"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def estimate(self, context):
+        estimate = context.search_index.estimate(context.resource_type, self.text)
+        return SQL_CLAUSE_COST if estimate is None else estimate
+
+    def compile(self, context):
+        scores = context.score(self.text)
+        if scores is None:
+            return None, None, None
+        return set(scores), None, None
+
+class Field(Node):
+    """field:value clause"""
+
+    def __init__(self, name: str, value):
+        self.name = name
+        self.value = value
+
+    def kind(self, context) -> Tuple[str, str]:
+        if self.name not in context.fields:
+            raise QueryParseError(f'حقل البحث "{self.name}" غير مدعوم لهذا النوع')
+        return context.fields[self.name]
+
+    def estimate(self, context):
+        kind, column = self.kind(context)
+        if kind == 'fragment':
+            estimate = context.trigram_index.estimate(context.resource_type, self.value, fields=[column])
+            return SQL_CLAUSE_COST if estimate is None else estimate
+        return SQL_CLAUSE_COST
+
+    def compile(self, context):
+        kind, column = self.kind(context)
+        model = context.model
+
+        if kind == 'fragment':
+            from models import NORMALIZED_COLUMNS
+            from utils.text_processing import ArabicTextProcessor
+
+            ids = context.trigram_index.search(context.resource_type, self.value, fields=[column])
+            if ids is not None:
+                return ids, None, None
+            shadow = NORMALIZED_COLUMNS.get(model, {}).get(column)
+            if shadow:
+                return None, getattr(model, shadow).contains(ArabicTextProcessor.normalize_arabic(self.value)), None
+            return None, getattr(model, column).contains(self.value), None
+
+        if kind == 'court':
+            from models import Court
+            courts = select(Court.id).where(Court.name.contains(self.value)).correlate(None)
+            return None, getattr(model, column).in_(courts), None
+
+        if kind == 'range':
+            start, end = self.value
+            conditions = []
+            if start is not None:
+                conditions.append(getattr(model, column) >= start)
+            if end is not None:
+                conditions.append(getattr(model, column) < end)
+            return None, and_(*conditions) if conditions else None, None
+
+        return None, getattr(model, column) == self.value, None
+
+class Not(Node):
+    """Exclusion of a clause"""
+
+    def __init__(self, child: Node):
+        self.child = child
+
+    def compile(self, context):
+        ids, clause, excluded = self.child.compile(context)
+        if ids is None and clause is None:
+            # NOT of everything (or of an exclusion) is a set again
+            return (set(), None, None) if excluded is None else (excluded, None, None)
+        if clause is None and excluded is None:
+            return None, None, ids
+        if ids is None and excluded is None:
+            return None, not_(clause), None
+        return None, None, context.resolve((ids, clause, excluded))
+
+class And(Node):
+    """Conjunction, evaluated from the most selective clause"""
+
+    def __init__(self, children: List[Node]):
+        self.children = children
+
+    def estimate(self, context):
+        return min((child.estimate(context) for child in self.children), default=UNKNOWN_COST)
+
+    def compile(self, context):
+        ids = None
+        clauses = []
+        excluded = set()
+        # Exclusions estimate as unknown, so they come after every positive clause
+        for child in sorted(self.children, key=lambda child: child.estimate(context)):
+            child_ids, child_clause, child_excluded = child.compile(context)
+            if child_ids is not None:
+                ids = child_ids if ids is None else ids & child_ids
+            if child_clause is not None:
+                clauses.append(child_clause)
+            if child_excluded:
+                excluded |= child_excluded
+            if ids is not None and excluded:
+                ids = ids - excluded
+                excluded = set()
+            if ids is not None and not ids:
+                return set(), None, None
+
+        return ids, and_(*clauses) if clauses else None, excluded or None
+
+class Or(Node):
+    """Disjunction"""
+
+    def __init__(self, children: List[Node]):
+        self.children = children
+
+    def estimate(self, context):
+        return sum(child.estimate(context) for child in self.children)
+
+    def compile(self, context):
+        matches = [child.compile(context) for child in self.children]
+        if any(all(part is None for part in match) for match in matches):
+            return None, None, None
+
+        exclusions = [excluded for ids, clause, excluded in matches if ids is None and clause is None]
+        if exclusions:
+            # Everything but the ids excluded by every exclusion and matched by no other clause
+            excluded = set.intersection(*exclusions)
+            for ids, clause, child_excluded in matches:
+                if ids is None and clause is None:
+                    continue
+                candidates = excluded if ids is None else excluded & ids
+                excluded -= context.resolve((candidates, clause, child_excluded))
+            return None, None, excluded or None
+
+        ids = set()
+        clauses = []
+        for match in matches:
+            if match[0] is None and match[2] is None:
+                clauses.append(match[1])
+            else:
+                ids |= context.resolve(match)
+        if not clauses:
+            return ids, None, None
+        if len(ids) > MAX_SQL_IDS:
+            return ids | context.clause_ids(or_(*clauses)), None, None
+        if ids:
+            clauses.append(context.model.id.in_(ids))
+        return None, or_(*clauses), None
+
+class QueryParser:
+    """Recursive-descent parser: OR binds loosest, then implicit AND, then NOT/-"""
+
+    TOKEN = re.compile(r'''
+        \s*(?:
+            (?P<lparen>\() |
+            (?P<rparen>\)) |
+            (?P<field>[A-Za-z_]+):(?=\S) |
+            (?P<range>\[[^\]]*\]) |
+            (?P<negate>-)(?=[^\s)]) |
+            (?P<phrase>"[^"]*"?) |
+            (?P<word>[^\s()"]+)
+        )''', re.VERBOSE)
+    NEAR_OPERATOR = re.compile(r'^NEAR(?:/\d+)?$')
+
+    def __init__(self, query: str):
+        self.tokens = self.lex(query or '')
+        self.position = 0
+
+    @classmethod
+    def lex(cls, query: str) -> List[Tuple[str, str]]:
+        tokens = []
+        position = 0
+        query = query.strip()
+        while position < len(query):
+            match = cls.TOKEN.match(query, position)
+            if not match or match.end() == position:
+                break
+            kind = match.lastgroup
+            tokens.append((kind, match.group(kind)))
+            position = match.end()
+        return tokens
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def advance(self) -> Tuple[str, str]:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self) -> Optional[Node]:
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QueryParseError('صيغة البحث غير صحيحة: أقواس غير متوازنة')
+        return node
+
+    def parse_or(self) -> Optional[Node]:
+        children = [self.parse_and()]
+        while self.peek() == ('word', 'OR'):
+            self.advance()
+            children.append(self.parse_and())
+        children = [child for child in children if child is not None]
+        if len(children) > 1:
+            return Or(children)
+        return children[0] if children else None
+
+    def parse_and(self) -> Optional[Node]:
+        children = []
+        while True:
+            token = self.peek()
+            if token is None or token[0] == 'rparen' or token == ('word', 'OR'):
+                break
+            if token == ('word', 'AND'):
+                self.advance()
+                continue
+
+            # NEAR/n joins the neighbouring free text into one positional clause
+            if token[0] == 'word' and self.NEAR_OPERATOR.match(token[1]) and children and isinstance(children[-1], Text):
+                self.advance()
+                following = self.parse_unary()
+                if isinstance(following, Text):
+                    children[-1] = Text(f'{children[-1].text} {token[1]} {following.text}')
+                elif following is not None:
+                    children.append(following)
+                continue
+
+            child = self.parse_unary()
+            if child is None:
+                continue
+
+            # Adjacent free text is one clause, so it is scored and intersected in one pass
+            if isinstance(child, Text) and children and isinstance(children[-1], Text):
+                children[-1] = Text(f'{children[-1].text} {child.text}')
+            else:
+                children.append(child)
+
+        if len(children) > 1:
+            return And(children)
+        return children[0] if children else None
+
+    def parse_unary(self) -> Optional[Node]:
+        token = self.peek()
+        if token is None:
+            return None
+        if token[0] == 'negate' or token == ('word', 'NOT'):
+            self.advance()
+            if self.peek() is None:
+                return None
+            child = self.parse_unary()
+            return Not(child) if child is not None else None
+        return self.parse_primary()
+
+    def parse_primary(self) -> Optional[Node]:
+        kind, value = self.advance()
+
+        if kind == 'lparen':
+            node = self.parse_or()
+            if self.peek() is None or self.peek()[0] != 'rparen':
+                raise QueryParseError('صيغة البحث غير صحيحة: أقواس غير متوازنة')
+            self.advance()
+            return node
+
+        if kind == 'rparen':
+            raise QueryParseError('صيغة البحث غير صحيحة: أقواس غير متوازنة')
+
+        if kind == 'field':
+            name = value.lower()
+            if name not in FIELD_NAMES:
+                # Not a field we know: keep "name:" as ordinary text
+                return Text(value)
+            return self.parse_field_value(name)
+
+        if kind == 'range':
+            return Text(value.strip('[]'))
+
+        if kind == 'phrase':
+            return Text(value if value.endswith('"') and len(value) > 1 else value + '"')
+
+        return Text(value)
+
+    def parse_field_value(self, name: str) -> Node:
+        token = self.peek()
+        if token is None or token[0] in ('lparen', 'rparen'):
+            raise QueryParseError(f'قيمة الحقل "{name}" مفقودة')
+        kind, value = self.advance()
+
+        if name == 'date':
+            if kind == 'range':
+                return Field(name, self.parse_range(value))
+            return Field(name, self.parse_date_value(value.strip('"')))
+
+        if kind == 'range':
+            raise QueryParseError(f'الحقل "{name}" لا يقبل نطاقاً')
+        return Field(name, value.strip('"'))
+
+    @staticmethod
+    def parse_date(value: str, upper: bool = False) -> Optional[datetime]:
+        """Parse YYYY, YYYY-MM or YYYY-MM-DD; upper bounds are exclusive and cover the whole period"""
+        value = value.strip()
+        if value in ('', '*'):
+            return None
+        try:
+            if re.fullmatch(r'\d{4}', value):
+                start = datetime(int(value), 1, 1)
+                return datetime(start.year + 1, 1, 1) if upper else start
+            if re.fullmatch(r'\d{4}-\d{1,2}', value):
+                year, month = map(int, value.split('-'))
+                start = datetime(year, month, 1)
+                if not upper:
+                    return start
+                return datetime(year + month // 12, month % 12 + 1, 1)
+            start = datetime.fromisoformat(value)
+        except ValueError:
+            raise QueryParseError(f'تاريخ غير صالح في البحث: {value}')
+        return start + timedelta(days=1) if upper and len(value) <= 10 else start
+
+    @classmethod
+    def parse_date_value(cls, value: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+        return cls.parse_date(value), cls.parse_date(value, upper=True)
+
+    @classmethod
+    def parse_range(cls, value: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+        bounds = re.split(r'\s+TO\s+', value.strip('[]').strip())
+        if len(bounds) != 2:
+            raise QueryParseError(f'نطاق غير صالح في البحث: {value}')
+        return cls.parse_date(bounds[0]), cls.parse_date(bounds[1], upper=True)
+
+class SearchQuery:
+    """A parsed search query, executable against any resource type"""
+
+    def __init__(self, root: Optional[Node]):
+        self.root = root
+
+    @classmethod
+    def parse(cls, query: str) -> 'SearchQuery':
+        return cls(QueryParser(query).parse())
+
+    @property
+    def is_simple(self) -> bool:
+        """True for plain free text without fields or operators"""
+        return self.root is None or isinstance(self.root, Text)
+
+    def ranking_texts(self) -> List[str]:
+        """Free-text clauses that count toward relevance (not under an exclusion)"""
+        texts = []
+
+        def collect(node):
+            if isinstance(node, Text):
+                texts.append(node.text)
+            elif isinstance(node, (And, Or)):
+                for child in node.children:
+                    collect(child)
+
+        if self.root is not None:
+            collect(self.root)
+        return texts
+
+    def execute(self, model, resource_type: str, search_index, trigram_index) -> 'QueryPlanResult':
+        """Run the plan: index clauses become id sets, structured clauses become SQL"""
+        context = QueryContext(model, resource_type, search_index, trigram_index)
+        if self.root is None:
+            return QueryPlanResult(context, None, None, [])
+        ids, clause, excluded = self.root.compile(context)
+        if excluded:
+            if len(excluded) <= MAX_SQL_IDS:
+                clause = and_(clause, not_(model.id.in_(excluded))) if clause is not None \
+                    else not_(model.id.in_(excluded))
+            else:
+                # Too many exclusions for SQL: the rest of the query must be narrow enough to list
+                ids = context.clause_ids(clause) - excluded
+                clause = None
+        return QueryPlanResult(context, ids, clause, self.ranking_texts())
+
+class QueryPlanResult:
+    """Matched ids and remaining SQL conditions of an executed query"""
+
+    def __init__(self, context: QueryContext, ids: Optional[Set[int]], clause, ranking_texts: List[str]):
+        self.context = context
+        self.ids = ids
+        self.clause = clause
+        self.ranking_texts = ranking_texts
+
+    def filter(self, query):
+        """Apply the structured part of the plan to a SQLAlchemy query"""
+        if self.clause is not None:
+            query = query.filter(self.clause)
+        return query
+
+    @property
+    def scores(self) -> Optional[Dict[int, float]]:
+        """BM25 relevance of the matched ids, or None when matching is left to SQL"""
+        if self.ids is None:
+            return None
+        scores = dict.fromkeys(self.ids, 0.0)
+        for text in self.ranking_texts:
+            for resource_id, score in (self.context.score(text) or {}).items():
+                if resource_id in scores:
+                    scores[resource_id] += score
+        return scores
+
+# Export query language
+__all__ = [
+    'QueryParseError',
+    'QueryParser',
+    'SearchQuery',
+    'QueryPlanResult',
+    'QUERY_FIELDS',
+    'MAX_SQL_IDS',
+    'MAX_CLAUSE_IDS',
+    'filter_ids'
+]
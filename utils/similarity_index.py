@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed judgment vectors and approximate nearest-neighbour lookup for "similar judgments"
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils.text_processing import ArabicTextProcessor
+
+class SimilarityIndex:
+    """LSA vectors in a memory-mapped float32 matrix with random-projection LSH tables.
+
+    database/build_similarity_index.py writes the files offline. Requests
+    open them read-only with mmap, collect candidates from the hash
+    buckets of the query vector (and their one-bit neighbours), and
+    re-rank only those candidates by cosine similarity.
+    """
+
+    DEFAULT_PATH = 'similarity_index'
+    META_FILE = 'meta.json'
+
+    # Build defaults
+    COMPONENTS = 128
+    TABLES = 8
+    BUCKET_SIZE = 16
+    MAX_BITS = 24
+    MAX_FEATURES = 100000
+    TRANSFORM_BATCH = 10000
+
+    # Below this many rows an exact scan is already fast enough
+    EXACT_LIMIT = 20000
+
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path or self.DEFAULT_PATH
+        self.lock = threading.Lock()
+        self.data = None
+        self.loaded_build = None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.index_path, name)
+
+    def _load(self) -> Optional[dict]:
+        """Open the current build, reopening when a newer one was written"""
+        try:
+            with open(self._file(self.META_FILE), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        with self.lock:
+            if self.loaded_build != meta['build']:
+                files = meta['files']
+                self.data = {
+                    'meta': meta,
+                    'ids': np.load(self._file(files['ids']), mmap_mode='r'),
+                    'vectors': np.load(self._file(files['vectors']), mmap_mode='r'),
+                    'planes': np.load(self._file(files['planes'])),
+                    'codes': np.load(self._file(files['codes']), mmap_mode='r'),
+                    'order': np.load(self._file(files['order']), mmap_mode='r'),
+                }
+                self.loaded_build = meta['build']
+            return self.data
+
+    @property
+    def available(self) -> bool:
+        return self._load() is not None
+
+    @staticmethod
+    def _hash(planes: np.ndarray, vector: np.ndarray) -> np.ndarray:
+        """Bucket code of a vector in every table: one bit per hyperplane side"""
+        bits = (planes @ vector) > 0
+        weights = np.left_shift(np.uint32(1), np.arange(planes.shape[1], dtype=np.uint32))
+        return (bits * weights).sum(axis=1).astype(np.uint32)
+
+    def _candidates(self, data: dict, vector: np.ndarray) -> np.ndarray:
+        """Rows sharing a bucket, or a bucket one bit away, with the vector in any table"""
+        codes, order = data['codes'], data['order']
+        bits = data['planes'].shape[1]
+
+        found = []
+        for table, code in enumerate(self._hash(data['planes'], vector)):
+            probes = np.concatenate(([code], code ^ (np.uint32(1) << np.arange(bits, dtype=np.uint32))))
+            starts = np.searchsorted(codes[table], probes, side='left')
+            ends = np.searchsorted(codes[table], probes, side='right')
+            for start, end in zip(starts, ends):
+                if end > start:
+                    found.append(order[table, start:end])
+
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        # Sorted rows keep the memmap reads sequential
+        return np.unique(np.concatenate(found))
+
+    def similar(self, resource_id: int, k: int = 10) -> Optional[List[Tuple[int, float]]]:
+        """Top-k most similar ids with cosine scores; None when no index was built"""
+        data = self._load()
+        if data is None:
+            return None
+
+        ids = data['ids']
+        row = int(np.searchsorted(ids, resource_id))
+        if row >= ids.size or ids[row] != resource_id:
+            # Written after the last build
+            return []
+
+        vectors = data['vectors']
+        query = np.asarray(vectors[row])
+        if not query.any():
+            return []
+
+        if ids.size <= self.EXACT_LIMIT:
+            candidates = np.arange(ids.size)
+        else:
+            candidates = self._candidates(data, query)
+        candidates = candidates[candidates != row]
+        if not candidates.size:
+            return []
+
+        scores = np.asarray(vectors[candidates]) @ query
+        top = min(k, candidates.size)
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+
+        return [(int(ids[candidates[i]]), float(scores[i])) for i in best if scores[i] > 0]
+
+    @classmethod
+    def build(cls, index_path: str, documents: Iterable[Tuple[int, str]], components: int = COMPONENTS,
+              tables: int = TABLES, max_features: int = MAX_FEATURES, seed: int = 42) -> dict:
+        """Vectorize (id, text) pairs and write a new build; returns its metadata.
+
+        Texts are TF-IDF weighted over stemmed tokens and reduced with
+        TruncatedSVD to ``components`` dimensions (0 keeps the raw TF-IDF
+        space, which only suits small vocabularies).
+        """
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.preprocessing import normalize
+
+        ids = []
+
+        def texts():
+            for resource_id, text in documents:
+                ids.append(resource_id)
+                yield text or ''
+
+        vectorizer = TfidfVectorizer(analyzer=ArabicTextProcessor.tokenize, max_features=max_features,
+                                     sublinear_tf=True, dtype=np.float32)
+        matrix = vectorizer.fit_transform(texts())
+
+        # Rows ordered by id so lookups are a binary search
+        id_array = np.asarray(ids, dtype=np.int64)
+        ordering = np.argsort(id_array, kind='stable')
+        id_array = id_array[ordering]
+        matrix = matrix[ordering]
+
+        svd = None
+        dims = matrix.shape[1]
+        if components and dims > 1:
+            svd = TruncatedSVD(n_components=min(components, dims - 1), random_state=seed).fit(matrix)
+            dims = svd.n_components
+
+        os.makedirs(index_path, exist_ok=True)
+        build = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+        files = {name: f'{name}-{build}.npy' for name in ('ids', 'vectors', 'planes', 'codes', 'order')}
+        path = lambda name: os.path.join(index_path, files[name])
+
+        np.save(path('ids'), id_array)
+
+        # Unit vectors, so a dot product is the cosine similarity
+        vectors = np.lib.format.open_memmap(path('vectors'), mode='w+', dtype=np.float32,
+                                            shape=(id_array.size, dims))
+        for start in range(0, id_array.size, cls.TRANSFORM_BATCH):
+            chunk = matrix[start:start + cls.TRANSFORM_BATCH]
+            chunk = svd.transform(chunk) if svd is not None else chunk.toarray()
+            vectors[start:start + len(chunk)] = normalize(chunk)
+        vectors.flush()
+
+        # Enough bits for about BUCKET_SIZE rows per bucket
+        bits = int(np.clip(np.log2(max(id_array.size, 2) / cls.BUCKET_SIZE), 1, cls.MAX_BITS))
+        planes = np.random.default_rng(seed).standard_normal((tables, bits, dims)).astype(np.float32)
+        np.save(path('planes'), planes)
+
+        weights = np.left_shift(np.uint32(1), np.arange(bits, dtype=np.uint32))
+        codes = np.empty((tables, id_array.size), dtype=np.uint32)
+        for start in range(0, id_array.size, cls.TRANSFORM_BATCH):
+            chunk = np.asarray(vectors[start:start + cls.TRANSFORM_BATCH])
+            side = np.einsum('tbd,nd->tnb', planes, chunk) > 0
+            codes[:, start:start + len(chunk)] = (side * weights).sum(axis=2)
+
+        order = np.argsort(codes, axis=1, kind='stable')
+        np.save(path('codes'), np.take_along_axis(codes, order, axis=1))
+        np.save(path('order'), order.astype(np.int64))
+
+        meta = {
+            'build': build,
+            'count': int(id_array.size),
+            'dimensions': int(dims),
+            'tables': tables,
+            'bits': bits,
+            'features': len(vectorizer.vocabulary_),
+            'files': files,
+        }
+
+        # Publish atomically, then drop files of older builds
+        meta_path = os.path.join(index_path, cls.META_FILE)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+        current = set(files.values()) | {cls.META_FILE}
+        for name in os.listdir(index_path):
+            if name.endswith('.npy') and name not in current:
+                try:
+                    os.remove(os.path.join(index_path, name))
+                except OSError:
+                    # Still mapped by a running server (Windows); removed by the next build
+                    pass
+
+        return meta
+
+_similarity_indexes = {}
+_similarity_indexes_lock = threading.Lock()
+
+def get_similarity_index(index_path: str = None) -> SimilarityIndex:
+    """Return the shared similarity index instance for a path"""
+    path = index_path or SimilarityIndex.DEFAULT_PATH
+    with _similarity_indexes_lock:
+        if path not in _similarity_indexes:
+            _similarity_indexes[path] = SimilarityIndex(path)
+        return _similarity_indexes[path]
+
+# Export similarity index classes
+__all__ = [
+    'SimilarityIndex',
+    'get_similarity_index'
+]
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+"Did you mean" suggestions for search queries from the search index vocabulary
+"""
+
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from utils.search_index import InvertedIndex, get_search_index
+from utils.search_query import FIELD_NAMES, QueryParser
+from utils.text_processing import ArabicTextProcessor
+
+class SpellingCorrector:
+    """Symmetric-delete spelling correction over the indexed terms.
+
+    Every vocabulary term is expanded into the strings left after deleting
+    up to MAX_DISTANCE characters of its first PREFIX_LENGTH characters.
+    A misspelled term expanded the same way shares one of those strings
+    with every term within that edit distance, so a lookup is a few
+    binary searches over the sorted delete hashes plus an exact distance
+    check of the candidates found, instead of a scan of the vocabulary.
+    Corrections are matched in normalized form and returned as the most
+    frequent way the indexed documents write them.
+    """
+
+    MAX_DISTANCE = 2
+    PREFIX_LENGTH = 7
+
+    # Terms this short are not corrected; terms up to SHORT_TERM allow one edit
+    MIN_LENGTH = 3
+    SHORT_TERM = 4
+
+    # Terms seen in a single document are often typos themselves
+    MIN_DOC_FREQ = 2
+
+    # Seconds before the vocabulary is reloaded from the index
+    MAX_AGE = 3600
+
+    # Query words that are operators, not search terms
+    OPERATOR = re.compile(r'^(?:AND|OR|NOT|NEAR(?:/\d+)?)$')
+    PHRASE_WORD = re.compile(r'[^\s"]+')
+
+    def __init__(self, index: InvertedIndex, max_age: Optional[float] = MAX_AGE):
+        self.index = index
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.loaded_at = None
+        self.terms: List[str] = []
+        self.doc_freqs: Dict[str, Dict[str, int]] = {}
+        self.surfaces: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self.delete_hashes = np.empty(0, dtype=np.int64)
+        self.delete_terms = np.empty(0, dtype=np.int32)
+
+    @classmethod
+    def deletes(cls, term: str, distance: int) -> set:
+        """The term's prefix with every combination of up to distance characters removed"""
+        found = {term[:cls.PREFIX_LENGTH]}
+        frontier = found
+        for _ in range(distance):
+            frontier = {word[:i] + word[i + 1:] for word in frontier if len(word) > 1 for i in range(len(word))}
+            found |= frontier
+        return found
+
+    @classmethod
+    def allowed_distance(cls, term: str) -> int:
+        if len(term) < cls.MIN_LENGTH:
+            return 0
+        return 1 if len(term) <= cls.SHORT_TERM else cls.MAX_DISTANCE
+
+    def load(self):
+        """Rebuild the delete table from the index vocabulary"""
+        doc_freqs = {}
+        for term, resource_type, doc_freq in self.index.vocabulary(self.MIN_DOC_FREQ):
+            if len(term) >= self.MIN_LENGTH and not term.isdigit():
+                doc_freqs.setdefault(resource_type, {})[term] = doc_freq
+
+        terms = sorted({term for freqs in doc_freqs.values() for term in freqs})
+
+        # Written forms of the tokens behind the known terms only
+        known = set(terms)
+        surfaces = {}
+        for token, resource_type, surface, doc_freq in self.index.surface_forms():
+            if ArabicTextProcessor.stem(token) in known:
+                forms = surfaces.setdefault(resource_type, {}).setdefault(token, {})
+                forms[surface] = doc_freq
+        hashes, owners = [], []
+        for term_id, term in enumerate(terms):
+            for deleted in self.deletes(term, self.MAX_DISTANCE):
+                hashes.append(hash(deleted))
+                owners.append(term_id)
+
+        # Hash collisions only add candidates; each one is checked by edit distance
+        hashes = np.array(hashes, dtype=np.int64)
+        order = np.argsort(hashes, kind='stable')
+
+        with self.lock:
+            self.terms = terms
+            self.doc_freqs = doc_freqs
+            self.surfaces = surfaces
+            self.delete_hashes = hashes[order]
+            self.delete_terms = np.array(owners, dtype=np.int32)[order]
+            self.loaded_at = time.monotonic()
+
+    def _stale(self) -> bool:
+        return self.loaded_at is None or (self.max_age is not None and time.monotonic() - self.loaded_at > self.max_age)
+
+    def _ensure_loaded(self):
+        if self._stale():
+            with self.load_lock:
+                if self._stale():
+                    self.load()
+
+    def frequency(self, term: str, resource_types: Iterable[str]) -> int:
+        return sum(self.doc_freqs.get(resource_type, {}).get(term, 0) for resource_type in resource_types)
+
+    def written_form(self, token: str, resource_types: Iterable[str]) -> str:
+        """Most frequent indexed spelling of a normalized token; the token itself if none is known"""
+        counts = {}
+        with self.lock:
+            for resource_type in resource_types:
+                for surface, doc_freq in self.surfaces.get(resource_type, {}).get(token, {}).items():
+                    counts[surface] = counts.get(surface, 0) + doc_freq
+        if not counts:
+            return token
+        return max(counts, key=lambda surface: (counts[surface], surface))
+
+    def correct_term(self, term: str, resource_types: Iterable[str]) -> Optional[str]:
+        """Closest known term to an unknown one, most frequent first on ties; None if there is none"""
+        resource_types = list(resource_types)
+        distance = self.allowed_distance(term)
+        if not distance or term.isdigit():
+            return None
+
+        with self.lock:
+            if self.frequency(term, resource_types):
+                return None
+
+            hashes = np.array([hash(deleted) for deleted in self.deletes(term, distance)], dtype=np.int64)
+            starts = np.searchsorted(self.delete_hashes, hashes, side='left')
+            ends = np.searchsorted(self.delete_hashes, hashes, side='right')
+            candidate_ids = set()
+            for start, end in zip(starts, ends):
+                if end > start:
+                    candidate_ids.update(self.delete_terms[start:end].tolist())
+
+            best = None
+            for term_id in candidate_ids:
+                candidate = self.terms[term_id]
+                if abs(len(candidate) - len(term)) > distance:
+                    continue
+                frequency = self.frequency(candidate, resource_types)
+                if not frequency:
+                    continue
+                edits = ArabicTextProcessor.edit_distance(term, candidate)
+                if edits <= distance and (best is None or (edits, -frequency, candidate) < best):
+                    best = (edits, -frequency, candidate)
+
+        return best[2] if best else None
+
+    def correct_word(self, word: str, resource_types: Iterable[str]) -> Optional[str]:
+        """Corrected form of one query word as documents write it, keeping the affixes the stemmer strips"""
+        tokens = ArabicTextProcessor.tokenize(word, stem=False)
+        if len(tokens) != 1:
+            return None
+
+        resource_types = list(resource_types)
+        token = tokens[0]
+        term = ArabicTextProcessor.stem(token)
+        correction = self.correct_term(term, resource_types)
+        if correction is None:
+            return None
+
+        position = token.find(term)
+        if position >= 0:
+            correction = token[:position] + correction + token[position + len(term):]
+        return self.written_form(correction, resource_types)
+
+    def suggest(self, query: str, resource_types: Iterable[str]) -> Optional[str]:
+        """The query with unknown words replaced by their closest indexed terms; None if nothing changed.
+
+        Operators, field values and excluded words are left as typed.
+        """
+        if not query or not query.strip():
+            return None
+        resource_types = list(resource_types)
+        self._ensure_loaded()
+
+        replacements = []
+        position = 0
+        skip_next = False
+        while position < len(query):
+            match = QueryParser.TOKEN.match(query, position)
+            if not match or match.end() == position:
+                break
+            kind = match.lastgroup
+            start, end = match.start(kind), match.end(kind)
+            position = match.end()
+
+            if skip_next and kind not in ('lparen', 'rparen'):
+                skip_next = False
+                continue
+            if kind == 'field':
+                # A known field takes the next token as its value
+                skip_next = match.group(kind).lower() in FIELD_NAMES
+                continue
+            if kind == 'negate' or match.group(kind) == 'NOT':
+                # Excluded words never cause a miss
+                skip_next = True
+                continue
+
+            if kind == 'word' and not self.OPERATOR.match(match.group(kind)):
+                correction = self.correct_word(match.group(kind), resource_types)
+                if correction:
+                    replacements.append((start, end, correction))
+            elif kind == 'phrase':
+                for word in self.PHRASE_WORD.finditer(query, start, end):
+                    correction = self.correct_word(word.group(), resource_types)
+                    if correction:
+                        replacements.append((word.start(), word.end(), correction))
+
+        if not replacements:
+            return None
+
+        for start, end, correction in reversed(replacements):
+            query = query[:start] + correction + query[end:]
+        return query
+
+_correctors = {}
+_correctors_lock = threading.Lock()
+
+def get_spelling_corrector(index_path: str = None) -> SpellingCorrector:
+    """Return the shared spelling corrector for a search index path"""
+    path = index_path or InvertedIndex.DEFAULT_PATH
+    with _correctors_lock:
+        if path not in _correctors:
+            _correctors[path] = SpellingCorrector(get_search_index(path))
+        return _correctors[path]
+
+# Export spelling correction classes
+__all__ = [
+    'SpellingCorrector',
+    'get_spelling_corrector'
+]
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-aggregated statistics: daily case and judgment counts per reporting dimension
+"""
+
+import hashlib
+import json
+import threading
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from utils.counting import TableCounters
+
+class StatsRollup:
+    """Daily row counts of cases and judgments kept in stats_rollups.
+
+    Each rollup row counts the rows created on one day that share every
+    reporting dimension of their resource type, so the statistics read a
+    few hundred rows however large the tables grow. Inserts, deletes and
+    dimension changes adjust their buckets in the writing transaction,
+    with one UPDATE per bucket per flush. An empty rollup is built on
+    first use, or rebuilt when its total disagrees with the table row
+    counter; rebuild() recounts after writes that bypass the ORM.
+    """
+
+    # Columns each resource type is broken down by
+    DIMENSIONS = {
+        'case': ('status', 'priority', 'category_id', 'court_id'),
+        'judgment': ('status', 'judgment_type', 'court_id'),
+    }
+
+    # Column whose day buckets a row
+    DATE_COLUMN = 'created_at'
+
+    def __init__(self):
+        self.registered = False
+        self.seed_lock = threading.Lock()
+        self.seeded = set()
+
+    @staticmethod
+    def models() -> Dict:
+        """Rolled-up model classes by resource type"""
+        from models import Case, Judgment
+        return {'case': Case, 'judgment': Judgment}
+
+    @staticmethod
+    def bucket(resource_type: str, values: Dict) -> str:
+        """Stable key of one combination of day and dimension values"""
+        payload = json.dumps([resource_type, sorted(values.items())], default=str, ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def day_of(cls, value) -> Optional[date]:
+        return value.date() if isinstance(value, datetime) else value
+
+    def register(self):
+        """Attach the flush hook"""
+        if self.registered:
+            return
+        for resource_type, model in self.models().items():
+            for column in self.DIMENSIONS[resource_type] + (self.DATE_COLUMN,):
+                # Setting an expired attribute loads its committed value first, so the old bucket is known
+                event.listen(getattr(model, column), 'set', self._keep_history, active_history=True)
+        event.listen(Session, 'after_flush', self._after_flush)
+        self.registered = True
+
+    @staticmethod
+    def _keep_history(target, value, oldvalue, initiator):
+        # Only registered for its active_history; the flush hook reads the loaded value
+        pass
+
+    def _values(self, resource_type: str, instance, old: bool = False) -> Dict:
+        """Bucket values of an instance, as written (old=False) or as last loaded (old=True)"""
+        state = inspect(instance)
+        values = {}
+        for column in self.DIMENSIONS[resource_type] + (self.DATE_COLUMN,):
+            history = state.attrs[column].history
+            if old and history.deleted:
+                value = history.deleted[0]
+            elif old and history.unchanged:
+                value = history.unchanged[0]
+            elif not old and history.added:
+                value = history.added[0]
+            else:
+                value = getattr(instance, column)
+            values['day' if column == self.DATE_COLUMN else column] = value
+        values['day'] = self.day_of(values['day'])
+        return values
+
+    def _changed(self, resource_type: str, instance) -> bool:
+        state = inspect(instance)
+        return any(state.attrs[column].history.has_changes()
+                   for column in self.DIMENSIONS[resource_type] + (self.DATE_COLUMN,))
+
+    def _after_flush(self, session, flush_context):
+        # session.new, dirty and deleted and their attribute history still describe this flush
+        types = {model: resource_type for resource_type, model in self.models().items()}
+        deltas = {}
+
+        def add(resource_type, values, delta):
+            key = self.bucket(resource_type, values)
+            entry = deltas.setdefault(key, [resource_type, values, 0])
+            entry[2] += delta
+
+        for instance in session.new:
+            resource_type = types.get(type(instance))
+            if resource_type:
+                add(resource_type, self._values(resource_type, instance), 1)
+        for instance in session.dirty:
+            resource_type = types.get(type(instance))
+            if resource_type and self._changed(resource_type, instance):
+                add(resource_type, self._values(resource_type, instance, old=True), -1)
+                add(resource_type, self._values(resource_type, instance), 1)
+        for instance in session.deleted:
+            resource_type = types.get(type(instance))
+            if resource_type:
+                add(resource_type, self._values(resource_type, instance, old=True), -1)
+
+        connection = session.connection()
+        for key, (resource_type, values, delta) in deltas.items():
+            if delta:
+                self._adjust(connection, key, resource_type, values, delta)
+
+    @staticmethod
+    def _adjust(connection, key: str, resource_type: str, values: Dict, delta: int):
+        from models import StatsRollup as Rollup
+        rollups = Rollup.__table__
+
+        update = rollups.update().where(rollups.c.bucket == key).values(row_count=rollups.c.row_count + delta)
+        if connection.execute(update).rowcount:
+            return
+        try:
+            with connection.begin_nested():
+                connection.execute(rollups.insert().values(bucket=key, resource_type=resource_type,
+                                                           row_count=delta, **values))
+        except IntegrityError:
+            # Bucket created concurrently by another transaction
+            connection.execute(update)
+
+    def rebuild(self, session, resource_type: str) -> int:
+        """Recount the rollup of a resource type from its table; returns the number of buckets"""
+        from models import StatsRollup as Rollup
+        rollups = Rollup.__table__
+        model = self.models()[resource_type]
+        dimensions = [getattr(model, column) for column in self.DIMENSIONS[resource_type]]
+        day = func.date(getattr(model, self.DATE_COLUMN))
+
+        rows = session.query(day, *dimensions, func.count(model.id)).group_by(day, *dimensions).all()
+        buckets = {}
+        for row in rows:
+            values = dict(zip(self.DIMENSIONS[resource_type], row[1:-1]))
+            values['day'] = date.fromisoformat(row[0]) if isinstance(row[0], str) else self.day_of(row[0])
+            key = self.bucket(resource_type, values)
+            # Several timestamps of one day may come back as separate groups on some databases
+            if key in buckets:
+                buckets[key]['row_count'] += row[-1]
+            else:
+                buckets[key] = dict(values, bucket=key, resource_type=resource_type, row_count=row[-1])
+
+        # Written on its own connection so the caller's transaction stays untouched
+        with session.get_bind().begin() as connection:
+            connection.execute(rollups.delete().where(rollups.c.resource_type == resource_type))
+            if buckets:
+                connection.execute(rollups.insert(), list(buckets.values()))
+        self.seeded.add(resource_type)
+        return len(buckets)
+
+    def _ensure_seeded(self, session, resource_type: str):
+        """Build a resource type's rollup on first use unless it already accounts for every row.
+
+        Writes made before the rollup was first built still add buckets of
+        their own, so the rollup's total is checked against the maintained
+        table row counter rather than just for being non-empty.
+        """
+        if resource_type in self.seeded:
+            return
+        from models import StatsRollup as Rollup
+        with self.seed_lock:
+            if resource_type in self.seeded:
+                return
+            model = self.models()[resource_type]
+            rolled_up = session.query(func.sum(Rollup.row_count))\
+                               .filter(Rollup.resource_type == resource_type).scalar() or 0
+            if int(rolled_up) != TableCounters().count(session, model):
+                try:
+                    self.rebuild(session, resource_type)
+                except IntegrityError:
+                    # Built concurrently by another process
+                    pass
+            self.seeded.add(resource_type)
+
+    def _query(self, session, resource_type: str, columns: List, filters: Dict = None):
+        """Rollup rows of a resource type narrowed by dimension values and a creation day range"""
+        from models import StatsRollup as Rollup
+        self._ensure_seeded(session, resource_type)
+
+        query = session.query(*columns).filter(Rollup.resource_type == resource_type, Rollup.row_count != 0)
+        for name, value in (filters or {}).items():
+            if value in (None, ''):
+                continue
+            if name == 'date_from':
+                query = query.filter(Rollup.day >= self.day_of(value))
+            elif name == 'date_to':
+                query = query.filter(Rollup.day <= self.day_of(value))
+            elif name in self.DIMENSIONS[resource_type]:
+                query = query.filter(getattr(Rollup, name) == value)
+        return query
+
+    def total(self, session, resource_type: str, filters: Dict = None) -> int:
+        """Number of rows matching the filters"""
+        from models import StatsRollup as Rollup
+        return int(self._query(session, resource_type, [func.sum(Rollup.row_count)], filters).scalar() or 0)
+
+    def counts(self, session, resource_type: str, dimension: str, filters: Dict = None) -> Dict:
+        """Row counts per value of one dimension"""
+        from models import StatsRollup as Rollup
+        column = getattr(Rollup, dimension)
+        rows = self._query(session, resource_type, [column, func.sum(Rollup.row_count)], filters)\
+                   .group_by(column).all()
+        return {value: int(count) for value, count in rows if count}
+
+    def daily(self, session, resource_type: str, filters: Dict = None) -> List[Tuple[date, int]]:
+        """Row counts per creation day, oldest first"""
+        from models import StatsRollup as Rollup
+        rows = self._query(session, resource_type, [Rollup.day, func.sum(Rollup.row_count)], filters)\
+                   .group_by(Rollup.day).order_by(Rollup.day).all()
+        return [(day, int(count)) for day, count in rows if day is not None and count]
+
+    def summary(self, session, resource_type: str, filters: Dict = None) -> Dict:
+        """Total, per-dimension and per-day counts of the rows matching the filters, from one query.
+
+        The rollup rows are grouped by day and every dimension at once and
+        folded into each breakdown here, so all figures share the filters
+        and the rollup is read a single time.
+        """
+        from models import StatsRollup as Rollup
+        dimensions = self.DIMENSIONS[resource_type]
+        columns = [Rollup.day] + [getattr(Rollup, dimension) for dimension in dimensions]
+        rows = self._query(session, resource_type, columns + [func.sum(Rollup.row_count)], filters)\
+                   .group_by(*columns).all()
+
+        total = 0
+        by_dimension = {dimension: {} for dimension in dimensions}
+        daily = {}
+        for row in rows:
+            count = int(row[-1])
+            if not count:
+                continue
+            total += count
+            for dimension, value in zip(dimensions, row[1:-1]):
+                counts = by_dimension[dimension]
+                counts[value] = counts.get(value, 0) + count
+            if row[0] is not None:
+                daily[row[0]] = daily.get(row[0], 0) + count
+
+        return {
+            'total': total,
+            'by': {dimension: {value: count for value, count in counts.items() if count}
+                   for dimension, counts in by_dimension.items()},
+            'daily': sorted(daily.items())
+        }
+
+_stats_rollup = None
+_stats_rollup_lock = threading.Lock()
+
+def get_stats_rollup() -> StatsRollup:
+    """Return the shared statistics rollup, attaching its write hook on first use"""
+    global _stats_rollup
+    with _stats_rollup_lock:
+        if _stats_rollup is None:
+            _stats_rollup = StatsRollup()
+            _stats_rollup.register()
+        return _stats_rollup
+
+# Export statistics rollup classes
+__all__ = [
+    'StatsRollup',
+    'get_stats_rollup'
+]
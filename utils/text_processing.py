@@ -4,12 +4,14 @@ Utility functions for Arabic text processing and search functionality
 """
 
 import re
+from functools import lru_cache
 import arabic_reshaper
 from bidi.algorithm import get_display
-from fuzzywuzzy import fuzz, process
+from fuzzywuzzy import fuzz
 import string
 from datetime import datetime, timedelta
 import hashlib
+import html
 import os
 import uuid
 
@@ -27,6 +29,21 @@ class ArabicTextProcessor:
         'ي': 'ي', 'ئ': 'ي', 'ؤ': 'و'
     }
     
+    # Replacement pairs that change the text; str.replace beats str.translate on Arabic text
+    NORMALIZE_PAIRS = tuple((old, new) for old, new in NORMALIZE_MAP.items() if old != new)
+    
+    # Light stemming affixes, in normalized form (ة -> ه, ى -> ي), longest first
+    STEM_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+    STEM_SUFFIXES = ('ها', 'ان', 'ات', 'ون', 'ين', 'يه', 'ه', 'ي')
+    STEM_CACHE_SIZE = 100000
+    
+    # Arabic and English punctuation, dropped from tokens
+    PUNCTUATION = '،؛؟!""''()[]{}«»' + string.punctuation
+    PUNCTUATION_TABLE = str.maketrans('', '', PUNCTUATION)
+    
+    # Whitespace-delimited words, as split() sees them
+    WORD_PATTERN = re.compile(r'\S+')
+    
     @staticmethod
     def reshape_arabic(text):
         """Reshape Arabic text for proper display"""
@@ -44,20 +61,23 @@ class ArabicTextProcessor:
         if not text:
             return ""
         
-        # Convert to lowercase (for mixed content)
-        text = text.lower()
-        
-        # Remove diacritics
-        text = ArabicTextProcessor.ARABIC_DIACRITICS.sub('', text)
+        # Convert to lowercase (for mixed content) and remove diacritics
+        text = ArabicTextProcessor.ARABIC_DIACRITICS.sub('', text.lower())
         
-        # Normalize characters
-        for old, new in ArabicTextProcessor.NORMALIZE_MAP.items():
-            text = text.replace(old, new)
+        # Normalize characters, skipping letters the text does not contain
+        for old, new in ArabicTextProcessor.NORMALIZE_PAIRS:
+            if old in text:
+                text = text.replace(old, new)
         
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        return text
+        # Collapse whitespace without a regex pass
+        return ' '.join(text.split())
+    
+    @staticmethod
+    def normalize_many(texts):
+        """Normalize an iterable of texts lazily, for bulk indexing pipelines"""
+        normalize = ArabicTextProcessor.normalize_arabic
+        for text in texts:
+            yield normalize(text)
     
     @staticmethod
     def remove_punctuation(text):
@@ -65,16 +85,68 @@ class ArabicTextProcessor:
         if not text:
             return ""
         
-        # Arabic and English punctuation
-        arabic_punctuation = '،؛؟!""''()[]{}«»'
-        english_punctuation = string.punctuation
-        
-        all_punctuation = arabic_punctuation + english_punctuation
-        
-        # Remove punctuation
-        translator = str.maketrans('', '', all_punctuation)
-        return text.translate(translator)
+        # Remove Arabic and English punctuation
+        return text.translate(ArabicTextProcessor.PUNCTUATION_TABLE)
+
+    @staticmethod
+    def tokenize(text, stem=True):
+        """Split text into normalized, optionally stemmed, search tokens"""
+        if not text:
+            return []
+
+        normalized = ArabicTextProcessor.normalize_arabic(text)
+        normalized = ArabicTextProcessor.remove_punctuation(normalized)
+        tokens = normalized.split()
+
+        if stem:
+            return [ArabicTextProcessor.stem(token) for token in tokens]
+        return tokens
+
+    @staticmethod
+    def token_spans(text, stem=True):
+        """Tokenize like tokenize(), yielding (token, start, end) offsets into the original text"""
+        if not text:
+            return
+        
+        punctuation = ArabicTextProcessor.PUNCTUATION
+        tokens = {}
+        for match in ArabicTextProcessor.WORD_PATTERN.finditer(text):
+            word = match.group()
+            token = tokens.get(word)
+            if token is None:
+                # Words repeat a lot in legal text, so each distinct word is normalized once
+                token = ArabicTextProcessor.remove_punctuation(ArabicTextProcessor.normalize_arabic(word))
+                if token and stem:
+                    token = ArabicTextProcessor.stem(token)
+                tokens[word] = token
+            if not token:
+                continue
+            
+            # Leading and trailing punctuation stay outside the span
+            start, end = match.span()
+            yield (token,
+                   start + len(word) - len(word.lstrip(punctuation)),
+                   end - len(word) + len(word.rstrip(punctuation)))
     
+    @staticmethod
+    @lru_cache(maxsize=STEM_CACHE_SIZE)
+    def stem(token):
+        """Light-stem a normalized token: conjunction, article and common suffixes"""
+        # Conjunction و on longer words only, so short roots like ورد survive
+        if len(token) > 3 and token.startswith('و') and not token.startswith('وال'):
+            token = token[1:]
+
+        for prefix in ArabicTextProcessor.STEM_PREFIXES:
+            if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+                token = token[len(prefix):]
+                break
+
+        for suffix in ArabicTextProcessor.STEM_SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 2:
+                token = token[:-len(suffix)]
+
+        return token
+
     @staticmethod
     def extract_keywords(text, min_length=3, max_keywords=10):
         """Extract keywords from Arabic text"""
@@ -120,43 +192,147 @@ class ArabicTextProcessor:
         # Calculate fuzzy similarity
         return fuzz.ratio(norm1, norm2)
     
+    @staticmethod
+    def edit_distance(text1, text2):
+        """Levenshtein distance between two strings"""
+        if text1 == text2:
+            return 0
+        if len(text1) < len(text2):
+            text1, text2 = text2, text1
+        if not text2:
+            return len(text1)
+        
+        previous = list(range(len(text2) + 1))
+        for i, char1 in enumerate(text1, 1):
+            current = [i]
+            for j, char2 in enumerate(text2, 1):
+                current.append(min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char1 != char2)
+                ))
+            previous = current
+        
+        return previous[-1]
+    
     @staticmethod
     def fuzzy_search(query, text_list, threshold=60):
-        """Perform fuzzy search on a list of Arabic texts"""
+        """Perform fuzzy search on a list of Arabic texts.
+        
+        ``text_list`` may be a prebuilt FuzzyMatchIndex, which avoids
+        normalizing and indexing the candidates on every call.
+        """
         if not query or not text_list:
             return []
         
-        # Normalize query
-        normalized_query = ArabicTextProcessor.normalize_arabic(query)
+        if isinstance(text_list, FuzzyMatchIndex):
+            index = text_list
+        else:
+            index = FuzzyMatchIndex(text_list)
         
-        # Normalize text list
-        normalized_texts = [ArabicTextProcessor.normalize_arabic(text) for text in text_list]
+        return index.search(query, threshold)
+
+class FuzzyMatchIndex:
+    """BK-tree over normalized texts for threshold fuzzy matching.
+    
+    Scores are fuzz.ratio values (0-100) of the normalized texts. A
+    threshold is turned into an edit-distance radius, so a query only
+    compares against the tree nodes inside that radius.
+    """
+    
+    def __init__(self, texts=None):
+        self.texts = []
+        self.root = None
+        self.nodes = {}  # normalized text -> [normalized text, original indices, children by distance]
         
-        # Perform fuzzy matching
-        matches = process.extract(normalized_query, normalized_texts, limit=len(text_list))
+        for text in texts or []:
+            self.add(text)
+    
+    def __len__(self):
+        return len(self.texts)
+    
+    def __contains__(self, text):
+        return ArabicTextProcessor.normalize_arabic(text) in self.nodes
+    
+    def add(self, text):
+        """Add a text and return its index"""
+        index = len(self.texts)
+        self.texts.append(text)
         
-        # Filter by threshold and return with original indices
-        results = []
-        for match, score in matches:
-            if score >= threshold:
-                # Find original index
-                original_index = normalized_texts.index(match)
-                results.append({
-                    'text': text_list[original_index],
-                    'score': score,
-                    'index': original_index
-                })
+        normalized = ArabicTextProcessor.normalize_arabic(text)
+        if normalized in self.nodes:
+            self.nodes[normalized][1].append(index)
+            return index
+        
+        node = [normalized, [index], {}]
+        self.nodes[normalized] = node
+        
+        if self.root is None:
+            self.root = node
+            return index
+        
+        current = self.root
+        while True:
+            distance = ArabicTextProcessor.edit_distance(normalized, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                break
+            current = child
+        
+        return index
+    
+    @staticmethod
+    def max_distance(query_length, threshold):
+        """Largest edit distance a text can have and still reach the ratio threshold"""
+        # fuzz.ratio rounds to an integer, so allow half a point of slack
+        ratio = (min(threshold, 100) - 0.5) / 100.0
+        if ratio <= 0:
+            return None
+        return int(2 * query_length * (1 - ratio) / ratio)
+    
+    def search(self, query, threshold=60):
+        """Return texts scoring at least ``threshold``, best first, with original indices"""
+        if not query or self.root is None:
+            return []
+        
+        normalized_query = ArabicTextProcessor.normalize_arabic(query)
+        radius = self.max_distance(len(normalized_query), threshold)
         
+        results = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = ArabicTextProcessor.edit_distance(normalized_query, node[0])
+            
+            if radius is None or distance <= radius:
+                score = fuzz.ratio(normalized_query, node[0])
+                if score >= threshold:
+                    for index in node[1]:
+                        results.append({
+                            'text': self.texts[index],
+                            'score': score,
+                            'index': index
+                        })
+            
+            for child_distance, child in node[2].items():
+                if radius is None or distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        
+        results.sort(key=lambda match: (-match['score'], match['index']))
         return results
 
+# Column names accepted by SearchUtils.build_search_query
+SEARCH_FIELD_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
 class SearchUtils:
     """Search utility functions"""
     
     @staticmethod
     def build_search_query(terms, fields=None):
-        """Build a search query from search terms"""
+        """Build a parameterized WHERE clause and its bound values from search terms"""
         if not terms:
-            return ""
+            return "", {}
         
         # Default fields to search in
         if fields is None:
@@ -165,14 +341,19 @@ class SearchUtils:
         # Normalize search terms
         normalized_terms = [ArabicTextProcessor.normalize_arabic(term) for term in terms]
         
-        # Build query conditions
-        conditions = []
+        # Field names cannot be bound, so only plain identifiers are accepted
         for field in fields:
-            for term in normalized_terms:
-                if term:
-                    conditions.append(f"{field} LIKE '%{term}%'")
+            if not SEARCH_FIELD_PATTERN.match(field):
+                raise ValueError(f"Invalid search field: {field!r}")
         
-        return " OR ".join(conditions) if conditions else ""
+        # Terms are bound parameters, never interpolated into the SQL
+        params = {}
+        for term in normalized_terms:
+            if term:
+                params[f"term{len(params)}"] = f"%{term}%"
+        
+        conditions = [f"{field} LIKE :{name}" for field in fields for name in params]
+        return " OR ".join(conditions), params
     
     @staticmethod
     def highlight_matches(text, query, tag='mark'):
@@ -180,21 +361,127 @@ class SearchUtils:
         if not text or not query:
             return text
         
-        # Normalize query
-        normalized_query = ArabicTextProcessor.normalize_arabic(query)
-        query_words = normalized_query.split()
-        
-        highlighted_text = text
-        for word in query_words:
-            if word:
-                # Case-insensitive replacement
-                pattern = re.compile(re.escape(word), re.IGNORECASE)
-                highlighted_text = pattern.sub(
-                    f'<{tag}>\\g<0></{tag}>', 
-                    highlighted_text
-                )
-        
-        return highlighted_text
+        return SnippetBuilder(query, tag=tag, escape=False).highlight(text)
+
+class SnippetBuilder:
+    """Query-dependent snippets with highlighted matches.
+    
+    Matching runs on the tokenizer's normalized, stemmed tokens, so a
+    query highlights every spelling and affixed form it retrieves.
+    Offsets point into the original text, which is scanned once and
+    sliced once; only the snippet is returned.
+    """
+    
+    DEFAULT_LENGTH = 300
+    ELLIPSIS = '...'
+    WHITESPACE = re.compile(r'\s')
+    
+    def __init__(self, query=None, terms=None, length=DEFAULT_LENGTH, tag='mark', escape=True):
+        if terms is None:
+            terms = ArabicTextProcessor.tokenize(query) if query else []
+        self.terms = frozenset(terms)
+        self.length = length
+        self.tag = tag
+        self.escape = escape
+    
+    @classmethod
+    def for_texts(cls, texts, **kwargs):
+        """Builder matching the terms of several query clauses"""
+        terms = [term for text in texts for term in ArabicTextProcessor.tokenize(text)]
+        return cls(terms=terms, **kwargs)
+    
+    def matches(self, text):
+        """(start, end, token) of every query term occurrence, in text order"""
+        if not self.terms or not text:
+            return []
+        terms = self.terms
+        return [(start, end, token)
+                for token, start, end in ArabicTextProcessor.token_spans(text)
+                if token in terms]
+    
+    def best_window(self, matches):
+        """Span covering the most distinct terms, then the most matches, within the snippet length"""
+        best = None
+        best_score = (0, 0)
+        counts = {}
+        right = 0
+        for left, (start, _, _) in enumerate(matches):
+            # Grow the window while the next match still fits; it always holds its first match,
+            # even a token longer than the snippet
+            while right < len(matches) and (right == left or matches[right][1] - start <= self.length):
+                token = matches[right][2]
+                counts[token] = counts.get(token, 0) + 1
+                right += 1
+            
+            score = (len(counts), right - left)
+            if score > best_score:
+                best_score = score
+                best = (start, matches[right - 1][1])
+            
+            # Drop the left match before moving on
+            token = matches[left][2]
+            counts[token] -= 1
+            if not counts[token]:
+                del counts[token]
+        return best
+    
+    def snippet(self, text):
+        """Best-scoring window of the text with its matches highlighted"""
+        if not text:
+            return ""
+        
+        matches = self.matches(text)
+        window = self.best_window(matches) if matches else None
+        if window is None:
+            # No match: the opening of the text
+            start, end = 0, min(len(text), self.length)
+        else:
+            # Center the matched span in the snippet
+            match_start, match_end = window
+            start = max(0, match_start - (self.length - (match_end - match_start)) // 2)
+            end = min(len(text), start + self.length)
+            start = min(max(0, min(start, end - self.length)), match_start)
+            
+            # Do not cut the first and last words
+            if start > 0:
+                space = self.WHITESPACE.search(text, start, match_start)
+                if space:
+                    start = space.end()
+            end = max(end, match_end)
+        
+        if end < len(text):
+            space = text.rfind(' ', start, end)
+            if window is None and space > start:
+                end = space
+            elif window is not None and space >= window[1]:
+                end = space
+        
+        body = self.render(text, start, end, matches)
+        return ''.join((
+            self.ELLIPSIS if start > 0 else '',
+            ' '.join(body.split()),
+            self.ELLIPSIS if end < len(text) else ''
+        ))
+    
+    def highlight(self, text):
+        """The full text with every match highlighted"""
+        if not text:
+            return text
+        return self.render(text, 0, len(text), self.matches(text))
+    
+    def render(self, text, start, end, matches):
+        """Wrap the matches inside [start, end) in the highlight tag, in one pass"""
+        escape = html.escape if self.escape else str
+        pieces = []
+        position = start
+        for match_start, match_end, _ in matches:
+            if match_start < start or match_end > end:
+                continue
+            pieces.append(escape(text[position:match_start]))
+            pieces.append(f'<{self.tag}>{escape(text[match_start:match_end])}</{self.tag}>')
+            position = match_end
+        pieces.append(escape(text[position:end]))
+        return ''.join(pieces)
 
 class FileUtils:
     """File handling utilities"""
@@ -435,6 +722,8 @@ class ReportUtils:
 # Export all utility classes
 __all__ = [
     'ArabicTextProcessor',
+    'FuzzyMatchIndex',
+    'SnippetBuilder',
     'SearchUtils', 
     'FileUtils',
     'DateUtils',